@@ -1,8 +1,9 @@
 import sys
+import os
 import pandas as pd
-from aroa_etl.attribute_processing.string_utils import preprocess_name, preprocess_last_name
+from aroa_etl.person_matching.similarity_measures import add_parsed_date_columns
+from aroa_etl.person_matching.clustering_preprocessing import NA_VALUES, clean_na_values, add_processed_columns, group_multiple_names
 import pickle
-import copy
 from tqdm import tqdm
 from typing import Dict, List, Set
 
@@ -23,78 +24,41 @@ lsh_kwargs = {
 leave_one_out_hashing = False
 idx_chars = 4 # bucker parameter
 len_chars = 2
+max_bucket_size = None             # larger buckets are sub-blocked by birth year bands, None keeps all buckets
+checkpoint_every_seconds = 15 * 60 # the clustering state is saved regularly and resumed after a crash
+n_jobs = 1                         # > 1 clusters independent bucket components in parallel, e.g. os.cpu_count(), but without checkpoints
+sweep_cutoffs = None               # e.g. [80, 85, 90]: scores the candidate pairs once and reports a clustering per cutoff instead
 
 person_data = pd.read_csv(fname,sep="|")
 
-NA_VALUES = ["-1", "-1.0", "None", "", "NULL", "unbekannt", "unbekant", "-", "0", "0.0", "NA"]
-person_data = person_data.where(~person_data.fillna("").isin(NA_VALUES)).dropna(subset=["strLName", "strGName"])
-person_data = person_data.fillna("").astype(str)
+person_data = clean_na_values(person_data, NA_VALUES)
 
 #show(person_data)
 
 print("Preprocess data")
 
-person_data["strLName_processed"] = person_data["strLName"].apply(preprocess_last_name)
-person_data["strGName_processed"] = person_data["strGName"].apply(preprocess_name)
-person_data["strDoB_processed"] = person_data["strDoB"].fillna('00000000')
-person_data["strPoB_processed"] = person_data["strPoB"].apply(preprocess_name)
-person_data["prisoner_number"] = person_data["prisoner_number"].astype(str)
-person_data["prisoner_number"] = person_data["prisoner_number"].mask(person_data["prisoner_number"].isin(NA_VALUES))
+person_data = add_processed_columns(person_data, NA_VALUES)
 
 print("Group multiple names")
-agg_person_data = person_data.groupby(['lObjId', 'lCountId']).apply(lambda group: [" ".join(group["strGName_processed"].values),
-                                                                                   " ".join(group["strLName_processed"].values),
-                                                                                   group["strDoB_processed"].iloc[0],
-                                                                                   group["strPoB_processed"].iloc[0],
-                                                                                   group["prisoner_number"].iloc[0],
-                                                                                   group["TD_number"].iloc[0],
-                                                                                   group["prison"].iloc[0],
-                                                                                   group["lLNameType"].iloc[0],
-                                                                                   group["lGNamePos"].iloc[0],
-                                                                                   group["strGName"].iloc[0],
-                                                                                   group["strLName"].iloc[0],]
-                                                                    )
-
-person_data = pd.DataFrame(list(agg_person_data),columns=["strGName_processed","strLName_processed","strDoB_processed","strPoB_processed","prisoner_number","TD_number", "prison", "lLNameType", "lGNamePos", "strGName", "strLName"],index = agg_person_data.index)
-person_data = person_data.reset_index()
-from aroa_etl.person_matching.person_clustering import build_buckets, get_buckets_for_name
+person_data = group_multiple_names(person_data)
+person_data = add_parsed_date_columns(person_data, "strDoB_processed")
+from aroa_etl.person_matching.person_clustering import BucketCandidates, build_name_pair_bucket_index
+from aroa_etl.person_matching.disjoint_set import DisjointSet
 
 print("start building buckets")
 # lsh, minhashes = local_semantic_hashing(person_data,minhash_kwargs,lsh_kwargs,leave_one_out_hashing)
 # get_bucket_fn = lambda person_idx: lsh.query(minhashes[person_idx])
 
-first_name_buckets = build_buckets(person_data, column="strGName_processed", idx_chars=idx_chars,len_chars=len_chars)
-last_name_buckets = build_buckets(person_data, column="strLName_processed", idx_chars=idx_chars,len_chars=len_chars)
-
-def build_get_bucket_fn():
-    _person_data = person_data.copy()
-    def get_bucket_fn(person_idx):
-        fname_buckets = get_buckets_for_name(_person_data["strGName_processed"][person_idx],idx_chars)
-        lname_buckets = get_buckets_for_name(_person_data["strLName_processed"][person_idx],idx_chars)
-        first_bucket = set()
-        for fbucket in fname_buckets:
-            first_bucket = first_bucket.union(first_name_buckets[fbucket])
-        last_bucket = set()
-        for lbucket in lname_buckets:
-            last_bucket = last_bucket.union(last_name_buckets[lbucket])
-        return first_bucket.intersection(last_bucket)
-    return get_bucket_fn
+# first name and last name bucket indices, candidates are the intersection of both buckets
+get_bucket_fn = BucketCandidates(person_data, idx_chars=idx_chars, max_bucket_size=max_bucket_size)
 
 def merge_clusterings(clustering1: List[Set], clustering2: List[Set]):
-    cluster = copy.deepcopy(clustering1)
-    merged_clusters = True
-    while merged_clusters:
-        merged_clusteres = False
-        for idx in tqdm(range(len(cluster)), total=len(cluster)):
-            for cl in clustering1:
-                if len(cluster[idx].intersection(cl)) > 0 and not cl.issubset(cluster[idx]):
-                    cluster[idx].update(td_cl)
-                    merged_clusters = True
-            for cl in clustering2:
-                if len(cluster[idx].intersection(cl)) > 0 and not cl.issubset(cluster[idx]):
-                    cluster[idx].update(cl)
-                    merged_clusters = True      
-    return cluster
+    clusters = [*clustering1, *clustering2]
+    elements = list({idx for cl in clusters for idx in cl})
+    element_pos = {idx: pos for pos, idx in enumerate(elements)}
+    disjoint_set = DisjointSet(len(elements))
+    disjoint_set.union_clusters([element_pos[idx] for idx in cl] for cl in clusters)
+    return [{elements[pos] for pos in cluster} for cluster in disjoint_set.clusters()]
 
 
 print("Compute known Clusters")
@@ -109,16 +73,48 @@ pnum_clusters = [set(group.index) for _, group in pnum_clusters]
 clusters = pnum_clusters
 cluster_map = { idx : list(cl) for cl in clusters for idx in cl }
 
-from aroa_etl.person_matching.person_clustering import agglomerative_clustering, cluster_column, clean_td_cases
+from aroa_etl.person_matching.person_clustering import agglomerative_clustering, parallel_agglomerative_clustering, cluster_column, clean_td_cases
+
+if sweep_cutoffs is not None:
+    from aroa_etl.person_matching.similarity_graph import SimilarityGraph, edges_match, score_candidate_edges
+    from aroa_etl.person_matching.threshold_sweep import threshold_sweep
+    from aroa_etl.person_matching.person_clustering import clustering_fingerprint
+    sweepname = f"{fname.split('.')[0]}_sweep_linkage_{linkage}"
+    # the scores do not depend on the linkage, the edges are reused while the data and blocking are unchanged
+    edge_path = f"{fname.split('.')[0]}_sweep_edges"
+    edge_metadata = {"fingerprint": clustering_fingerprint(person_data),
+                     "blocking": {"idx_chars": idx_chars, "len_chars": get_bucket_fn.len_chars, "max_bucket_size": max_bucket_size}}
+    if not edges_match(edge_path, edge_metadata):
+        print("Score candidate edges")
+        score_candidate_edges(person_data, get_bucket_fn, edge_path, metadata=edge_metadata)
+    graph = SimilarityGraph.load(edge_path, num_rows=person_data.shape[0])
+    print(f"Sweep {graph.num_edges} edges")
+    known_clusters = [person_data.index.get_indexer(list(cl)) for cl in clusters]
+    report, sweep_clusterings = threshold_sweep(graph, sweep_cutoffs, linkage, known_clusters)
+    print(report.to_string())
+    report.to_csv(f"{sweepname}_report.csv", index=False)
+    for sweep_cutoff, labels in sweep_clusterings.items():
+        person_data[f"Person_Entity_ID_cutoff_{sweep_cutoff}"] = labels
+    person_data.to_csv(f"{sweepname}.csv")
+    sys.exit(0)
+
 print("start clustering")
 
-clustering = agglomerative_clustering(build_get_bucket_fn(), cluster_map, person_data, cutoff, linkage, iteration)
+outname = fname.split(".")
+outname = f"{outname[0]}_with_clusters_{iteration}_linkage_{linkage}_cutoff_{cutoff}"
+checkpoint_path = f"{outname}_checkpoint.npz"
+if n_jobs > 1:
+    name_pair_buckets = build_name_pair_bucket_index(person_data, idx_chars=idx_chars)
+    clustering = parallel_agglomerative_clustering(get_bucket_fn, cluster_map, person_data, cutoff, linkage, iteration,
+                                                   buckets=[name_pair_buckets], n_jobs=n_jobs)
+else:
+    clustering = agglomerative_clustering(get_bucket_fn, cluster_map, person_data, cutoff, linkage, iteration,
+                                          checkpoint_path=checkpoint_path, checkpoint_every_seconds=checkpoint_every_seconds,
+                                          resume_from=checkpoint_path if os.path.exists(checkpoint_path) else None)
 
 print("Add Person Entity ID")
 person_data["Person_Entity_ID"] = cluster_column(person_data, clustering)
 
-outname = fname.split(".")
-outname = f"{outname[0]}_with_clusters_{iteration}_linkage_{linkage}_cutoff_{cutoff}"
 person_data.to_csv(f"{outname}.csv")
 person_data.to_pickle(f"{outname}.pkl")
 
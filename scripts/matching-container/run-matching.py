@@ -5,6 +5,7 @@ from aroa_etl.attribute_processing.string_utils import preprocess_name, preproce
 from aroa_etl.person_matching.matching import person_matching
 import sys
 from aroa_etl.utils import value_is_not_empty_q
+from aroa_etl.person_matching.similarity_measures import add_parsed_date_columns
 import os
 
 external_fname = sys.argv[1]
@@ -15,6 +16,7 @@ def preprocess_persdata(persdata: DataFrame):
     persdata["strGName_processed"] = persdata["strGName"].fillna("").apply(preprocess_name)
     persdata["strDoB_processed"] = persdata["strDoB"].fillna('00000000').astype(str).str.replace(r'^[^\d]*$', '00000000', regex=True)
     persdata["prisoner_number"] = persdata["strPrisNo"]
+    persdata = add_parsed_date_columns(persdata, "strDoB_processed")
     #persdata = persdata[["lObjId", "lCountId","strGName","strLName", "strGName_processed","strLName_processed","strDoB_processed","prisoner_number", "TDNumber"]]
     agg_functions = {
         "strGName_processed": lambda values: " ".join(list(v for v in set(values) if value_is_not_empty_q(v))),
@@ -39,6 +41,7 @@ external["geburt_jahr"] = external["geburt_jahr"].astype(str).fillna("0000").str
 external["geburt_monat"] = external["geburt_monat"].astype(str).fillna("00").str.replace(r"^0$","00",regex=True).apply(lambda m: "0"*(2-len(m)) + m)
 external["geburt_tag"] = external["geburt_tag"].astype(str).fillna("00").str.replace(r"^0$","00",regex=True).apply(lambda d: "0"*(2-len(d)) + d)
 external["strDoB_processed"] = external["geburt_jahr"] + external["geburt_monat"] + external["geburt_tag"]
+external = add_parsed_date_columns(external, "strDoB_processed")
 external["strLName_processed"] = external["nachname"].fillna("").apply(preprocess_last_name)
 external["strGName_processed"] = external["vorname"].fillna("").apply(preprocess_name)
 #external["DateOfBirth"] = external["DateOfBirth"].astype(str).str.replace(r'^[^\d]*$', '00000000', regex=True)
@@ -50,7 +53,8 @@ matchings_df = person_matching(external, persdata, allow_duplicates=True,
                     src_lname_col="strLName_processed", target_lname_col="strLName_processed",
                     src_date_col="strDoB_processed", target_date_col="strDoB_processed",
                     trg_pre_clustering_on_n_chars=2, trg_pre_clustering_group_n_len_units=4, 
-                    top_n_matches = 10, min_match_score=80.0, name_only=False)
+                    top_n_matches = 10, min_match_score=80.0, name_only=False, n_jobs=os.cpu_count(),
+                    trg_index_dir="/persdata/blocking_index")
 
 # cleanup match columns
 persdata = persdata.drop(["strGName_processed", "strLName_processed"],axis=1)
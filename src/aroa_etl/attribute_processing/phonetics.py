@@ -0,0 +1,83 @@
+import re
+import jellyfish
+import pandas as pd
+
+# ------------------------- Phonetic Encoders ---------------------------------
+
+_koelner_codes = {
+    **{c: "0" for c in "aeijouyäöü"},
+    "b": "1", "f": "3", "v": "3", "w": "3",
+    "g": "4", "k": "4", "q": "4",
+    "l": "5", "m": "6", "n": "6", "r": "7",
+    "s": "8", "z": "8", "ß": "8",
+}
+
+def _koelner_char_code(word: str, i: int) -> str:
+    char = word[i]
+    prev_char = word[i-1] if i > 0 else ""
+    next_char = word[i+1] if i + 1 < len(word) else ""
+    if char == "h":
+        return ""
+    if char == "p":
+        return "3" if next_char == "h" else "1"
+    if char in "dt":
+        return "8" if next_char in ("c", "s", "z", "ß") and next_char != "" else "2"
+    if char == "c":
+        if i == 0:
+            return "4" if next_char != "" and next_char in "ahkloqrux" else "8"
+        return "4" if next_char != "" and next_char in "ahkoqux" and prev_char not in ("s", "z", "ß") else "8"
+    if char == "x":
+        return "8" if prev_char != "" and prev_char in "ckq" else "48"
+    return _koelner_codes.get(char, "")
+
+def koelner_phonetik_word(word: str) -> str:
+    """
+        Kölner Phonetik code of a single word. Characters that are not letters are ignored.
+    """
+    word = re.sub(r"[^a-zäöüß]", "", word.lower())
+    code = "".join(_koelner_char_code(word, i) for i in range(len(word)))
+    # merge repeated codes and drop zeros after the first position
+    code = re.sub(r"(.)\1+", r"\1", code)
+    return code[:1] + code[1:].replace("0", "")
+
+def koelner_phonetik(name: str) -> str:
+    """
+        Kölner Phonetik of every sub-name of `name`, separated by spaces. Suited for German names.
+    """
+    return " ".join(code for code in (koelner_phonetik_word(sub_name) for sub_name in str(name).split(" ")) if code != "")
+
+def metaphone(name: str) -> str:
+    """
+        Metaphone of every sub-name of `name`, separated by spaces.
+    """
+    return " ".join(code for code in (jellyfish.metaphone(sub_name) for sub_name in str(name).split(" ") if sub_name != "") if code != "")
+
+PHONETIC_ENCODERS = {"koelner": koelner_phonetik, "metaphone": metaphone}
+
+def phonetic_codes(names: pd.core.series.Series, encoder: str = "koelner") -> pd.core.series.Series:
+    """
+        Phonetic codes of all `names` with the encoder `encoder` of `PHONETIC_ENCODERS`. Every distinct name is encoded once.
+    """
+    encode = PHONETIC_ENCODERS[encoder]
+    names = names.fillna("").astype(str)
+    return names.map({name: encode(name) for name in pd.unique(names)})
+
+def phonetic_bucket_keys(name: str, encoder: str = "koelner") -> list[tuple[str, int]]:
+    """
+        Bucket keys of `name` for the `phonetic_encoder` option of the bucket indices: the whole code of every sub-name
+        with length class 0, since a prefix or the length of a code does not separate names.
+    """
+    return [(code, 0) for code in PHONETIC_ENCODERS[encoder](name).split(" ") if code != ""]
+
+def phonetic_column(column: str, encoder: str = "koelner") -> str:
+    return f"{column}_{encoder}"
+
+def add_phonetic_columns(person_data: pd.core.frame.DataFrame, columns=("strGName_processed", "strLName_processed"),
+                         encoder: str = "koelner") -> pd.core.frame.DataFrame:
+    """
+        Encodes `columns` once and stores the codes next to them (see `phonetic_column`). The `PhoneticBlocker` uses
+        the code columns. The bucket indices encode the names themselves (see `phonetic_bucket_keys`).
+    """
+    for column in columns:
+        person_data[phonetic_column(column, encoder)] = phonetic_codes(person_data[column], encoder)
+    return person_data
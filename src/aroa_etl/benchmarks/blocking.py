@@ -0,0 +1,96 @@
+import argparse
+import json
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from aroa_etl.benchmarks.synthetic import synthetic_persons, true_pairs
+from aroa_etl.person_matching.blockers import SortedNeighborhoodBlocker, PhoneticBlocker, LSHBlocker
+from aroa_etl.person_matching.matching import PrefixBucketBlocker
+from aroa_etl.person_matching.person_clustering import BucketCandidates
+
+# ------------------------- Blocking Benchmark ---------------------------------
+
+# blocker configurations: name -> function that builds the fitted blocker for a frame
+DEFAULT_CONFIGS = {
+    "prefix_n_chars_2": lambda persons: PrefixBucketBlocker(trg_pre_clustering_on_n_chars=2).fit(persons),
+    "prefix_n_chars_3": lambda persons: PrefixBucketBlocker(trg_pre_clustering_on_n_chars=3).fit(persons),
+    "buckets_idx_chars_3": lambda persons: BucketCandidates(persons, idx_chars=3, len_chars=3),
+    "buckets_idx_chars_4": lambda persons: BucketCandidates(persons, idx_chars=4, len_chars=3),
+    "sorted_neighborhood_10": lambda persons: SortedNeighborhoodBlocker(window=10).fit(persons),
+    "sorted_neighborhood_koelner_10": lambda persons: SortedNeighborhoodBlocker(sort_keys=("koelner", "reversed_name"), window=10).fit(persons),
+    "koelner": lambda persons: PhoneticBlocker("koelner").fit(persons),
+    "metaphone": lambda persons: PhoneticBlocker("metaphone").fit(persons),
+    "lsh_threshold_0.5_num_perm_32": lambda persons: LSHBlocker({"num_perm": 32}, {"threshold": 0.5, "num_perm": 32}).fit(persons),
+}
+
+def candidate_pairs(blocker, persons: pd.core.frame.DataFrame) -> np.ndarray:
+    """
+        All distinct unordered pairs (i, j), i < j, of positions in `persons` that `blocker` makes candidates,
+        coded as i * len(persons) + j.
+    """
+    num_rows = persons.shape[0]
+    pair_codes = []
+    for pos, positions in enumerate(blocker.candidate_positions(persons)):
+        positions = np.asarray(positions, dtype=np.int64)
+        positions = positions[positions != pos]
+        pair_codes.append(np.minimum(positions, pos) * num_rows + np.maximum(positions, pos))
+    return np.unique(np.concatenate(pair_codes)) if len(pair_codes) > 0 else np.zeros(0, dtype=np.int64)
+
+def benchmark_blocker(name: str, build_blocker, persons: pd.core.frame.DataFrame, measure_memory: bool = True) -> dict:
+    """
+        Builds the blocker with `build_blocker` on `persons` and queries the candidates of every record.
+        Reports build and query time, the candidate pairs, the pair reduction ratio against all pairs, the recall of
+        the true pairs (same `entity_id`) and, with `measure_memory`, the peak of traced memory in a second run.
+    """
+    num_rows = persons.shape[0]
+    start = time.perf_counter()
+    blocker = build_blocker(persons)
+    build_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    pairs = candidate_pairs(blocker, persons)
+    query_seconds = time.perf_counter() - start
+    entity_ids = persons["entity_id"].to_numpy()
+    found_true_pairs = int((entity_ids[pairs // num_rows] == entity_ids[pairs % num_rows]).sum())
+    all_pairs = num_rows * (num_rows - 1) // 2
+    report = {
+        "blocker": name, "rows": num_rows, "build_seconds": build_seconds, "query_seconds": query_seconds,
+        "candidate_pairs": int(pairs.shape[0]), "all_pairs": all_pairs,
+        "pair_reduction_ratio": 1 - pairs.shape[0] / all_pairs if all_pairs > 0 else 0.0,
+        "true_pairs": true_pairs(entity_ids), "found_true_pairs": found_true_pairs,
+        "recall": found_true_pairs / true_pairs(entity_ids) if true_pairs(entity_ids) > 0 else 1.0,
+    }
+    if measure_memory:
+        tracemalloc.start()
+        try:
+            candidate_pairs(build_blocker(persons), persons)
+            report["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return report
+
+def run_blocking_benchmark(configs: dict = None, n_entities: int = 2000, seed: int = 0, measure_memory: bool = True,
+                           output: str = None, **synthetic_kwargs) -> list[dict]:
+    """
+        Benchmarks every blocker configuration of `configs` (default `DEFAULT_CONFIGS`) on synthetic records of
+        `n_entities` persons (see `synthetic_persons`). Returns one report per configuration and writes them as JSON to `output`.
+    """
+    configs = DEFAULT_CONFIGS if configs is None else configs
+    persons = synthetic_persons(n_entities, seed=seed, **synthetic_kwargs)
+    reports = [benchmark_blocker(name, build_blocker, persons, measure_memory) for name, build_blocker in configs.items()]
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump({"n_entities": n_entities, "seed": seed, "reports": reports}, f, indent=2)
+    return reports
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall and pair reduction of the blocking strategies on synthetic person records")
+    parser.add_argument("--entities", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--configs", nargs="*", default=None, help=f"subset of {list(DEFAULT_CONFIGS)}")
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced memory run")
+    parser.add_argument("--output", default="blocking_benchmark.json")
+    args = parser.parse_args()
+    configs = DEFAULT_CONFIGS if args.configs is None else {name: DEFAULT_CONFIGS[name] for name in args.configs}
+    for report in run_blocking_benchmark(configs, args.entities, args.seed, not args.no_memory, args.output):
+        print(json.dumps(report))
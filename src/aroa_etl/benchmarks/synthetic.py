@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+from aroa_etl.attribute_processing.string_utils import preprocess_name, preprocess_last_name
+
+# ------------------------- Synthetic Person Records ---------------------------------
+
+FIRST_NAMES = [
+    "hans", "karl", "heinrich", "wilhelm", "friedrich", "otto", "walter", "jürgen", "günther", "josef",
+    "johann", "franz", "peter", "paul", "stefan", "jan", "piotr", "stanisław", "józef", "władysław",
+    "anna", "maria", "marie", "elisabeth", "margarete", "gertrud", "käthe", "hildegard", "ursula", "helene",
+    "zofia", "katarzyna", "jadwiga", "helena", "irena", "olga", "tatjana", "ivan", "nikolai", "sergej",
+]
+
+LAST_NAMES = [
+    "müller", "schmidt", "schneider", "fischer", "weber", "meyer", "wagner", "becker", "schulz", "hoffmann",
+    "schäfer", "koch", "bauer", "richter", "klein", "wolf", "schröder", "neumann", "schwarz", "zimmermann",
+    "braun", "krüger", "hofmann", "hartmann", "lange", "schmitt", "werner", "schmitz", "krause", "meier",
+    "lehmann", "schmid", "schulze", "maier", "köhler", "herrmann", "könig", "walter", "mayer", "huber",
+    "kowalski", "nowak", "wiśniewski", "wójcik", "kowalczyk", "kamiński", "lewandowski", "zieliński", "szymański", "woźniak",
+    "dąbrowski", "kozłowski", "jankowski", "mazur", "kwiatkowski", "krawczyk", "piotrowski", "grabowski", "nowakowski", "pawłowski",
+    "ivanov", "smirnov", "kuznetsov", "popov", "sokolov", "lebedev", "kozlov", "novikov", "morozov", "petrov",
+]
+
+_umlaut_variants = {"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss", "ae": "ä", "oe": "ö", "ue": "ü"}
+_alphabet = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+
+def typo(name: str, rng: np.random.Generator) -> str:
+    """
+        One random substitution, deletion, insertion or transposition of characters in `name`.
+    """
+    if len(name) < 2:
+        return name
+    pos = int(rng.integers(0, len(name) - 1))
+    kind = rng.integers(0, 4)
+    if kind == 0:
+        return name[:pos] + rng.choice(_alphabet) + name[pos+1:]
+    elif kind == 1:
+        return name[:pos] + name[pos+1:]
+    elif kind == 2:
+        return name[:pos] + rng.choice(_alphabet) + name[pos:]
+    return name[:pos] + name[pos+1] + name[pos] + name[pos+2:]
+
+def umlaut_variant(name: str) -> str:
+    """
+        Writes the umlauts of `name` as digraphs and the other way round, e.g. müller <-> mueller.
+    """
+    for umlaut, variant in _umlaut_variants.items():
+        if umlaut in name:
+            return name.replace(umlaut, variant)
+    return name
+
+def swap_date(date: str, rng: np.random.Generator) -> str:
+    """
+        Swaps day and month of a YYYYMMDD date if possible, otherwise writes it in DD.MM.YYYY format.
+    """
+    year, month, day = date[:4], date[4:6], date[6:]
+    if int(day) <= 12 and rng.random() < 0.5:
+        return f"{year}{day}{month}"
+    return f"{day}.{month}.{year}"
+
+def synthetic_persons(n_entities: int, max_records_per_entity: int = 3, typo_rate: float = 0.2, umlaut_rate: float = 0.2,
+                      date_swap_rate: float = 0.1, seed: int = 0) -> pd.core.frame.DataFrame:
+    """
+        Synthetic person records of `n_entities` persons with 1 to `max_records_per_entity` records each.
+        The first record of a person holds its true names and birth date, every further record has a typo in a name with
+        `typo_rate`, umlaut variants of the names with `umlaut_rate` and a swapped birth date with `date_swap_rate`.
+        The records have the raw columns strGName, strLName, strDoB, the processed columns of the matching
+        (`preprocess_name` and `preprocess_last_name` rules) and the `entity_id` of the true person.
+    """
+    rng = np.random.default_rng(seed)
+    gnames = rng.choice(FIRST_NAMES, n_entities)
+    lnames = rng.choice(LAST_NAMES, n_entities)
+    birth_days = pd.Timestamp("1880-01-01") + pd.to_timedelta(rng.integers(0, 365 * 50, n_entities), unit="D")
+    dobs = birth_days.strftime("%Y%m%d").to_numpy()
+    records_per_entity = rng.integers(1, max_records_per_entity + 1, n_entities)
+    records = []
+    for entity_id in range(n_entities):
+        for record_nr in range(records_per_entity[entity_id]):
+            gname, lname, dob = str(gnames[entity_id]), str(lnames[entity_id]), str(dobs[entity_id])
+            if record_nr > 0:
+                if rng.random() < typo_rate:
+                    if rng.random() < 0.5:
+                        gname = typo(gname, rng)
+                    else:
+                        lname = typo(lname, rng)
+                if rng.random() < umlaut_rate:
+                    gname, lname = umlaut_variant(gname), umlaut_variant(lname)
+                if rng.random() < date_swap_rate:
+                    dob = swap_date(dob, rng)
+            records.append((entity_id, gname, lname, dob))
+    persons = pd.DataFrame(records, columns=["entity_id", "strGName", "strLName", "strDoB"])
+    persons["strGName_processed"] = persons["strGName"].map({name: preprocess_name(name) for name in pd.unique(persons["strGName"])})
+    persons["strLName_processed"] = persons["strLName"].map({name: preprocess_last_name(name) for name in pd.unique(persons["strLName"])})
+    persons["strDoB_processed"] = persons["strDoB"]
+    return persons
+
+def true_pairs(entity_ids: np.ndarray) -> int:
+    """
+        Number of record pairs that belong to the same entity.
+    """
+    counts = np.unique(entity_ids, return_counts=True)[1].astype(np.int64)
+    return int((counts * (counts - 1) // 2).sum())
+
+# ------------------------- Synthetic PersData ---------------------------------
+
+PLACES = ["berlin", "hamburg", "münchen", "köln", "frankfurt", "dresden", "leipzig", "warszawa", "kraków", "łódź",
+          "wrocław", "poznań", "lwów", "kiew", "minsk", "praha", "wien", "budapest", "amsterdam", "paris"]
+
+def synthetic_persdata(n_rows: int, entity_ratio: float = 0.5, second_name_rate: float = 0.1, typo_rate: float = 0.2,
+                       umlaut_rate: float = 0.2, date_swap_rate: float = 0.1, na_rate: float = 0.05, seed: int = 0) -> pd.core.frame.DataFrame:
+    """
+        A frame shaped like the PersData export with about `n_rows` rows of `entity_ratio * n_rows` true persons.
+        Records of a person are varied like in `synthetic_persons`, `second_name_rate` of the records have a second
+        given name in an additional row with the same lObjId and lCountId. `na_rate` of the values are NA markers.
+        Generated with vectorized operations, so it scales to millions of rows.
+    """
+    rng = np.random.default_rng(seed)
+    n_entities = max(1, int(n_rows * entity_ratio))
+    n_records = max(1, int(round(n_rows / (1 + second_name_rate))))
+    entity_ids = rng.integers(0, n_entities, n_records)
+    gnames = pd.Series(np.asarray(FIRST_NAMES, dtype=object)[rng.integers(0, len(FIRST_NAMES), n_entities)][entity_ids])
+    lnames = pd.Series(np.asarray(LAST_NAMES, dtype=object)[rng.integers(0, len(LAST_NAMES), n_entities)][entity_ids])
+    birth_days = pd.Timestamp("1880-01-01") + pd.to_timedelta(rng.integers(0, 365 * 50, n_entities), unit="D")
+    dobs = pd.Series(birth_days.strftime("%Y%m%d").to_numpy()[entity_ids])
+    # variants of the records
+    typo_q = rng.random(n_records) < typo_rate
+    typo_gname_q = typo_q & (rng.random(n_records) < 0.5)
+    gnames[typo_gname_q] = [typo(name, rng) for name in gnames[typo_gname_q]]
+    lnames[typo_q & ~typo_gname_q] = [typo(name, rng) for name in lnames[typo_q & ~typo_gname_q]]
+    umlaut_q = rng.random(n_records) < umlaut_rate
+    gnames[umlaut_q] = gnames[umlaut_q].map(umlaut_variant)
+    lnames[umlaut_q] = lnames[umlaut_q].map(umlaut_variant)
+    swap_q = rng.random(n_records) < date_swap_rate
+    dobs[swap_q] = dobs[swap_q].str[6:8] + "." + dobs[swap_q].str[4:6] + "." + dobs[swap_q].str[:4]
+    prisoner_numbers = pd.Series(np.where(rng.random(n_entities) < 0.3, rng.integers(1, 200000, n_entities).astype(str), "")[entity_ids])
+    persdata = pd.DataFrame({
+        "lObjId": rng.integers(1, 10**9, n_records).astype(str),
+        "lCountId": np.arange(n_records).astype(str),
+        "strLName": lnames, "strGName": gnames, "strDoB": dobs,
+        "strPoB": np.asarray(PLACES, dtype=object)[rng.integers(0, len(PLACES), n_entities)][entity_ids],
+        "prisoner_number": prisoner_numbers,
+        "TD_number": np.where(rng.random(n_records) < 0.1, rng.integers(1, 10**6, n_records).astype(str), ""),
+        "prison": np.asarray(["dachau", "buchenwald", "sachsenhausen", "auschwitz", "ravensbrück"], dtype=object)[rng.integers(0, 5, n_records)],
+        "lLNameType": "1", "lGNamePos": "1", "entity_id": entity_ids,
+    })
+    # second given names as additional rows
+    second_names = persdata.loc[rng.random(n_records) < second_name_rate].copy()
+    second_names["strGName"] = np.asarray(FIRST_NAMES, dtype=object)[rng.integers(0, len(FIRST_NAMES), second_names.shape[0])]
+    second_names["lGNamePos"] = "2"
+    persdata = pd.concat([persdata, second_names]).sort_values(["lCountId", "lGNamePos"], kind="stable").reset_index(drop=True)
+    # na markers
+    for column in ["strDoB", "strPoB", "prisoner_number"]:
+        na_q = rng.random(persdata.shape[0]) < na_rate
+        persdata.loc[na_q, column] = rng.choice(["-1", "unbekannt", "NULL", "0"], int(na_q.sum()))
+    return persdata
+
+def synthetic_external_list(persdata: pd.core.frame.DataFrame, n_rows: int, typo_rate: float = 0.2, seed: int = 0) -> pd.core.frame.DataFrame:
+    """
+        An external person list for matching against `persdata`: `n_rows` records of persons in `persdata` with
+        typos in the names. Has the processed columns of the matching and the `entity_id` of the true person.
+    """
+    rng = np.random.default_rng(seed)
+    first_rows = persdata.loc[persdata["lGNamePos"] == "1"]
+    external = first_rows.iloc[rng.integers(0, first_rows.shape[0], n_rows)][["strGName", "strLName", "strDoB", "strPoB", "prisoner_number", "entity_id"]]
+    external = external.reset_index(drop=True)
+    typo_q = rng.random(n_rows) < typo_rate
+    external.loc[typo_q, "strLName"] = [typo(name, rng) for name in external.loc[typo_q, "strLName"]]
+    external["strGName_processed"] = external["strGName"].map({name: preprocess_name(name) for name in pd.unique(external["strGName"])})
+    external["strLName_processed"] = external["strLName"].map({name: preprocess_last_name(name) for name in pd.unique(external["strLName"])})
+    external["strDoB_processed"] = external["strDoB"]
+    external["strPoB_processed"] = external["strPoB"].map({name: preprocess_name(name) for name in pd.unique(external["strPoB"])})
+    return external
@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import pandas as pd
+from aroa_etl.benchmarks.synthetic import synthetic_persdata, synthetic_external_list
+from aroa_etl.person_matching.clustering_preprocessing import clean_na_values, add_processed_columns, group_multiple_names
+from aroa_etl.person_matching.similarity_measures import add_parsed_date_columns
+from aroa_etl.person_matching.matching import person_matching
+from aroa_etl.person_matching.person_clustering import BucketCandidates, agglomerative_clustering
+
+# ------------------------- End-to-End Throughput Benchmark ---------------------------------
+
+STAGES = ["clean_na_values", "add_processed_columns", "group_multiple_names", "add_parsed_date_columns",
+          "person_matching", "build_buckets", "agglomerative_clustering"]
+
+def peak_rss_bytes() -> int:
+    """
+        Peak resident set size of this process and its finished child processes (e.g. matching workers) over their
+        whole lifetime. Stages after the largest one report the same value, see `StageMemorySampler` for a stage.
+    """
+    # ru_maxrss is in kilobytes on linux and in bytes on macos
+    unit = 1 if sys.platform == "darwin" else 1024
+    return unit * max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+def current_rss_bytes() -> "int | None":
+    """
+        Current resident set size of this process from /proc (linux), None if it is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+class StageMemorySampler():
+    """
+        Samples the resident set size of this process every `interval` seconds in a background thread while a stage
+        runs. `peak_rss` is the highest sample, `start_rss` the size before the stage. Short peaks between two samples
+        and the memory of child processes are not seen. Without /proc, all sizes are None.
+    """
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.start_rss = self.peak_rss = None
+        self._stop = threading.Event()
+
+    def _sample(self):
+        rss = current_rss_bytes()
+        if rss is not None:
+            self.peak_rss = rss if self.peak_rss is None else max(self.peak_rss, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self.start_rss = self.peak_rss = current_rss_bytes()
+        if self.start_rss is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start_rss is not None:
+            self._stop.set()
+            self._thread.join()
+            self._sample()
+
+    @property
+    def rss_increase(self) -> "int | None":
+        return None if self.start_rss is None else self.peak_rss - self.start_rss
+
+def _timed(stage: str, rows: int, fn, *args, **kwargs):
+    with StageMemorySampler() as memory:
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        seconds = time.perf_counter() - start
+    report = {"stage": stage, "rows": rows, "seconds": seconds, "rows_per_second": rows / seconds if seconds > 0 else float("inf"),
+              "rss_before_bytes": memory.start_rss, "stage_peak_rss_bytes": memory.peak_rss,
+              "stage_rss_increase_bytes": memory.rss_increase, "peak_rss_bytes": peak_rss_bytes()}
+    return result, report
+
+def benchmark_scale(n_rows: int, n_external_rows: int = None, stages=STAGES, seed: int = 0, matching_kwargs: dict = {},
+                    clustering_kwargs: dict = {"cutoff": 85, "linkage": "max", "iteration": "fast"}, idx_chars: int = 4) -> list[dict]:
+    """
+        Runs the clustering-script preprocessing, the matching of an external list and the clustering on a synthetic
+        PersData frame of `n_rows` rows (see `synthetic_persdata`) and times `stages` one by one.
+        The external list has `n_external_rows` rows (default a tenth of `n_rows`). Every report has the rows of the
+        stage, the time, rows per second, the RSS before the stage, the peak RSS during the stage and its increase
+        (see `StageMemorySampler`) and the peak RSS of the process so far.
+        Preprocessing stages that are not selected still run untimed, the later stages need their output.
+    """
+    n_external_rows = max(1, n_rows // 10) if n_external_rows is None else n_external_rows
+    person_data = synthetic_persdata(n_rows, seed=seed)
+    external = synthetic_external_list(person_data, n_external_rows, seed=seed) if "person_matching" in stages else None
+    reports = []
+    def run(stage, rows, fn, *args, **kwargs):
+        if stage not in stages:
+            return fn(*args, **kwargs)
+        result, report = _timed(stage, rows, fn, *args, **kwargs)
+        reports.append({"scale": n_rows, **report})
+        return result
+    person_data = run("clean_na_values", person_data.shape[0], clean_na_values, person_data)
+    person_data = run("add_processed_columns", person_data.shape[0], add_processed_columns, person_data)
+    person_data = run("group_multiple_names", person_data.shape[0], group_multiple_names, person_data)
+    person_data = run("add_parsed_date_columns", person_data.shape[0], add_parsed_date_columns, person_data, "strDoB_processed")
+    if "person_matching" in stages:
+        run("person_matching", external.shape[0], person_matching, external, person_data, **matching_kwargs)
+    if "build_buckets" in stages or "agglomerative_clustering" in stages:
+        get_bucket_fn = run("build_buckets", person_data.shape[0], BucketCandidates, person_data, idx_chars=idx_chars)
+        if "agglomerative_clustering" in stages:
+            run("agglomerative_clustering", person_data.shape[0], agglomerative_clustering, get_bucket_fn, {}, person_data,
+                verbose=False, **clustering_kwargs)
+    return reports
+
+def run_throughput_benchmark(scales=(10000,), stages=STAGES, seed: int = 0, output: str = None, **kwargs) -> list[dict]:
+    """
+        `benchmark_scale` for every number of rows in `scales`. Returns all reports and writes them as JSON to `output`.
+    """
+    unknown_stages = set(stages) - set(STAGES)
+    assert len(unknown_stages) == 0, f"Unknown stages {unknown_stages}, choose from {STAGES}"
+    reports = [report for n_rows in scales for report in benchmark_scale(n_rows, stages=stages, seed=seed, **kwargs)]
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump({"scales": list(scales), "stages": list(stages), "seed": seed, "pandas": pd.__version__,
+                       "python": sys.version, "reports": reports}, f, indent=2)
+    return reports
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput of preprocessing, matching and clustering on synthetic PersData")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--external-rows", type=int, default=None, help="rows of the external list, default a tenth of the scale")
+    parser.add_argument("--stages", nargs="+", default=STAGES, help=f"subset of {STAGES}")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--n-jobs", type=int, default=1, help="processes of the matching")
+    parser.add_argument("--output", default="throughput_benchmark.json")
+    args = parser.parse_args()
+    reports = run_throughput_benchmark(args.scales, args.stages, args.seed, args.output, n_external_rows=args.external_rows,
+                                       matching_kwargs={"n_jobs": args.n_jobs})
+    for report in reports:
+        print(json.dumps(report))
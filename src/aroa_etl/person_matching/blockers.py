@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+from abc import ABC, abstractmethod
+from aroa_etl.attribute_processing.string_utils import preprocess_name, preprocess_last_name
+from aroa_etl.attribute_processing.phonetics import phonetic_codes, phonetic_column
+from aroa_etl.person_matching.blocking import build_blocking_index
+from aroa_etl.person_matching.minhash_signatures import MinHashSignatures, minhash_signatures
+
+# ------------------------- Blocker Interface ---------------------------------
+
+class Blocker(ABC):
+    """
+        Common interface of the blocking strategies. `fit` indexes the target persons, `candidate_positions` yields
+        the sorted positions of the target candidates for every row of a source dataframe.
+        A fitted blocker is called with the index of a target person and returns the index labels of the targets
+        that are candidates of this person, so it can be used as `get_bucket_fn` of `agglomerative_clustering`.
+    """
+    target_df = None
+
+    def is_fitted(self) -> bool:
+        return self.target_df is not None
+
+    @abstractmethod
+    def fit(self, target_df: pd.core.frame.DataFrame) -> "Blocker":
+        """
+            Indexes the persons in `target_df` and returns the fitted blocker.
+        """
+
+    @abstractmethod
+    def candidate_positions(self, src_df: pd.core.frame.DataFrame):
+        """
+            Yields the target positions of the candidates of every row in `src_df`.
+        """
+
+    def neighbors(self, pos: int) -> np.ndarray:
+        """
+            Target positions of the candidates of the target at position `pos`.
+        """
+        return next(iter(self.candidate_positions(self.target_df.iloc[[pos]])))
+
+    def __call__(self, person_idx) -> pd.Index:
+        return self.target_df.index[self.neighbors(self.target_df.index.get_loc(person_idx))]
+
+# ------------------------- Sorted Neighborhood ---------------------------------
+
+def _map_unique(values: pd.core.series.Series, fn) -> pd.core.series.Series:
+    values = values.fillna("").astype(str)
+    return values.map({value: fn(value) for value in pd.unique(values)})
+
+def name_sort_key(person_data: pd.core.frame.DataFrame, gname_col="strGName_processed", lname_col="strLName_processed") -> pd.core.series.Series:
+    """
+        The normalized last name followed by the normalized first name.
+    """
+    return _map_unique(person_data[lname_col], preprocess_last_name) + " " + _map_unique(person_data[gname_col], preprocess_name)
+
+def reversed_name_sort_key(person_data: pd.core.frame.DataFrame, gname_col="strGName_processed", lname_col="strLName_processed") -> pd.core.series.Series:
+    """
+        The reversed `name_sort_key`. Brings names together that differ in the first characters.
+    """
+    return name_sort_key(person_data, gname_col, lname_col).str[::-1]
+
+def _phonetic_codes(person_data: pd.core.frame.DataFrame, column: str, encoder: str = "koelner") -> pd.core.series.Series:
+    """
+        The precomputed code column of `column` (see `add_phonetic_columns`) or the codes computed now.
+    """
+    code_column = phonetic_column(column, encoder)
+    return person_data[code_column].fillna("").astype(str) if code_column in person_data else phonetic_codes(person_data[column], encoder)
+
+def phonetic_sort_key(person_data: pd.core.frame.DataFrame, gname_col="strGName_processed", lname_col="strLName_processed") -> pd.core.series.Series:
+    """
+        The Kölner Phonetik of the last name followed by the one of the first name.
+    """
+    return _phonetic_codes(person_data, lname_col) + " " + _phonetic_codes(person_data, gname_col)
+
+SORT_KEYS = {"name": name_sort_key, "reversed_name": reversed_name_sort_key, "koelner": phonetic_sort_key}
+
+class SortedNeighborhoodBlocker(Blocker):
+    """
+        Sorted neighborhood blocking. The targets are sorted by every key in `sort_keys`, the candidates of a source
+        person are the `window` targets around its place in each sort order. The candidates of a fitted target person
+        (`neighbors`) are the `window // 2` targets before and after it and the person itself, so that two persons
+        are candidates of each other. This gives at most `window * len(sort_keys)` candidates per source person and
+        `(2 * (window // 2) + 1) * len(sort_keys)` per target person independent of the name distribution.
+        `sort_keys` are names of `SORT_KEYS` or functions (person_data, gname_col, lname_col) -> Series of strings.
+    """
+    def __init__(self, sort_keys=("name", "reversed_name"), window: int = 10,
+                 gname_col="strGName_processed", lname_col="strLName_processed"):
+        assert window > 0, "The window has to contain at least one person"
+        self.sort_keys = [SORT_KEYS[key] if isinstance(key, str) else key for key in sort_keys]
+        self.window = window
+        self.gname_col = gname_col
+        self.lname_col = lname_col
+
+    def _keys(self, person_data: pd.core.frame.DataFrame) -> list[np.ndarray]:
+        return [sort_key(person_data, self.gname_col, self.lname_col).to_numpy(dtype=str) for sort_key in self.sort_keys]
+
+    def fit(self, target_df: pd.core.frame.DataFrame) -> "SortedNeighborhoodBlocker":
+        self.target_df = target_df
+        self.orders, self.sorted_keys, self.ranks = [], [], []
+        for keys in self._keys(target_df):
+            order = np.argsort(keys, kind="stable")
+            rank = np.empty_like(order)
+            rank[order] = np.arange(order.shape[0])
+            self.orders.append(order)
+            self.sorted_keys.append(keys[order])
+            self.ranks.append(rank)
+        return self
+
+    def _window(self, order: np.ndarray, start: int) -> np.ndarray:
+        start = min(max(start, 0), max(order.shape[0] - self.window, 0))
+        return order[start:start + self.window]
+
+    def candidate_positions(self, src_df: pd.core.frame.DataFrame):
+        insert_positions = [np.searchsorted(sorted_keys, keys) for sorted_keys, keys in zip(self.sorted_keys, self._keys(src_df))]
+        for src_pos in range(src_df.shape[0]):
+            windows = [self._window(order, insert_pos[src_pos] - self.window // 2) for order, insert_pos in zip(self.orders, insert_positions)]
+            yield np.unique(np.concatenate(windows))
+
+    def neighbors(self, pos: int) -> np.ndarray:
+        # windows centered on the person itself, so two persons are candidates of each other
+        half = self.window // 2
+        windows = [order[max(rank[pos] - half, 0):rank[pos] + half + 1] for order, rank in zip(self.orders, self.ranks)]
+        return np.unique(np.concatenate(windows))
+
+# ------------------------- Phonetic Blocking ---------------------------------
+
+class PhoneticBlocker(Blocker):
+    """
+        Blocking on phonetic codes: candidates share the code of a first name and of a last name with the person.
+        With `n_chars`, only the first `n_chars` characters of the codes have to match.
+        Precomputed code columns (see `add_phonetic_columns`) are used if they are in the frames.
+    """
+    def __init__(self, encoder: str = "koelner", n_chars: int = None, gname_col="strGName_processed", lname_col="strLName_processed"):
+        self.encoder = encoder
+        self.n_chars = n_chars
+        self.gname_col = gname_col
+        self.lname_col = lname_col
+
+    def _keys(self, codes: str) -> list[tuple[str, int]]:
+        return [(code[:self.n_chars], 0) for code in codes.split(" ") if code != ""]
+
+    def fit(self, target_df: pd.core.frame.DataFrame) -> "PhoneticBlocker":
+        metadata = {"encoder": self.encoder, "n_chars": self.n_chars}
+        self.first_name_index = build_blocking_index(_phonetic_codes(target_df, self.gname_col, self.encoder), self._keys, metadata)
+        self.last_name_index = build_blocking_index(_phonetic_codes(target_df, self.lname_col, self.encoder), self._keys, metadata)
+        self.target_df = target_df
+        return self
+
+    def candidate_positions(self, src_df: pd.core.frame.DataFrame):
+        first_name_codes = _phonetic_codes(src_df, self.gname_col, self.encoder).to_numpy()
+        last_name_codes = _phonetic_codes(src_df, self.lname_col, self.encoder).to_numpy()
+        for src_pos in range(src_df.shape[0]):
+            first_bucket = self.first_name_index.lookup(self._keys(first_name_codes[src_pos]))
+            last_bucket = self.last_name_index.lookup(self._keys(last_name_codes[src_pos]))
+            yield np.intersect1d(first_bucket, last_bucket, assume_unique=True)
+
+# ------------------------- MinHash LSH Blocking ---------------------------------
+
+class LSHBlocker(Blocker):
+    """
+        Blocking with the MinHash LSH of `local_semantic_hashing`: candidates are the persons the LSH index returns
+        for the MinHash of the names. The signatures are computed with `minhash_signatures`.
+    """
+    def __init__(self, minhash_kwargs: dict = {"num_perm": 128,},
+                 lsh_kwargs: dict = {"threshold": 0.01, "num_perm": 128, "weights": (0.4, 0.6)},
+                 leave_one_out_hashing: bool = False, gname_col="strGName_processed", lname_col="strLName_processed"):
+        self.minhash_kwargs = minhash_kwargs
+        self.lsh_kwargs = lsh_kwargs
+        self.leave_one_out_hashing = leave_one_out_hashing
+        self.gname_col = gname_col
+        self.lname_col = lname_col
+
+    def _signatures(self, person_data: pd.core.frame.DataFrame) -> MinHashSignatures:
+        signatures = minhash_signatures(person_data, self.minhash_kwargs, self.leave_one_out_hashing, self.gname_col, self.lname_col)
+        # keyed by position
+        return MinHashSignatures(signatures.signatures, pd.RangeIndex(person_data.shape[0]), signatures.seed, signatures.scheme, signatures.metadata)
+
+    def fit(self, target_df: pd.core.frame.DataFrame) -> "LSHBlocker":
+        self.lsh = self._signatures(target_df).lsh(self.lsh_kwargs)
+        self.target_df = target_df
+        return self
+
+    def candidate_positions(self, src_df: pd.core.frame.DataFrame):
+        src_signatures = self._signatures(src_df)
+        for src_pos in range(src_df.shape[0]):
+            yield np.sort(np.array(self.lsh.query(src_signatures.minhash(src_pos)), dtype=np.int64))
@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from aroa_etl.person_matching.similarity_measures import parse_dates, parsed_date_columns
+
+# ------------------------- Blocking Index ---------------------------------
+
+BLOCKING_INDEX_VERSION = 1
+
+@lru_cache(maxsize=2**16)
+def bucket_key_code(bucket_key: tuple[str, int]) -> int:
+    """
+        Encodes a (prefix, length-class) bucket key as a single non-negative int64. The upper bits are a stable
+        hash of the prefix, the lower 8 bits hold the length class.
+    """
+    prefix, length_class = bucket_key
+    prefix_hash = int.from_bytes(hashlib.blake2b(prefix.encode('utf8'), digest_size=7).digest(), "big") >> 1
+    return (prefix_hash << 8) | min(int(length_class), 255)
+
+def _combine_codes(key_codes, sub_codes) -> np.ndarray:
+    """
+        Combines bucket key codes and sub-block codes to the non-negative int64 codes of the sub-buckets.
+    """
+    key_codes = np.asarray(key_codes, dtype=np.int64).astype(np.uint64)
+    sub_codes = np.asarray(sub_codes, dtype=np.int64).astype(np.uint64)
+    with np.errstate(over="ignore"):
+        combined = key_codes * np.uint64(0x9E3779B97F4A7C15) + sub_codes * np.uint64(0xC2B2AE3D27D4EB4F)
+    return (combined >> np.uint64(1)).astype(np.int64)
+
+def _pair_count(sizes) -> int:
+    sizes = np.asarray(sizes, dtype=np.int64)
+    return int((sizes * (sizes - 1) // 2).sum())
+
+def frame_fingerprint(person_data: pd.core.frame.DataFrame, columns: list[str], index: bool = False) -> str:
+    """
+        Hash of the content of `columns` in `person_data` (and its index with `index=True`).
+        Used to check that a stored index or state belongs to a frame.
+    """
+    row_hashes = pd.util.hash_pandas_object(person_data[columns].fillna("").astype(str), index=index)
+    return hashlib.sha1(row_hashes.to_numpy().tobytes()).hexdigest()
+
+class BlockingIndex():
+    """
+        Maps bucket keys to the positional row ids of the persons in the bucket.
+        The postings are stored in CSR layout: the rows of the bucket `keys[i]` are `row_ids[indptr[i]:indptr[i+1]]`.
+        `keys` is sorted, the row ids of every bucket are sorted and unique.
+    """
+    def __init__(self, keys: np.ndarray, indptr: np.ndarray, row_ids: np.ndarray, num_rows: int, metadata: dict = None):
+        self.keys = keys
+        self.indptr = indptr
+        self.row_ids = row_ids
+        self.num_rows = num_rows
+        self.metadata = dict() if metadata is None else metadata
+        # sub-blocking of oversized buckets, see `refine`
+        self.refined_keys = keys[:0]
+        self.sub_blocks = None
+        self.refinement = None
+
+    def __len__(self):
+        return self.keys.shape[0]
+
+    def lookup_code(self, key_code: int, sub_code: int = -1) -> np.ndarray:
+        """
+            Rows in the bucket `key_code`. If the bucket was refined (see `refine`) and `sub_code` is known,
+            only the rows of its sub-block and the rows with an unknown sub-block code are returned.
+        """
+        if sub_code >= 0 and self.sub_blocks is not None and self._is_refined(key_code):
+            known = self.sub_blocks.lookup_code(_combine_codes(key_code, sub_code))
+            unknown = self.sub_blocks.lookup_code(_combine_codes(key_code, -1))
+            return np.union1d(known, unknown) if unknown.shape[0] > 0 else known
+        pos = np.searchsorted(self.keys, key_code)
+        if pos < self.keys.shape[0] and self.keys[pos] == key_code:
+            return self.row_ids[self.indptr[pos]:self.indptr[pos+1]]
+        return self.row_ids[:0]
+
+    def _is_refined(self, key_code: int) -> bool:
+        pos = np.searchsorted(self.refined_keys, key_code)
+        return pos < self.refined_keys.shape[0] and self.refined_keys[pos] == key_code
+
+    def __getitem__(self, bucket_key: tuple[str, int]) -> np.ndarray:
+        return self.lookup_code(bucket_key_code(bucket_key))
+
+    def lookup(self, bucket_keys, sub_code: int = -1) -> np.ndarray:
+        """
+            Returns the sorted union of the rows in all buckets of `bucket_keys`.
+            `sub_code` is the sub-block code of the query in refined buckets.
+        """
+        postings = [self.lookup_code(bucket_key_code(bucket_key), sub_code) for bucket_key in bucket_keys]
+        if len(postings) == 0:
+            return self.row_ids[:0]
+        if len(postings) == 1:
+            return postings[0]
+        return np.unique(np.concatenate(postings))
+
+    def bucket_sizes(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def bucket_stats(self, max_bucket_size: int = None) -> dict:
+        """
+            Size statistics of the buckets. `pairs` is the number of row pairs that share a bucket.
+            With `max_bucket_size`, the buckets and pairs above that size are counted as oversized.
+        """
+        sizes = self.bucket_sizes()
+        stats = {"buckets": len(self), "postings": int(sizes.sum()),
+                 "max_bucket_size": int(sizes.max()) if len(self) > 0 else 0,
+                 "mean_bucket_size": float(sizes.mean()) if len(self) > 0 else 0.0,
+                 "p99_bucket_size": float(np.percentile(sizes, 99)) if len(self) > 0 else 0.0,
+                 "pairs": _pair_count(sizes)}
+        if max_bucket_size is not None:
+            oversized = sizes > max_bucket_size
+            stats.update(oversized_buckets=int(oversized.sum()), oversized_pairs=_pair_count(sizes[oversized]))
+        return stats
+
+    def refine(self, max_bucket_size: int, sub_codes: np.ndarray = None) -> "BlockingIndex":
+        """
+            Guardrail for oversized buckets. Buckets with more than `max_bucket_size` rows are split into sub-blocks
+            by `sub_codes`, a non-negative code of a secondary key (see `sub_block_codes`) for every row, -1 if unknown.
+            Lookups with a known sub-block code get the rows of their sub-block and all rows with unknown code,
+            lookups with an unknown code still get the whole bucket. Without `sub_codes`, oversized buckets are skipped.
+            Returns the refined index, `refinement` reports the refined or skipped buckets and pairs.
+        """
+        sizes = self.bucket_sizes()
+        oversized = np.flatnonzero(sizes > max_bucket_size)
+        pairs_before = _pair_count(sizes[oversized])
+        refinement = {"max_bucket_size": max_bucket_size, "oversized_buckets": int(oversized.shape[0]), "pairs_before": pairs_before}
+        if sub_codes is None:
+            keep = np.ones(len(self), dtype=bool)
+            keep[oversized] = False
+            posting_keep = np.repeat(keep, sizes)
+            indptr = np.concatenate([[0], np.cumsum(sizes[keep])]).astype(np.int64)
+            refined = BlockingIndex(self.keys[keep], indptr, self.row_ids[posting_keep], self.num_rows, self.metadata)
+            refined.refinement = {**refinement, "skipped_buckets": int(oversized.shape[0]), "skipped_pairs": pairs_before}
+            return refined
+        sub_codes = np.asarray(sub_codes, dtype=np.int64)
+        assert sub_codes.shape[0] == self.num_rows, "A sub-block code is needed for every row"
+        refined = BlockingIndex(self.keys, self.indptr, self.row_ids, self.num_rows, self.metadata)
+        bucket_nrs = np.repeat(oversized, sizes[oversized])
+        rows = np.asarray(self.row_ids)[np.repeat(sizes > max_bucket_size, sizes)]
+        row_sub_codes = np.maximum(sub_codes[rows], -1)
+        codes = _combine_codes(np.asarray(self.keys)[bucket_nrs], row_sub_codes)
+        order = np.lexsort((rows, codes))
+        sub_keys, starts = np.unique(codes[order], return_index=True)
+        refined.sub_blocks = BlockingIndex(sub_keys, np.append(starts, codes.shape[0]).astype(np.int64), rows[order], self.num_rows)
+        refined.refined_keys = np.asarray(self.keys)[oversized]
+        # pairs after refinement: pairs within known sub-blocks and all pairs with a row of unknown code
+        block_ids = np.unique(np.stack([bucket_nrs, row_sub_codes]), axis=1, return_counts=True)
+        (block_buckets, block_codes), block_sizes = block_ids
+        unknown_sizes = np.zeros(len(self), dtype=np.int64)
+        unknown_sizes[block_buckets[block_codes < 0]] = block_sizes[block_codes < 0]
+        pairs_after = _pair_count(block_sizes[block_codes >= 0]) + _pair_count(unknown_sizes[oversized]) \
+            + int((unknown_sizes[oversized] * (sizes[oversized] - unknown_sizes[oversized])).sum())
+        refined.refinement = {**refinement, "refined_buckets": int(oversized.shape[0]), "pairs_after": pairs_after,
+                              "refined_pairs": pairs_before - pairs_after}
+        return refined
+
+    def save(self, path: str):
+        """
+            Stores the index in directory `path`. The arrays are stored as .npy files and can be memory-mapped on load.
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "keys.npy"), self.keys)
+        np.save(os.path.join(path, "indptr.npy"), self.indptr)
+        np.save(os.path.join(path, "row_ids.npy"), self.row_ids)
+        metadata = {**self.metadata, "version": BLOCKING_INDEX_VERSION, "num_rows": self.num_rows}
+        with open(os.path.join(path, "metadata.json"), "w") as f:
+            json.dump(metadata, f)
+
+    @staticmethod
+    def load(path: str, mmap_mode="r", expected_metadata: dict = None) -> "BlockingIndex":
+        """
+            Loads an index stored with `save`. With `mmap_mode` the arrays are memory-mapped instead of read.
+            Every entry of `expected_metadata` (e.g. the fingerprint of the frame) has to match the stored metadata.
+        """
+        with open(os.path.join(path, "metadata.json")) as f:
+            metadata = json.load(f)
+        assert metadata.get("version") == BLOCKING_INDEX_VERSION, f"Blocking index version {metadata.get('version')} is not supported"
+        for key, value in (expected_metadata or dict()).items():
+            assert metadata.get(key) == value, f"Blocking index in {path} does not match: {key} is {metadata.get(key)}, expected {value}"
+        keys = np.load(os.path.join(path, "keys.npy"), mmap_mode=mmap_mode)
+        indptr = np.load(os.path.join(path, "indptr.npy"), mmap_mode=mmap_mode)
+        row_ids = np.load(os.path.join(path, "row_ids.npy"), mmap_mode=mmap_mode)
+        return BlockingIndex(keys, indptr, row_ids, metadata.pop("num_rows"), metadata)
+
+    @staticmethod
+    def matches(path: str, expected_metadata: dict) -> bool:
+        """
+            Checks if a valid index with `expected_metadata` is stored in `path`.
+        """
+        if not os.path.exists(os.path.join(path, "metadata.json")):
+            return False
+        with open(os.path.join(path, "metadata.json")) as f:
+            metadata = json.load(f)
+        return metadata.get("version") == BLOCKING_INDEX_VERSION \
+            and all(metadata.get(key) == value for key, value in expected_metadata.items())
+
+def build_blocking_index(names: pd.core.series.Series, get_keys, metadata: dict = None) -> BlockingIndex:
+    """
+        Builds a `BlockingIndex` over `names`. `get_keys` maps a name to the list of its bucket keys.
+        Keys are computed once per distinct name. Row ids are the positions in `names`.
+    """
+    names = pd.Series(names).fillna("").astype(str).reset_index(drop=True)
+    if names.shape[0] == 0:
+        return BlockingIndex(np.zeros(0, dtype=np.int64), np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32), 0, metadata)
+    name_codes = {name: [bucket_key_code(key) for key in get_keys(name)] for name in pd.unique(names)}
+    codes_per_row = names.map(name_codes)
+    counts = codes_per_row.str.len().to_numpy()
+    assert names.shape[0] < np.iinfo(np.int32).max, "Too many rows for int32 row ids"
+    rows = np.repeat(np.arange(names.shape[0], dtype=np.int32), counts)
+    codes = np.fromiter((code for row_codes in codes_per_row for code in row_codes), dtype=np.int64, count=counts.sum())
+    # sort by key and row and drop duplicate postings
+    order = np.lexsort((rows, codes))
+    codes, rows = codes[order], rows[order]
+    unique_q = np.ones(codes.shape[0], dtype=bool)
+    unique_q[1:] = (codes[1:] != codes[:-1]) | (rows[1:] != rows[:-1])
+    codes, rows = codes[unique_q], rows[unique_q]
+    keys, starts = np.unique(codes, return_index=True)
+    indptr = np.append(starts, codes.shape[0]).astype(np.int64)
+    return BlockingIndex(keys, indptr, rows, names.shape[0], metadata)
+
+def birth_year_band_codes(years, band_width: int = 5) -> np.ndarray:
+    """
+        Sub-block codes of birth years: the band of `band_width` years. Unknown years (<= 0) get -1.
+    """
+    years = np.asarray(years, dtype=np.int64)
+    return np.where(years > 0, years // band_width, -1)
+
+def second_name_codes(names, n_chars: int = 2) -> np.ndarray:
+    """
+        Sub-block codes of the prefix of the second sub-name in `names`, e.g. the second given name. Single names get -1.
+    """
+    second_names = pd.Series(names).fillna("").astype(str).str.split(" ").str[1].fillna("").str[:n_chars]
+    prefix_codes = {prefix: bucket_key_code((prefix, 0)) if prefix != "" else -1 for prefix in pd.unique(second_names)}
+    return second_names.map(prefix_codes).to_numpy(dtype=np.int64)
+
+def sub_block_codes(person_data: pd.core.frame.DataFrame, sub_blocking: str, name_col: str = None, date_col: str = "strDoB_processed",
+                    band_width: int = 5, n_chars: int = 2) -> np.ndarray:
+    """
+        Sub-block codes of all rows of `person_data` for `BlockingIndex.refine`.
+        `sub_blocking` is "birth_year" for birth year bands of `date_col` or "second_name" for the prefix of the second
+        sub-name in `name_col`.
+    """
+    if sub_blocking == "birth_year":
+        year_col = parsed_date_columns(date_col)[0]
+        years = person_data[year_col].to_numpy() if year_col in person_data else parse_dates(person_data[date_col])[0]
+        return birth_year_band_codes(years, band_width)
+    elif sub_blocking == "second_name":
+        return second_name_codes(person_data[name_col], n_chars)
+    assert False, f"Sub-blocking {sub_blocking} not defined"
+
+def guard_bucket_sizes(bucket_index: BlockingIndex, person_data: pd.core.frame.DataFrame, max_bucket_size: int,
+                       sub_blocking: str = "birth_year", name_col: str = None, date_col: str = "strDoB_processed", band_width: int = 5) -> BlockingIndex:
+    """
+        Refines the buckets of `bucket_index` over `person_data` with more than `max_bucket_size` rows by `sub_blocking`
+        (see `sub_block_codes`) or skips them if `sub_blocking` is None. Prints the bucket statistics and the refinement.
+    """
+    print(f"buckets of {name_col}: {bucket_index.bucket_stats(max_bucket_size)}")
+    sub_codes = None if sub_blocking is None else sub_block_codes(person_data, sub_blocking, name_col, date_col, band_width)
+    refined = bucket_index.refine(max_bucket_size, sub_codes)
+    print(f"bucket guardrail for {name_col}: {refined.refinement}")
+    return refined
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+from aroa_etl.attribute_processing.string_utils import preprocess_name, preprocess_last_name
+
+# ------------------------- Preprocessing of PersData for Clustering ---------------------------------
+
+NA_VALUES = ["-1", "-1.0", "None", "", "NULL", "unbekannt", "unbekant", "-", "0", "0.0", "NA"]
+
+GROUP_COLUMNS = ["lObjId", "lCountId"]
+FIRST_VALUE_COLUMNS = ["strDoB_processed", "strPoB_processed", "prisoner_number", "TD_number", "prison",
+                       "lLNameType", "lGNamePos", "strGName", "strLName"]
+
+def _map_unique(values: pd.core.series.Series, fn) -> pd.core.series.Series:
+    return values.map({value: fn(value) for value in pd.unique(values)})
+
+def clean_na_values(person_data: pd.core.frame.DataFrame, na_values: list[str] = NA_VALUES) -> pd.core.frame.DataFrame:
+    """
+        Removes `na_values` and persons without first or last name. All remaining values are strings.
+    """
+    person_data = person_data.where(~person_data.fillna("").isin(na_values)).dropna(subset=["strLName", "strGName"])
+    return person_data.fillna("").astype(str)
+
+def add_processed_columns(person_data: pd.core.frame.DataFrame, na_values: list[str] = NA_VALUES) -> pd.core.frame.DataFrame:
+    """
+        Adds the processed name, birth date and birth place columns. Every distinct name is processed once.
+    """
+    person_data["strLName_processed"] = _map_unique(person_data["strLName"], preprocess_last_name)
+    person_data["strGName_processed"] = _map_unique(person_data["strGName"], preprocess_name)
+    person_data["strDoB_processed"] = person_data["strDoB"].fillna('00000000')
+    person_data["strPoB_processed"] = _map_unique(person_data["strPoB"], preprocess_name)
+    person_data["prisoner_number"] = person_data["prisoner_number"].astype(str)
+    person_data["prisoner_number"] = person_data["prisoner_number"].mask(person_data["prisoner_number"].isin(na_values))
+    return person_data
+
+def group_multiple_names(person_data: pd.core.frame.DataFrame) -> pd.core.frame.DataFrame:
+    """
+        One row per person (`GROUP_COLUMNS`): the processed names of all rows of a person are joined with spaces,
+        the other columns are taken from the first row of the person.
+    """
+    names = person_data.groupby(GROUP_COLUMNS)[["strGName_processed", "strLName_processed"]].agg(" ".join)
+    first_rows = person_data.loc[~person_data.duplicated(GROUP_COLUMNS)].set_index(GROUP_COLUMNS)[FIRST_VALUE_COLUMNS]
+    person_data = names.join(first_rows)
+    return person_data.reset_index()
+
+def preprocess_clustering_data(
+        person_data: pd.core.frame.DataFrame,
+        gname_col="strGName_processed", lname_col="strLName_processed"
+) -> pd.core.frame.DataFrame:
+    """
+        Normalizes the name columns in place. `agglomerative_clustering` scores the names after this step, so edges
+        scored outside of it (see `score_candidate_edges`) have to be scored on the same names.
+    """
+    person_data[gname_col] = person_data[gname_col].apply(preprocess_name)
+    person_data[lname_col] = person_data[lname_col].apply(preprocess_last_name)
+    return person_data
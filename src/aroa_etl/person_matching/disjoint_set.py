@@ -0,0 +1,82 @@
+import numpy as np
+
+# ------------------------- Union Find ---------------------------------
+
+class DisjointSet():
+    """
+        Union-find over the positions 0..n-1 with array-backed parent and rank arrays.
+        `find` uses path halving and `union` unites by rank, so merging clusters runs in near-linear time.
+    """
+    def __init__(self, n: int):
+        self.parent = np.arange(n, dtype=np.int64)
+        self.rank = np.zeros(n, dtype=np.int8)
+
+    def __len__(self):
+        return self.parent.shape[0]
+
+    def find(self, i: int) -> int:
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> int:
+        """
+            Unites the sets of `i` and `j`. Returns the root of the united set.
+        """
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i == root_j:
+            return root_i
+        if self.rank[root_i] < self.rank[root_j]:
+            root_i, root_j = root_j, root_i
+        self.parent[root_j] = root_i
+        if self.rank[root_i] == self.rank[root_j]:
+            self.rank[root_i] += 1
+        return root_i
+
+    def union_pairs(self, positions_1, positions_2):
+        for i, j in zip(np.asarray(positions_1).tolist(), np.asarray(positions_2).tolist()):
+            self.union(i, j)
+
+    def union_clusters(self, clusters):
+        """
+            Unites all positions within every cluster of `clusters` (an iterable of position lists).
+        """
+        for cluster in clusters:
+            cluster = np.asarray(cluster).tolist()
+            for j in cluster[1:]:
+                self.union(cluster[0], j)
+
+    def roots(self) -> np.ndarray:
+        """
+            Root of every position. Computed by vectorized pointer jumping.
+        """
+        roots = self.parent.copy()
+        while True:
+            next_roots = roots[roots]
+            if np.array_equal(next_roots, roots):
+                break
+            roots = next_roots
+        self.parent = roots
+        return roots
+
+    def labels(self) -> np.ndarray:
+        """
+            Compact set label of every position. Sets are numbered in order of their first position.
+        """
+        _, first_pos, labels = np.unique(self.roots(), return_index=True, return_inverse=True)
+        # renumber by first position instead of root
+        order = np.argsort(first_pos, kind="stable")
+        relabel = np.empty_like(order)
+        relabel[order] = np.arange(order.shape[0])
+        return relabel[labels]
+
+    def clusters(self) -> list[np.ndarray]:
+        """
+            All sets as arrays of positions, in the order of `labels`.
+        """
+        labels = self.labels()
+        order = np.argsort(labels, kind="stable")
+        boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+        return np.split(order, boundaries) if order.shape[0] > 0 else []
@@ -4,84 +4,277 @@ from iteration_utilities import first
 from rapidfuzz import process, fuzz, utils
 import re 
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
 from tqdm import tqdm
-from aroa_etl.person_matching.similarity_measures import simple_date_matcher, date_similarity, person_similarity, name_matcher
+from aroa_etl.person_matching.ranking import TopNCollector
+from aroa_etl.person_matching.blockers import Blocker
+from aroa_etl.person_matching.similarity_graph import EdgeWriter
+from aroa_etl.person_matching.blocking import BlockingIndex, build_blocking_index, frame_fingerprint, guard_bucket_sizes, sub_block_codes
+from aroa_etl.attribute_processing.phonetics import phonetic_bucket_keys
+from aroa_etl.person_matching.similarity_measures import simple_date_matcher, date_similarity, person_similarity, name_matcher, SimilarityModel
     
-def compute_trg_buckets(target_df, target_gname_col, target_lname_col, trg_pre_clustering_on_n_chars=2, trg_pre_clustering_group_n_len_units=4):
-    target_fname_buckets = defaultdict(list)
-    target_lname_buckets = defaultdict(list)
+def name_bucket_keys(name, trg_pre_clustering_on_n_chars=2, trg_pre_clustering_group_n_len_units=4):
+    return [get_bucket_key(subname, trg_pre_clustering_on_n_chars, trg_pre_clustering_group_n_len_units)
+            for subname in re.sub(r"[^a-z\s]","",name).split(" ")]
 
-    get_key = lambda name: get_bucket_key(name, trg_pre_clustering_on_n_chars, trg_pre_clustering_group_n_len_units)
+def bucket_key_fn(trg_pre_clustering_on_n_chars=2, trg_pre_clustering_group_n_len_units=4, phonetic_encoder=None):
+    """
+        The function from a name to its bucket keys: prefix and length class keys (see `name_bucket_keys`) or,
+        with `phonetic_encoder`, the whole phonetic codes of the sub-names (see `phonetic_bucket_keys`).
+    """
+    if phonetic_encoder is not None:
+        return lambda name: phonetic_bucket_keys(name, phonetic_encoder)
+    return lambda name: name_bucket_keys(name, trg_pre_clustering_on_n_chars, trg_pre_clustering_group_n_len_units)
 
-    for idx, row in tqdm(target_df.iterrows(),total=target_df.shape[0]):
-        fname = row[target_gname_col]
-        for subname in re.sub(r"[^a-z\s]","",fname).split(" "):
-            target_fname_buckets[get_key(subname)].append(idx)
-        lname = row[target_lname_col]
-        for subname in re.sub(r"[^a-z\s]","",lname).split(" "):
-            target_lname_buckets[get_key(subname)].append(idx)
+def compute_trg_buckets(target_df, target_gname_col, target_lname_col, trg_pre_clustering_on_n_chars=2, trg_pre_clustering_group_n_len_units=4,
+                        phonetic_encoder=None):
+    """
+        Builds the first name and last name `BlockingIndex` of `target_df`. Row ids in the index are positions in `target_df`.
+        With `phonetic_encoder` (e.g. "koelner"), the names are keyed by their phonetic codes (see `bucket_key_fn`).
+    """
+    get_keys = bucket_key_fn(trg_pre_clustering_on_n_chars, trg_pre_clustering_group_n_len_units, phonetic_encoder)
+    metadata = {"trg_pre_clustering_on_n_chars": trg_pre_clustering_on_n_chars,
+                "trg_pre_clustering_group_n_len_units": trg_pre_clustering_group_n_len_units,
+                "phonetic_encoder": phonetic_encoder,
+                "fingerprint": frame_fingerprint(target_df, [target_gname_col, target_lname_col])}
+    target_fname_buckets = build_blocking_index(target_df[target_gname_col], get_keys, metadata)
+    target_lname_buckets = build_blocking_index(target_df[target_lname_col], get_keys, metadata)
+    return target_fname_buckets, target_lname_buckets
+
+def load_or_compute_trg_buckets(index_dir, target_df, target_gname_col, target_lname_col, 
+                                trg_pre_clustering_on_n_chars=2, trg_pre_clustering_group_n_len_units=4, phonetic_encoder=None):
+    """
+        Loads the target buckets from `index_dir` if they were built for the same content of `target_df` and the
+        same parameters. Otherwise the buckets are computed and stored in `index_dir` for later runs.
+    """
+    fname_dir, lname_dir = os.path.join(index_dir, "first_name"), os.path.join(index_dir, "last_name")
+    expected_metadata = {"trg_pre_clustering_on_n_chars": trg_pre_clustering_on_n_chars,
+                         "trg_pre_clustering_group_n_len_units": trg_pre_clustering_group_n_len_units,
+                         "phonetic_encoder": phonetic_encoder,
+                         "fingerprint": frame_fingerprint(target_df, [target_gname_col, target_lname_col])}
+    if BlockingIndex.matches(fname_dir, expected_metadata) and BlockingIndex.matches(lname_dir, expected_metadata):
+        return BlockingIndex.load(fname_dir), BlockingIndex.load(lname_dir)
+    target_fname_buckets, target_lname_buckets = compute_trg_buckets(
+        target_df, target_gname_col, target_lname_col, trg_pre_clustering_on_n_chars, trg_pre_clustering_group_n_len_units, phonetic_encoder
+    )
+    target_fname_buckets.save(fname_dir)
+    target_lname_buckets.save(lname_dir)
     return target_fname_buckets, target_lname_buckets
         
+def target_buckets(target_df, target_gname_col, target_lname_col, target_date_col="strDoB_processed",
+                   trg_pre_clustering_on_n_chars=2, trg_pre_clustering_group_n_len_units=4, trg_index_dir=None,
+                   max_bucket_size=None, sub_blocking="birth_year", sub_blocking_band_width=5, phonetic_encoder=None):
+    """
+        The first name and last name buckets of `target_df`, loaded from `trg_index_dir` if possible and refined
+        above `max_bucket_size` (see `guard_bucket_sizes`).
+    """
+    compute_buckets = compute_trg_buckets if trg_index_dir is None else \
+        lambda *args: load_or_compute_trg_buckets(trg_index_dir, *args)
+    target_fname_buckets, target_lname_buckets = compute_buckets(
+        target_df,
+        target_gname_col,
+        target_lname_col, 
+        trg_pre_clustering_on_n_chars, 
+        trg_pre_clustering_group_n_len_units,
+        phonetic_encoder
+    )
+    if max_bucket_size is not None:
+        target_fname_buckets = guard_bucket_sizes(target_fname_buckets, target_df, max_bucket_size, sub_blocking, 
+                                                  target_gname_col, target_date_col, sub_blocking_band_width)
+        target_lname_buckets = guard_bucket_sizes(target_lname_buckets, target_df, max_bucket_size, sub_blocking, 
+                                                  target_lname_col, target_date_col, sub_blocking_band_width)
+    return target_fname_buckets, target_lname_buckets
+
 def get_bucket_key(name, trg_pre_clustering_on_n_chars, trg_pre_clustering_group_n_len_units):
     return (name[:trg_pre_clustering_on_n_chars],int(len(name)/trg_pre_clustering_group_n_len_units))
 
 
+def bucket_candidate_positions(src_df, target_fname_buckets, target_lname_buckets,
+                               src_gname_col="strGName_processed", src_lname_col="strLName_processed", src_date_col="strDoB_processed",
+                               trg_pre_clustering_on_n_chars=2, trg_pre_clustering_group_n_len_units=4,
+                               sub_blocking=None, sub_blocking_band_width=5, phonetic_encoder=None):
+    """
+        Yields the target positions of every document in `src_df` that share a first name and a last name bucket with it.
+        If the target buckets were refined (see `guard_bucket_sizes`), `sub_blocking` has to be the same sub-blocking.
+        `phonetic_encoder` has to be the encoder of the target buckets.
+    """
+    get_keys = bucket_key_fn(trg_pre_clustering_on_n_chars, trg_pre_clustering_group_n_len_units, phonetic_encoder)
+    # sub-block codes of the source documents for refined target buckets
+    src_fname_codes = src_lname_codes = np.full(src_df.shape[0], -1, dtype=np.int64)
+    if sub_blocking is not None and target_fname_buckets.sub_blocks is not None:
+        src_fname_codes = sub_block_codes(src_df, sub_blocking, src_gname_col, src_date_col, sub_blocking_band_width)
+    if sub_blocking is not None and target_lname_buckets.sub_blocks is not None:
+        src_lname_codes = sub_block_codes(src_df, sub_blocking, src_lname_col, src_date_col, sub_blocking_band_width)
+    src_gnames, src_lnames = src_df[src_gname_col].to_numpy(), src_df[src_lname_col].to_numpy()
+    for src_pos in range(src_df.shape[0]):
+        fname_bucket = target_fname_buckets.lookup(get_keys(src_gnames[src_pos]), src_fname_codes[src_pos])
+        lname_bucket = target_lname_buckets.lookup(get_keys(src_lnames[src_pos]), src_lname_codes[src_pos])
+        yield np.intersect1d(fname_bucket, lname_bucket, assume_unique=True)
+
+class PrefixBucketBlocker(Blocker):
+    """
+        The prefix and length bucket blocking of `person_matching` as a `Blocker`: candidates share a first name
+        and a last name bucket. With `index_dir`, the buckets are stored and reused (see `load_or_compute_trg_buckets`),
+        with `max_bucket_size`, oversized buckets are refined or skipped (see `guard_bucket_sizes`).
+        With `phonetic_encoder`, the buckets are keyed by phonetic codes (see `bucket_key_fn`).
+    """
+    def __init__(self, gname_col="strGName_processed", lname_col="strLName_processed", date_col="strDoB_processed",
+                 trg_pre_clustering_on_n_chars=2, trg_pre_clustering_group_n_len_units=4, index_dir=None,
+                 max_bucket_size=None, sub_blocking="birth_year", sub_blocking_band_width=5, phonetic_encoder=None):
+        self.gname_col = gname_col
+        self.lname_col = lname_col
+        self.date_col = date_col
+        self.trg_pre_clustering_on_n_chars = trg_pre_clustering_on_n_chars
+        self.trg_pre_clustering_group_n_len_units = trg_pre_clustering_group_n_len_units
+        self.index_dir = index_dir
+        self.max_bucket_size = max_bucket_size
+        self.sub_blocking = sub_blocking
+        self.sub_blocking_band_width = sub_blocking_band_width
+        self.phonetic_encoder = phonetic_encoder
+
+    def fit(self, target_df) -> "PrefixBucketBlocker":
+        self.fname_buckets, self.lname_buckets = target_buckets(target_df, self.gname_col, self.lname_col, self.date_col,
+                                                                self.trg_pre_clustering_on_n_chars, self.trg_pre_clustering_group_n_len_units,
+                                                                self.index_dir, self.max_bucket_size, self.sub_blocking, self.sub_blocking_band_width,
+                                                                self.phonetic_encoder)
+        self.target_df = target_df
+        return self
+
+    def candidate_positions(self, src_df):
+        return bucket_candidate_positions(src_df, self.fname_buckets, self.lname_buckets, self.gname_col, self.lname_col, self.date_col,
+                                          self.trg_pre_clustering_on_n_chars, self.trg_pre_clustering_group_n_len_units,
+                                          self.sub_blocking, self.sub_blocking_band_width, self.phonetic_encoder)
+
+def match_sources(src_df, target_df, target_fname_buckets, target_lname_buckets,
+                  src_gname_col="strGName_processed",src_lname_col="strLName_processed",src_date_col="strDoB_processed",
+                  target_gname_col="strGName_processed",target_lname_col="strLName_processed",target_date_col="strDoB_processed",
+                  date_matcher=date_similarity, trg_pre_clustering_on_n_chars=2, trg_pre_clustering_group_n_len_units=4, 
+                  top_n_matches = 1, min_match_score=0.0, name_only=False, sub_blocking=None, sub_blocking_band_width=5,
+                  blocker=None, progress=True, edge_writer=None, edge_src_offset=0, phonetic_encoder=None):
+    """
+        Matches every document in `src_df` against its bucket candidates in `target_df`.
+        Returns a list of (srcID, score, trgID) tuples with the `top_n_matches` best matches per source document.
+        If the target buckets were refined (see `guard_bucket_sizes`), `sub_blocking` has to be the same sub-blocking.
+        With a `blocker` fitted on `target_df`, its candidates are used instead of the buckets.
+        With an `edge_writer`, all candidate scores are written as edges (source position + `edge_src_offset`, target position).
+        The candidates are scored with a `SimilarityModel` compiled on the columns of `src_df` and `target_df`. Without
+        `edge_writer`, names are scored with `min_match_score` as rapidfuzz `score_cutoff`.
+    """
+    matching = []
+    model = SimilarityModel(src_gname_col=src_gname_col, src_lname_col=src_lname_col, src_date_col=src_date_col,
+                            target_gname_col=target_gname_col, target_lname_col=target_lname_col, target_date_col=target_date_col,
+                            date_matcher=date_matcher, name_only=name_only).compile(src_df.columns, target_df.columns)
+    # scores below `min_match_score` are not collected, they only have to be exact for the edge export
+    score_cutoff = min_match_score if edge_writer is None and min_match_score > 0 else None
+    if blocker is None:
+        src_candidates = bucket_candidate_positions(src_df, target_fname_buckets, target_lname_buckets, src_gname_col, src_lname_col, src_date_col,
+                                                    trg_pre_clustering_on_n_chars, trg_pre_clustering_group_n_len_units,
+                                                    sub_blocking, sub_blocking_band_width, phonetic_encoder)
+    else:
+        src_candidates = blocker.candidate_positions(src_df)
+    for src_pos, bucket_idxs in tqdm(zip(range(src_df.shape[0]), src_candidates), total = src_df.shape[0], disable=not progress):
+        src_idx = src_df.index[src_pos]
+        src_doc = src_df.iloc[[src_pos]]
+        best_matches = TopNCollector(top_n_matches, min_match_score)
+        # target candidates for matching
+        candidates = target_df.iloc[bucket_idxs,:]
+        # score all candidates of the source document at once
+        match_scores = model.matrix(src_doc, candidates, score_cutoff)[0]
+        if edge_writer is not None:
+            edge_writer.add(src_pos + edge_src_offset, bucket_idxs, match_scores)
+        best_matches.add_batch(match_scores, candidates.index)
+        best_matches = best_matches.result() # list of (score, idx) in increasing order
+        if len(best_matches) == 0:
+            best_matches = [(-1, np.nan)]
+        best_matches = [ (src_idx, match_score, match_idx) for match_score, match_idx in best_matches ]
+        # best_match_idx is -1 if there is no match score greater than matching_threshold
+        matching += best_matches
+    return matching
+
+_shared_matching_state = dict()
+
+def _match_shard(src_shard, shard_start=0):
+    """
+        Worker function for the parallel matching. The target data and buckets are inherited 
+        from the parent process through `_shared_matching_state` when the worker is forked.
+        Every shard writes its edges to own chunk files.
+    """
+    state = dict(_shared_matching_state)
+    edge_kwargs = state.pop("edge_kwargs")
+    if edge_kwargs is None:
+        return match_sources(src_shard, **state, progress=False)
+    with EdgeWriter(**edge_kwargs, prefix=f"edges_{shard_start:010d}") as edge_writer:
+        return match_sources(src_shard, **state, progress=False, edge_writer=edge_writer, edge_src_offset=shard_start)
+
 def person_matching(src_df, target_df, allow_duplicates=True,
                     src_gname_col="strGName_processed",src_lname_col="strLName_processed",src_date_col="strDoB_processed",
                     src_prisoner_number="prisoner_number",src_birthplace = "strPoB_processed",
                     target_gname_col="strGName_processed",target_lname_col="strLName_processed",target_date_col="strDoB_processed",
                     target_prisoner_number="prisoner_number",target_birthplace = "strPoB_processed", date_matcher=date_similarity, 
                     trg_pre_clustering_on_n_chars=2, trg_pre_clustering_group_n_len_units=4, 
-                    top_n_matches = 1, min_match_score=0.0, name_only=False):
+                    top_n_matches = 1, min_match_score=0.0, name_only=False, n_jobs=1, shards_per_job=4, trg_index_dir=None,
+                    max_bucket_size=None, sub_blocking="birth_year", sub_blocking_band_width=5, blocker=None,
+                    edge_path=None, edge_chunk_size=1_000_000, edge_format="npz", phonetic_encoder=None):
     """
         Computes a matching between documents in `src_df` and documents in `target_df` based on person data. 
         The documents are fuzzy matched with threshold `matching_threshold`. Excluding duplicates from two 
         src_docs to the same target is not yet implemented.
+        With `n_jobs` > 1, `src_df` is split into `n_jobs * shards_per_job` shards that are matched in a pool of 
+        forked processes. The target data and buckets are shared with the workers once on fork.
+        With `trg_index_dir`, the target buckets are stored on disk and reused by later runs on the same target data.
+        With `max_bucket_size`, larger target buckets are refined by `sub_blocking` ("birth_year" bands of 
+        `sub_blocking_band_width` years or "second_name" prefixes) or skipped if `sub_blocking` is None.
+        With `phonetic_encoder` (e.g. "koelner"), the buckets are keyed by the phonetic codes of the names instead of
+        prefixes and lengths (see `bucket_key_fn`).
+        A `blocker` (e.g. `SortedNeighborhoodBlocker`) is fitted on `target_df` and replaces the target buckets.
+        With `edge_path`, the scores of all candidate pairs are streamed as edges (src = position in `src_df`,
+        dst = position in `target_df`) to chunk files in `edge_path` (see `EdgeWriter`). Their metadata marks them as
+        bipartite, so they are not loaded as a `SimilarityGraph`.
     """
-    matching = []
     print("Precluster target dataframe ")
-    target_fname_buckets, target_lname_buckets = compute_trg_buckets(
-        target_df,
-        target_gname_col,
-        target_lname_col, 
-        trg_pre_clustering_on_n_chars, 
-        trg_pre_clustering_group_n_len_units
+    if blocker is not None:
+        target_fname_buckets = target_lname_buckets = None
+        blocker.fit(target_df)
+    else:
+        target_fname_buckets, target_lname_buckets = target_buckets(target_df, target_gname_col, target_lname_col, target_date_col,
+                                                                    trg_pre_clustering_on_n_chars, trg_pre_clustering_group_n_len_units,
+                                                                    trg_index_dir, max_bucket_size, sub_blocking, sub_blocking_band_width,
+                                                                    phonetic_encoder)
+    matching_kwargs = dict(
+        target_df=target_df, target_fname_buckets=target_fname_buckets, target_lname_buckets=target_lname_buckets,
+        src_gname_col=src_gname_col, src_lname_col=src_lname_col, src_date_col=src_date_col,
+        target_gname_col=target_gname_col, target_lname_col=target_lname_col, target_date_col=target_date_col,
+        date_matcher=date_matcher, trg_pre_clustering_on_n_chars=trg_pre_clustering_on_n_chars, 
+        trg_pre_clustering_group_n_len_units=trg_pre_clustering_group_n_len_units,
+        top_n_matches=top_n_matches, min_match_score=min_match_score, name_only=name_only,
+        sub_blocking=sub_blocking, sub_blocking_band_width=sub_blocking_band_width, blocker=blocker,
+        phonetic_encoder=phonetic_encoder
     )
-    get_key = lambda name: get_bucket_key(name, trg_pre_clustering_on_n_chars, trg_pre_clustering_group_n_len_units)
+    edge_kwargs = None
+    if edge_path is not None:
+        edge_metadata = {"bipartite": True, "num_src_rows": src_df.shape[0], "num_dst_rows": target_df.shape[0]}
+        edge_kwargs = dict(path=edge_path, chunk_size=edge_chunk_size, format=edge_format, metadata=edge_metadata)
     print("Start Matching ")
-    for src_idx, src_doc in tqdm(src_df.iterrows(), total = src_df.shape[0]):
-        best_matches = [] # list of (score, idx) in increasing order
-        # get target candidates for matching
-        fname = src_doc[src_gname_col]
-        fname = re.sub(r"[^a-z\s]","",fname)
-        fname_bucket = [idx for subname in fname.split(" ") for idx in target_fname_buckets[get_key(subname)]]
-        lname = src_doc[src_lname_col]
-        lname = re.sub(r"[^a-z\s]","",lname)
-        lname_bucket = [idx for subname in lname.split(" ") for idx in target_lname_buckets[get_key(subname)]]
-        bucket_idxs = list(set(fname_bucket).intersection(set(lname_bucket)))
-        #print(num_match_columns)
-        for target_idx,target_doc in target_df.iloc[bucket_idxs,:].iterrows():
-            match_score = person_similarity(
-                src_doc, target_doc,
-                src_gname_col=src_gname_col,src_lname_col=src_lname_col,src_date_col=src_date_col,
-                target_gname_col=target_gname_col,target_lname_col=target_lname_col,target_date_col=target_date_col, date_matcher=date_matcher,
-                name_only=name_only
-            )
-            ranking_pos = -1
-            if match_score >= min_match_score:
-                ranking_pos = 0                
-            for top_score, idx in best_matches:
-                if match_score > top_score:
-                    ranking_pos += 1
-            if ranking_pos >=0:
-                best_matches = best_matches[:ranking_pos] + [(match_score, target_idx)] + best_matches[ranking_pos:]
-            if len(best_matches) > top_n_matches:
-                best_matches = best_matches[1:]
-        if len(best_matches) == 0:
-            best_matches = [(-1, np.nan)]
-        best_matches = [ (src_idx, match_score, match_idx) for match_score, match_idx in best_matches ]
-        # best_match_idx is -1 if there is no match score greater than matching_threshold
-        matching += best_matches
+    if n_jobs == 1 or src_df.shape[0] == 0:
+        if edge_kwargs is None:
+            matching = match_sources(src_df, **matching_kwargs)
+        else:
+            with EdgeWriter(**edge_kwargs) as edge_writer:
+                matching = match_sources(src_df, **matching_kwargs, edge_writer=edge_writer)
+    else:
+        n_shards = min(src_df.shape[0], n_jobs * shards_per_job)
+        shard_bounds = np.linspace(0, src_df.shape[0], n_shards + 1).astype(int)
+        src_shards = [src_df.iloc[start:end] for start, end in zip(shard_bounds[:-1], shard_bounds[1:])]
+        _shared_matching_state.update(matching_kwargs, edge_kwargs=edge_kwargs)
+        try:
+            with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context("fork")) as executor:
+                # map keeps the shard order, so the result equals the sequential matching
+                shard_matchings = list(tqdm(executor.map(_match_shard, src_shards, shard_bounds[:-1]), total=n_shards))
+        finally:
+            _shared_matching_state.clear()
+        matching = [match for shard_matching in shard_matchings for match in shard_matching]
     matchings_df = pd.DataFrame(matching,columns=["srcID","score","trgID"])
     if not allow_duplicates:
         best_matches_per_trg = matchings_df[matchings_df.score != -1.0].groupby("trgID")["score"].agg("max").reset_index()
@@ -92,3 +285,47 @@ def person_matching(src_df, target_df, allow_duplicates=True,
         matchings_df = pd.concat([_matchings_df, non_matched_srcids], axis=0)
         matchings_df.index = range(matchings_df.shape[0])
     return matchings_df
+
+def person_matching_stream(src_df, target_batches, target_columns=None, top_n_matches=1, min_match_score=0.0,
+                           emit_chunk_size=10000, trg_index_dir=None, **matching_kwargs):
+    """
+        Matches `src_df` against a stream of target dataframes `target_batches` (e.g. the PersData batch files).
+        A running top `top_n_matches` per source document is kept over all batches, so only the source data,
+        the current batch and the target rows of the current best matches are held in memory.
+        After the last batch, the matching is emitted in chunks of `emit_chunk_size` source documents. Every chunk
+        has the columns srcID, score, trgBatch, trgID and the `target_columns` of the matched target rows.
+        Source documents without a match get one row with score -1.
+        With `trg_index_dir`, the buckets of batch i are stored in the sub directory `batch_i`.
+        Further keyword arguments are passed to `person_matching`.
+    """
+    assert src_df.index.is_unique, "The index of src_df has to be unique"
+    src_positions = pd.Series(np.arange(src_df.shape[0]), index=src_df.index)
+    best_matches = [TopNCollector(top_n_matches, min_match_score) for _ in range(src_df.shape[0])]
+    retained = None # target rows of the current best matches, indexed by (trgBatch, trgID)
+    for batch_nr, target_batch in enumerate(target_batches):
+        batch_index_dir = None if trg_index_dir is None else os.path.join(trg_index_dir, f"batch_{batch_nr}")
+        batch_columns = list(target_batch.columns) if target_columns is None else target_columns
+        matchings_df = person_matching(src_df, target_batch, allow_duplicates=True, top_n_matches=top_n_matches,
+                                       min_match_score=min_match_score, trg_index_dir=batch_index_dir, **matching_kwargs)
+        # reversed to add the matches of every source from best to worst, so ties are resolved as in person_matching
+        matchings_df = matchings_df[matchings_df.trgID.notna()].iloc[::-1]
+        for src_pos, score, trg_id in zip(src_positions[matchings_df.srcID].values, matchings_df.score, matchings_df.trgID):
+            best_matches[src_pos].add(score, (batch_nr, trg_id))
+        # keep only target rows that are still among the best matches
+        batch_rows = target_batch.loc[pd.unique(matchings_df.trgID), batch_columns]
+        batch_rows.index = pd.MultiIndex.from_arrays([np.full(batch_rows.shape[0], batch_nr), batch_rows.index], names=["trgBatch", "trgID"])
+        retained = batch_rows if retained is None else pd.concat([retained, batch_rows])
+        referenced = {item for collector in best_matches for _, item in collector.result()}
+        retained = retained[retained.index.isin(referenced)]
+    for chunk_start in range(0, src_df.shape[0], emit_chunk_size):
+        matching = []
+        for src_pos in range(chunk_start, min(chunk_start + emit_chunk_size, src_df.shape[0])):
+            src_idx = src_df.index[src_pos]
+            matches = best_matches[src_pos].result()
+            if len(matches) == 0:
+                matching.append((src_idx, -1, np.nan, np.nan))
+            matching += [(src_idx, score, batch_nr, trg_id) for score, (batch_nr, trg_id) in matches]
+        matchings_df = pd.DataFrame(matching, columns=["srcID", "score", "trgBatch", "trgID"])
+        if retained is not None:
+            matchings_df = matchings_df.join(retained, on=["trgBatch", "trgID"])
+        yield matchings_df
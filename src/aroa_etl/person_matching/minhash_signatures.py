@@ -0,0 +1,192 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from datasketch import MinHash, MinHashLSH
+from aroa_etl.person_matching.blocking import frame_fingerprint
+
+# ------------------------- MinHash Signatures ---------------------------------
+
+MINHASH_SIGNATURES_VERSION = 1
+
+_mersenne_prime = np.uint64((1 << 61) - 1)
+_max_hash = np.uint64((1 << 32) - 1)
+# bit width and MurmurHash3 finalizer constants (shift1, multiplier1, shift2, multiplier2, shift3) of the datasketch >= 2.0 schemes
+_SCHEME_WIDTHS = {"affine32": 32, "affine64": 64}
+_FMIX_CONSTANTS = {
+    32: (np.uint32(16), np.uint32(0x85EBCA6B), np.uint32(13), np.uint32(0xC2B2AE35), np.uint32(16)),
+    64: (np.uint64(33), np.uint64(0xFF51AFD7ED558CCD), np.uint64(33), np.uint64(0xC4CEB9FE1A85EC53), np.uint64(33)),
+}
+
+def collision_shingles(name: str) -> list[str]:
+    """
+        The shingles `add_collision_hashes` adds for `name`: the name and all variants omitting one character.
+    """
+    return [name] + [name[:c] + name[c+1:] for c in range(len(name))]
+
+def person_shingles(lname: str, gname: str, leave_one_out_hashing: bool = False) -> list[str]:
+    """
+        All values `local_semantic_hashing` adds to the MinHash of a person with last name `lname` and given name `gname`.
+    """
+    shingles = []
+    for sub_name in lname.split(" ") + gname.split(" "):
+        shingles.append(sub_name)
+        if leave_one_out_hashing:
+            shingles.extend(collision_shingles(sub_name))
+    return shingles
+
+def _minhash_scheme(minhash: MinHash) -> str:
+    # datasketch < 2.0 has no schemes and always permutes like the "legacy" scheme
+    return getattr(minhash, "scheme", "legacy")
+
+def _fmix(hash_values: np.ndarray, width: int) -> np.ndarray:
+    """
+        MurmurHash3 finalizer on unsigned `width` bit integers, the pre-mix of the affine datasketch schemes.
+    """
+    shift_1, multiplier_1, shift_2, multiplier_2, shift_3 = _FMIX_CONSTANTS[width]
+    hash_values = hash_values ^ (hash_values >> shift_1)
+    hash_values = hash_values * multiplier_1
+    hash_values = hash_values ^ (hash_values >> shift_2)
+    hash_values = hash_values * multiplier_2
+    return hash_values ^ (hash_values >> shift_3)
+
+def permute_hashes(hash_values: np.ndarray, permutations: np.ndarray, scheme: str = "legacy") -> np.ndarray:
+    """
+        Applies the MinHash permutations to the hashed shingles. Returns a (len(hash_values) x num_perm) matrix
+        with the same values `MinHash.update` computes for every shingle.
+    """
+    a, b = permutations
+    if scheme == "legacy":
+        hv = np.asarray(hash_values, dtype=np.uint64).reshape(-1, 1)
+        return np.bitwise_and((hv * a + b) % _mersenne_prime, _max_hash)
+    hv = np.asarray(hash_values, dtype=a.dtype).reshape(-1, 1)
+    # the multiplication wraps around, which is the modulo 2^width of the scheme
+    with np.errstate(over="ignore"):
+        return _fmix(hv, _SCHEME_WIDTHS[scheme]) * a + b
+
+def minhash_signatures(person_data: pd.core.frame.DataFrame,
+                       minhash_kwargs: dict = {"num_perm": 128,},
+                       leave_one_out_hashing: bool = False,
+                       gname_col: str = "strGName_processed",
+                       lname_col: str = "strLName_processed",
+                       chunk_size: int = 2**16) -> "MinHashSignatures":
+    """
+        Computes the MinHash signatures of all persons in `person_data` at once.
+        Every distinct shingle is hashed once, the permutations are applied to chunks of the shingles and reduced per person.
+        The signatures are equal to the MinHashes `local_semantic_hashing` builds per person.
+        The metadata of the signatures holds the hashing mode and the fingerprint of the index and the names.
+    """
+    template = MinHash(**minhash_kwargs)
+    scheme = _minhash_scheme(template)
+    shingles = [person_shingles(lname, gname, leave_one_out_hashing)
+                for lname, gname in zip(person_data[lname_col].to_numpy(), person_data[gname_col].to_numpy())]
+    counts = np.fromiter((len(person) for person in shingles), dtype=np.int64, count=len(shingles))
+    shingle_codes, unique_shingles = pd.factorize(pd.Series([shingle for person in shingles for shingle in person], dtype=object))
+    unique_hashes = np.fromiter((template.hashfunc(shingle.encode('utf8')) for shingle in unique_shingles),
+                                dtype=np.uint64, count=len(unique_shingles))
+    shingle_hashes = unique_hashes[shingle_codes]
+    signatures = np.tile(template.hashvalues, (len(shingles), 1))
+    starts = np.concatenate([[0], np.cumsum(counts)])
+    # chunks of whole persons with about `chunk_size` shingles
+    person_pos = 0
+    while person_pos < len(shingles):
+        person_end = max(int(np.searchsorted(starts, starts[person_pos] + chunk_size, side="right")) - 1, person_pos + 1)
+        person_end = min(person_end, len(shingles))
+        non_empty = np.flatnonzero(counts[person_pos:person_end] > 0) + person_pos
+        if non_empty.shape[0] > 0:
+            permuted = permute_hashes(shingle_hashes[starts[person_pos]:starts[person_end]], template.permutations, scheme)
+            chunk_min = np.minimum.reduceat(permuted, starts[non_empty] - starts[person_pos], axis=0)
+            signatures[non_empty] = np.minimum(signatures[non_empty], chunk_min)
+        person_pos = person_end
+    metadata = {"leave_one_out_hashing": leave_one_out_hashing, "fingerprint": frame_fingerprint(person_data, [lname_col, gname_col], index=True)}
+    return MinHashSignatures(signatures, person_data.index, minhash_kwargs.get("seed", 1), scheme, metadata)
+
+class MinHashSignatures():
+    """
+        The MinHash signatures of persons as a (n_persons x num_perm) matrix.
+        Indexing with a person index returns the `datasketch.MinHash` of the person,
+        so the signatures can be used in place of the dict of MinHashes returned by `local_semantic_hashing`.
+        `metadata` describes how the signatures were computed (see `minhash_signatures`) and is stored with them.
+    """
+    def __init__(self, signatures: np.ndarray, index: pd.Index, seed: int = 1, scheme: str = "legacy", metadata: dict = None):
+        self.signatures = signatures
+        self.index = pd.Index(index)
+        self.seed = seed
+        self.scheme = scheme
+        self.metadata = dict() if metadata is None else metadata
+        self._permutations = None
+
+    def __len__(self):
+        return self.signatures.shape[0]
+
+    @property
+    def num_perm(self) -> int:
+        return self.signatures.shape[1]
+
+    def minhash(self, pos: int) -> MinHash:
+        """
+            The MinHash of the person at position `pos`.
+        """
+        if self._permutations is None:
+            self._permutations = MinHash(**self._minhash_kwargs()).permutations
+        return MinHash(hashvalues=np.array(self.signatures[pos]), permutations=self._permutations, **self._minhash_kwargs())
+
+    def _minhash_kwargs(self) -> dict:
+        kwargs = {"num_perm": self.num_perm, "seed": self.seed}
+        # datasketch >= 2.0 requires the scheme of given hash values
+        if "scheme" in MinHash.__init__.__code__.co_varnames:
+            kwargs["scheme"] = self.scheme
+        return kwargs
+
+    def __getitem__(self, person_idx) -> MinHash:
+        return self.minhash(self.index.get_loc(person_idx))
+
+    def lsh(self, lsh_kwargs: dict = {"threshold": 0.01, "num_perm": 128, "weights": (0.4, 0.6)}) -> MinHashLSH:
+        """
+            Builds a `MinHashLSH` with all persons, keyed by person index. The persons are inserted in one buffered session.
+        """
+        lsh = MinHashLSH(**lsh_kwargs)
+        with lsh.insertion_session() as session:
+            for pos, person_idx in enumerate(self.index):
+                session.insert(person_idx, self.minhash(pos))
+        return lsh
+
+    def save(self, path: str):
+        """
+            Stores the signatures in directory `path`. The signature matrix is stored as .npy file and can be memory-mapped on load.
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "signatures.npy"), np.asarray(self.signatures))
+        np.save(os.path.join(path, "index.npy"), self.index.to_numpy())
+        with open(os.path.join(path, "metadata.json"), "w") as f:
+            json.dump({**self.metadata, "version": MINHASH_SIGNATURES_VERSION, "seed": self.seed, "scheme": self.scheme,
+                       "num_perm": self.num_perm}, f)
+
+    @staticmethod
+    def load(path: str, mmap_mode="r", expected_metadata: dict = None) -> "MinHashSignatures":
+        """
+            Loads signatures stored with `save`. Every entry of `expected_metadata` has to match the stored metadata.
+        """
+        with open(os.path.join(path, "metadata.json")) as f:
+            metadata = json.load(f)
+        assert metadata.get("version") == MINHASH_SIGNATURES_VERSION, f"MinHash signatures version {metadata.get('version')} is not supported"
+        for key, value in (expected_metadata or dict()).items():
+            assert metadata.get(key) == value, f"MinHash signatures in {path} do not match: {key} is {metadata.get(key)}, expected {value}"
+        signatures = np.load(os.path.join(path, "signatures.npy"), mmap_mode=mmap_mode)
+        index = np.load(os.path.join(path, "index.npy"), allow_pickle=True)
+        seed, scheme = metadata.pop("seed"), metadata.pop("scheme")
+        for key in ("version", "num_perm"):
+            metadata.pop(key, None)
+        return MinHashSignatures(signatures, index, seed, scheme, metadata)
+
+    @staticmethod
+    def matches(path: str, expected_metadata: dict) -> bool:
+        """
+            Checks if valid signatures with `expected_metadata` are stored in `path`.
+        """
+        if not os.path.exists(os.path.join(path, "metadata.json")):
+            return False
+        with open(os.path.join(path, "metadata.json")) as f:
+            metadata = json.load(f)
+        return metadata.get("version") == MINHASH_SIGNATURES_VERSION \
+            and all(metadata.get(key) == value for key, value in expected_metadata.items())
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from rapidfuzz import utils
+
+# ------------------------- Name Similarity Cache ---------------------------------
+
+class NameSimilarityCache():
+    """
+        Bounded LRU cache for scores of name pairs. A pair is cached under (scorer, smaller name, larger name)
+        since the cached scorers are symmetric. The cache holds at most `maxsize` pairs and no other state per name,
+        so `maxsize` bounds its memory. Hits and misses are counted.
+    """
+    def __init__(self, maxsize: int = 2**20):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._scores = OrderedDict()
+
+    def __len__(self):
+        return len(self._scores)
+
+    def score(self, scorer, name_1: str, name_2: str) -> float:
+        """
+            Returns `scorer(name_1, name_2)` with the default rapidfuzz processor from the cache or computes it.
+        """
+        key = (scorer, name_1, name_2) if name_1 <= name_2 else (scorer, name_2, name_1)
+        score = self._scores.get(key)
+        if score is not None:
+            self.hits += 1
+            self._scores.move_to_end(key)
+            return score
+        self.misses += 1
+        score = scorer(name_1, name_2, processor=utils.default_process)
+        self._scores[key] = score
+        if len(self._scores) > self.maxsize:
+            self._scores.popitem(last=False)
+        return score
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate(),
+                "size": len(self._scores), "maxsize": self.maxsize}
+
+    def clear(self):
+        self.hits = 0
+        self.misses = 0
+        self._scores.clear()
+
+_active_cache = None
+
+def enable_name_cache(maxsize: int = 2**20) -> NameSimilarityCache:
+    """
+        Enables caching of name scores in `name_matcher` and `name_set_matcher`. Returns the new cache.
+        The batch scorers (`batch_person_similarity`, `SimilarityModel.matrix`) score with rapidfuzz `cdist` and do
+        not use the cache, it only helps code that scores single pairs, e.g. `person_similarity`.
+    """
+    global _active_cache
+    _active_cache = NameSimilarityCache(maxsize)
+    return _active_cache
+
+def disable_name_cache():
+    global _active_cache
+    _active_cache = None
+
+def active_name_cache() -> "NameSimilarityCache | None":
+    return _active_cache
+
+@contextmanager
+def name_cache(maxsize: int = 2**20):
+    """
+        Enables the name score cache within a with block, e.g. for a single clustering run.
+    """
+    global _active_cache
+    previous_cache = _active_cache
+    cache = enable_name_cache(maxsize)
+    try:
+        yield cache
+    finally:
+        _active_cache = previous_cache
+
+def cached_name_score(scorer, name_1: str, name_2: str, score_cutoff: float = 0) -> float:
+    """
+        Scores two names with `scorer` and the default rapidfuzz processor. Uses the active cache if enabled.
+        Without cache, scores below `score_cutoff` are 0 (rapidfuzz `score_cutoff`), cached scores are exact.
+    """
+    if _active_cache is None:
+        return scorer(name_1, name_2, processor=utils.default_process, score_cutoff=score_cutoff)
+    return _active_cache.score(scorer, name_1, name_2)
@@ -5,10 +5,22 @@ from datasketch import MinHash, MinHashLSH
 import math
 import pandas as pd
 from aroa_etl.attribute_processing.string_utils import preprocess_name, preprocess_last_name
+from aroa_etl.attribute_processing.phonetics import phonetic_bucket_keys
 from aroa_etl.person_matching.similarity_measures import *
 from tqdm import tqdm
 from collections import defaultdict  
 from typing import Dict
+import json
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from aroa_etl.person_matching.disjoint_set import DisjointSet
+from aroa_etl.person_matching.blocking import BlockingIndex, build_blocking_index, frame_fingerprint, guard_bucket_sizes, sub_block_codes
+from aroa_etl.person_matching.minhash_signatures import MinHashSignatures, minhash_signatures
+from aroa_etl.person_matching.blockers import Blocker
+from aroa_etl.person_matching.clustering_preprocessing import preprocess_clustering_data
+from aroa_etl.person_matching.similarity_graph import SimilarityGraph
 
 # ------------------------- Cluster Quality measures ---------------------------------
 
@@ -66,19 +78,89 @@ def link_score(person:pd.core.series.Series,
         return max_link_score(person,person_cluster)
     assert False, "Linkage not defined"
 
-def cluster_integrety(person_cluster:"list | pandas.core.frame.DataFrame"):
-    if type(person_cluster) == pd.core.frame.DataFrame:
-        person_cluster = [person for i,person in person_cluster.iterrows()]
-    avg_link_scores = np.array([avg_link_score(person,[*person_cluster[:i],*person_cluster[i+1:]])
-                                for i,person in enumerate(person_cluster) ])
-    single_link_scores = np.array([single_link_score(person,[*person_cluster[:i],*person_cluster[i+1:]])
-                                   for i,person in enumerate(person_cluster) ])
-    max_link_scores = np.array([max_link_score(person,[*person_cluster[:i],*person_cluster[i+1:]])
-                                    for i,person in enumerate(person_cluster) ])
-    
-    avg_link_scores = np.array([100]) if len(person_cluster) == 0 else avg_link_scores
-    single_link_scores = np.array([100]) if len(person_cluster) == 0 else single_link_scores
-    return {"average": avg_link_scores.mean(), "average-link": avg_link_scores.min(), "single-link" : single_link_scores.min(), "max-link": max_link_scores.min()}
+QUALITY_COLUMNS = ["average", "average-link", "single-link", "max-link"]
+
+def link_score_statistics(similarity: np.ndarray) -> dict:
+    """
+        Cluster quality from the pairwise similarity matrix of a cluster, row i scores person i against the others.
+        Gives the values of the former per-linkage scoring in `cluster_integrety`, every pair is scored only once.
+    """
+    num_persons = similarity.shape[0]
+    if num_persons < 2:
+        return {column: 100.0 for column in QUALITY_COLUMNS}
+    # scores of every person against the rest of the cluster
+    others = similarity[~np.eye(num_persons, dtype=bool)].reshape(num_persons, num_persons - 1)
+    avg_link_scores = others.mean(axis=1)
+    return {"average": float(avg_link_scores.mean()), "average-link": float(avg_link_scores.min()),
+            "single-link": float(others.max(axis=1).min()), "max-link": float(others.min(axis=1).min())}
+
+def cluster_integrety(person_cluster:"list | pandas.core.frame.DataFrame", **similarity_kwargs):
+    """
+        Average, average-link, single-link and max-link score of a cluster of persons (see `link_score_statistics`).
+        The pairwise similarity matrix is computed once with `batch_person_similarity`.
+    """
+    if type(person_cluster) == list:
+        person_cluster = pd.DataFrame(person_cluster)
+    return link_score_statistics(batch_person_similarity(person_cluster, person_cluster, **similarity_kwargs))
+
+_shared_quality_state = dict()
+
+def _cluster_quality_scores(clusters_positions: list[np.ndarray]) -> np.ndarray:
+    """
+        Worker function of `cluster_quality_table`. Returns the `QUALITY_COLUMNS` of every cluster given by its positions.
+        The data is inherited from the parent process through `_shared_quality_state` on fork.
+    """
+    state = _shared_quality_state
+    scores = np.empty((len(clusters_positions), len(QUALITY_COLUMNS)))
+    for i, positions in enumerate(clusters_positions):
+        statistics = cluster_integrety(state["person_data"].iloc[positions], **state["similarity_kwargs"])
+        scores[i] = [statistics[column] for column in QUALITY_COLUMNS]
+    return scores
+
+def cluster_quality_table(person_data: pd.core.frame.DataFrame, clustering: list = None, cluster_col: str = "Person_Entity_ID",
+                          n_jobs: int = 1, tasks_per_job: int = 8, **similarity_kwargs) -> pd.core.frame.DataFrame:
+    """
+        Quality of every cluster of a clustering: one row per cluster with its id, size and the `QUALITY_COLUMNS`
+        of `cluster_integrety`. The clusters are the index lists of `clustering` (id = list position) or, without
+        `clustering`, the groups of `cluster_col` (e.g. an exported Person_Entity_ID column, rows without id are ignored).
+        Singletons have the scores 100 and are not scored. With `n_jobs` > 1, the clusters are scored in a pool
+        of forked processes in tasks of similar numbers of pairs.
+    """
+    if clustering is None:
+        labels, cluster_ids = pd.factorize(person_data[cluster_col], sort=True)
+        positions = np.flatnonzero(labels >= 0)
+        labels = labels[positions]
+    else:
+        positions, labels = _cluster_labels(person_data, clustering)
+        cluster_ids = np.arange(len(clustering))
+    order = np.argsort(labels, kind="stable")
+    positions, labels = positions[order], labels[order]
+    sizes = np.bincount(labels, minlength=len(cluster_ids))
+    clusters_positions = np.split(positions, np.cumsum(sizes)[:-1])
+    quality = pd.DataFrame({cluster_col: cluster_ids, "size": sizes})
+    scores = np.full((len(cluster_ids), len(QUALITY_COLUMNS)), 100.0)
+    scored = np.flatnonzero(sizes > 1)
+    # tasks of similar numbers of pairs, largest clusters first
+    scored = scored[np.argsort(-sizes[scored], kind="stable")]
+    n_tasks = max(1, min(scored.shape[0], n_jobs * tasks_per_job))
+    pairs = sizes[scored].astype(np.int64) ** 2
+    task_of_cluster = (np.cumsum(pairs) - pairs) * n_tasks // max(1, pairs.sum())
+    tasks = [scored[task_of_cluster == task_nr] for task_nr in range(n_tasks)]
+    tasks = [task for task in tasks if task.shape[0] > 0]
+    _shared_quality_state.update(person_data=person_data, similarity_kwargs=similarity_kwargs)
+    try:
+        task_positions = [[clusters_positions[cluster] for cluster in task] for task in tasks]
+        if n_jobs == 1:
+            task_scores = [_cluster_quality_scores(positions) for positions in task_positions]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context("fork")) as executor:
+                task_scores = list(tqdm(executor.map(_cluster_quality_scores, task_positions), total=len(tasks)))
+    finally:
+        _shared_quality_state.clear()
+    for task, task_score in zip(tasks, task_scores):
+        scores[task] = task_score
+    quality[QUALITY_COLUMNS] = scores
+    return quality
 
 def jaccard_distance_cluster(cl1,cl2):
     cl1 = set(cl1)
@@ -154,6 +236,30 @@ def local_semantic_hashing(person_data: pd.core.frame.DataFrame,
         minhashes[i] = minhash
     return lsh, minhashes
 
+def batch_local_semantic_hashing(person_data: pd.core.frame.DataFrame,
+                                 minhash_kwargs: dict  = {"num_perm": 128,},
+                                 lsh_kwargs :dict  = {"threshold":0.01,
+                                                     "num_perm": 128,
+                                                     "weights": (0.4,0.6)},
+                                 leave_one_out_hashing : bool = False,
+                                 signature_path: str = None):
+    """
+        Same as `local_semantic_hashing`, but all MinHash signatures are computed at once as a matrix.
+        Returns the indexing object and the `MinHashSignatures`, which can be indexed by person like the map of hashes.
+        If `signature_path` is given, the signatures are stored there and memory-mapped from there in later runs
+        with the same persons, names, permutations and `leave_one_out_hashing`. Otherwise they are computed again.
+    """
+    expected_metadata = {"num_perm": minhash_kwargs.get("num_perm", 128), "seed": minhash_kwargs.get("seed", 1),
+                         "leave_one_out_hashing": leave_one_out_hashing,
+                         "fingerprint": frame_fingerprint(person_data, ["strLName_processed", "strGName_processed"], index=True)}
+    if signature_path is not None and MinHashSignatures.matches(signature_path, expected_metadata):
+        signatures = MinHashSignatures.load(signature_path)
+    else:
+        signatures = minhash_signatures(person_data, minhash_kwargs, leave_one_out_hashing)
+        if signature_path is not None:
+            signatures.save(signature_path)
+    return signatures.lsh(lsh_kwargs), signatures
+
 def get_buckets_for_name(name, idx_chars,len_chars=3):
     return [(sub_name.lower()[:idx_chars], int(len(sub_name)/len_chars)) for sub_name in name.split(" ") if len(sub_name)>=idx_chars]
 
@@ -166,25 +272,230 @@ def build_buckets(person_data, column, idx_chars=3,len_chars=3):
     return bucket
 
 
+def build_name_pair_buckets(person_data, gname_col="strGName_processed", lname_col="strLName_processed", idx_chars=3):
+    """
+        Buckets keyed by pairs of a first name and a last name bucket. Two persons share a pair bucket exactly if
+        they are in each others intersection of first name and last name buckets. Used to find independent components.
+    """
+    bucket = defaultdict(set)
+    print(f"build name pair buckets")
+    for idx, gname, lname in tqdm(zip(person_data.index, person_data[gname_col], person_data[lname_col]),total=person_data.shape[0]):
+        for fbucket in get_buckets_for_name(gname, idx_chars):
+            for lbucket in get_buckets_for_name(lname, idx_chars):
+                bucket[(fbucket, lbucket)].add(idx)
+    return bucket
+
+def name_pair_bucket_key(fbucket: tuple[str, int], lbucket: tuple[str, int]) -> tuple[str, int]:
+    """
+        Joins a first name and a last name bucket to one (prefix, length-class) key that can be coded by `bucket_key_code`.
+    """
+    return (f"{fbucket[0]}\t{fbucket[1]}\t{lbucket[0]}", lbucket[1])
+
+def bucket_keys_fn(idx_chars=3, len_chars=3, phonetic_encoder=None):
+    """
+        The function from a name to its bucket keys: prefix and length class keys (see `get_buckets_for_name`) or,
+        with `phonetic_encoder`, the whole phonetic codes of the sub-names (see `phonetic_bucket_keys`).
+    """
+    if phonetic_encoder is not None:
+        return lambda name: phonetic_bucket_keys(name, phonetic_encoder)
+    return lambda name: get_buckets_for_name(name, idx_chars, len_chars)
+
+def build_bucket_index(person_data, column, idx_chars=3, len_chars=3, phonetic_encoder=None) -> BlockingIndex:
+    """
+        The buckets of `build_buckets` as a `BlockingIndex`: keys are integer codes of the buckets and the
+        postings are sorted int32 row positions in CSR layout instead of sets of index labels.
+        With `phonetic_encoder` (e.g. "koelner"), the names are keyed by their phonetic codes (see `bucket_keys_fn`).
+    """
+    print(f"build bucket index for {column}")
+    return build_blocking_index(person_data[column], bucket_keys_fn(idx_chars, len_chars, phonetic_encoder),
+                                {"column": column, "idx_chars": idx_chars, "len_chars": len_chars, "phonetic_encoder": phonetic_encoder})
+
+def build_name_pair_bucket_index(person_data, gname_col="strGName_processed", lname_col="strLName_processed", idx_chars=3,
+                                 phonetic_encoder=None) -> BlockingIndex:
+    """
+        The buckets of `build_name_pair_buckets` as a `BlockingIndex`.
+    """
+    print(f"build name pair bucket index")
+    names = person_data[gname_col].fillna("").astype(str) + "\n" + person_data[lname_col].fillna("").astype(str)
+    get_buckets = bucket_keys_fn(idx_chars, 3, phonetic_encoder)
+    def get_keys(names):
+        gname, lname = names.split("\n")
+        return [name_pair_bucket_key(fbucket, lbucket) for fbucket in get_buckets(gname) for lbucket in get_buckets(lname)]
+    return build_blocking_index(names, get_keys, {"gname_col": gname_col, "lname_col": lname_col, "idx_chars": idx_chars,
+                                                  "phonetic_encoder": phonetic_encoder})
+
+class BucketCandidates(Blocker):
+    """
+        Candidate lookup for `agglomerative_clustering`: persons that share a first name bucket and a last name bucket
+        with the given person. The candidates of other persons are given by `candidate_positions` (see `Blocker`).
+        The buckets are `BlockingIndex` objects over the rows of `person_data` and the two postings are merged with
+        a sorted array intersection. Calling the object with a person index returns the index labels of the
+        candidates, `positions` works on row positions.
+        With `max_bucket_size`, larger buckets are refined by `sub_blocking` or skipped (see `guard_bucket_sizes`).
+        With `phonetic_encoder`, the buckets are keyed by phonetic codes instead of prefixes (see `bucket_keys_fn`).
+    """
+    def __init__(self, person_data, gname_col="strGName_processed", lname_col="strLName_processed", idx_chars=3, len_chars=3,
+                 first_name_index: BlockingIndex = None, last_name_index: BlockingIndex = None,
+                 max_bucket_size: int = None, sub_blocking: str = "birth_year", date_col="strDoB_processed", band_width: int = 5,
+                 phonetic_encoder: str = None):
+        self.target_df = person_data
+        self.index = person_data.index
+        self.gname_col, self.lname_col, self.date_col = gname_col, lname_col, date_col
+        self.gnames = person_data[gname_col].fillna("").astype(str).to_numpy()
+        self.lnames = person_data[lname_col].fillna("").astype(str).to_numpy()
+        self.idx_chars = idx_chars
+        self.len_chars = len_chars
+        self.get_buckets = bucket_keys_fn(idx_chars, len_chars, phonetic_encoder)
+        self.sub_blocking = sub_blocking if max_bucket_size is not None else None
+        self.band_width = band_width
+        self.first_name_index = build_bucket_index(person_data, gname_col, idx_chars, len_chars, phonetic_encoder) if first_name_index is None else first_name_index
+        self.last_name_index = build_bucket_index(person_data, lname_col, idx_chars, len_chars, phonetic_encoder) if last_name_index is None else last_name_index
+        self.first_name_codes = self.last_name_codes = np.full(person_data.shape[0], -1, dtype=np.int64)
+        if max_bucket_size is not None:
+            self.first_name_index = guard_bucket_sizes(self.first_name_index, person_data, max_bucket_size, sub_blocking, gname_col, date_col, band_width)
+            self.last_name_index = guard_bucket_sizes(self.last_name_index, person_data, max_bucket_size, sub_blocking, lname_col, date_col, band_width)
+            if sub_blocking is not None:
+                self.first_name_codes = sub_block_codes(person_data, sub_blocking, gname_col, date_col, band_width)
+                self.last_name_codes = sub_block_codes(person_data, sub_blocking, lname_col, date_col, band_width)
+
+    def fit(self, target_df: pd.core.frame.DataFrame) -> "BucketCandidates":
+        # the buckets are built on the person data given to the constructor
+        assert target_df.index.equals(self.index), "The buckets were built on other person data"
+        return self
+
+    def _candidates(self, gname: str, lname: str, first_name_code: int = -1, last_name_code: int = -1) -> np.ndarray:
+        first_bucket = self.first_name_index.lookup(self.get_buckets(gname), first_name_code)
+        last_bucket = self.last_name_index.lookup(self.get_buckets(lname), last_name_code)
+        return np.intersect1d(first_bucket, last_bucket, assume_unique=True)
+
+    def positions(self, pos: int) -> np.ndarray:
+        return self._candidates(self.gnames[pos], self.lnames[pos], self.first_name_codes[pos], self.last_name_codes[pos])
+
+    neighbors = positions
+
+    def candidate_positions(self, src_df):
+        gnames = src_df[self.gname_col].fillna("").astype(str).to_numpy()
+        lnames = src_df[self.lname_col].fillna("").astype(str).to_numpy()
+        first_name_codes = last_name_codes = np.full(src_df.shape[0], -1, dtype=np.int64)
+        if self.sub_blocking is not None:
+            first_name_codes = sub_block_codes(src_df, self.sub_blocking, self.gname_col, self.date_col, self.band_width)
+            last_name_codes = sub_block_codes(src_df, self.sub_blocking, self.lname_col, self.date_col, self.band_width)
+        for src_pos in range(src_df.shape[0]):
+            yield self._candidates(gnames[src_pos], lnames[src_pos], first_name_codes[src_pos], last_name_codes[src_pos])
+
+    def __call__(self, person_idx) -> pd.Index:
+        return self.index[self.positions(self.index.get_loc(person_idx))]
+
+
 # ------------------- Clustering ---------------------------------------------
 
-def local_agglomerative_cluster_fast(pre_cluster:list[int], person_bucket: pd.core.frame.DataFrame,cutoff: float,linkage: str, link_cascade=False):
+class BucketSimilarity():
+    """
+        Pairwise similarity matrix of the persons in `person_bucket`. Rows are computed with `SimilarityModel.matrix`
+        when they are first needed and kept for reuse, so only the rows of cluster members are ever scored.
+        The default `model` is the shared model of `similarity_kwargs` (see `similarity_model`).
+        With `score_cutoff`, scores below it can be lower than the exact scores (see `SimilarityModel.matrix`).
     """
-        Uses agglomerative clustering to compute the cluster of an idividual i. This faster version does only compute linkage score to the initial person i
+    def __init__(self, person_bucket: pd.core.frame.DataFrame, model: SimilarityModel = None, score_cutoff: float = None,
+                 **similarity_kwargs):
+        self.person_bucket = person_bucket
+        self.model = similarity_model(**similarity_kwargs) if model is None else model
+        self.score_cutoff = score_cutoff
+        self._rows = dict()
+
+    def __len__(self):
+        return self.person_bucket.shape[0]
+
+    def row(self, pos: int) -> np.ndarray:
+        if pos not in self._rows:
+            self._rows[pos] = self.model.matrix(self.person_bucket.iloc[[pos]], self.person_bucket, self.score_cutoff)[0]
+        return self._rows[pos]
+
+    def matrix(self) -> np.ndarray:
+        """
+            The full (n x n) similarity matrix of the bucket.
+        """
+        missing = [pos for pos in range(len(self)) if pos not in self._rows]
+        if len(missing) > 0:
+            scores = self.model.matrix(self.person_bucket.iloc[missing], self.person_bucket, self.score_cutoff)
+            self._rows.update(zip(missing, scores))
+        return np.array([self._rows[pos] for pos in range(len(self))]).reshape(len(self), len(self))
+
+class ClusterLinkage():
+    """
+        Linkage scores of every person in a bucket to a growing cluster. The scores are updated incrementally
+        with the similarity row of every new cluster member. An empty cluster has a link score of 100 (see `link_score`).
+    """
+    def __init__(self, similarity: BucketSimilarity, linkage: str):
+        assert linkage in ("single", "average", "max"), "Linkage not defined"
+        self.similarity = similarity
+        self.linkage = linkage
+        self.cluster_size = 0
+        if linkage == "single":
+            self._scores = np.full(len(similarity), -np.inf)
+        elif linkage == "average":
+            self._scores = np.zeros(len(similarity))
+        elif linkage == "max":
+            self._scores = np.full(len(similarity), np.inf)
+
+    def add(self, pos: int):
+        row = self.similarity.row(pos)
+        if self.linkage == "single":
+            np.maximum(self._scores, row, out=self._scores)
+        elif self.linkage == "average":
+            self._scores += row
+        elif self.linkage == "max":
+            np.minimum(self._scores, row, out=self._scores)
+        self.cluster_size += 1
+
+    def score(self, pos: int) -> float:
+        if self.cluster_size == 0:
+            return 100
+        if self.linkage == "average":
+            return self._scores[pos] / self.cluster_size
+        return self._scores[pos]
+
+def matrix_agglomerative_cluster(pre_cluster:list[int], person_bucket: pd.core.frame.DataFrame, cutoff: float, linkage: str, link_cascade=False,
+                                 similarity: BucketSimilarity = None):
+    """
+        Agglomerative clustering of an individual on the pairwise similarity matrix of `person_bucket`.
+        Persons are visited in index order and added if their link score to the current cluster is at least `cutoff`.
+        With `link_cascade`, the remaining persons are visited again until the cluster does not change.
+        `similarity` is the similarity of the bucket, by default a new `BucketSimilarity`.
         Returns an index list
     """
     person_cluster = pre_cluster
+    similarity = BucketSimilarity(person_bucket) if similarity is None else similarity
+    cluster_linkage = ClusterLinkage(similarity, linkage)
+    for pos in person_bucket.index.get_indexer(person_cluster):
+        cluster_linkage.add(pos)
     # persons that do not (yet) belong to a the person_cluster
-    other_persons_idxs = person_bucket.index.difference(person_cluster)
-    for other_person_idx, other_person in person_bucket.loc[other_persons_idxs,:].iterrows():
-        # the score on how likely other_person belongs to the same person
-        score = link_score(other_person,person_bucket.loc[person_cluster,:],linkage)
-        if score >=cutoff:
-            # add other person to the cluster
-            person_cluster.append(other_person_idx)
+    other_persons_pos = person_bucket.index.get_indexer(person_bucket.index.difference(person_cluster))
+    cluster_changed = True
+    while cluster_changed:
+        cluster_changed = False
+        remaining_pos = []
+        for pos in other_persons_pos:
+            if cluster_linkage.score(pos) >= cutoff:
+                # add other person to the cluster
+                person_cluster.append(person_bucket.index[pos])
+                cluster_linkage.add(pos)
+                cluster_changed = link_cascade
+            else:
+                remaining_pos.append(pos)
+        other_persons_pos = remaining_pos
     return person_cluster
 
-def local_agglomerative_cluster(pre_cluster:list[int], person_bucket: pd.core.frame.DataFrame, cutoff: float,linkage: str, iteration:str, link_cascade=False, ):
+def local_agglomerative_cluster_fast(pre_cluster:list[int], person_bucket: pd.core.frame.DataFrame,cutoff: float,linkage: str, link_cascade=False,
+                                     similarity: BucketSimilarity = None):
+    """
+        Uses agglomerative clustering to compute the cluster of an idividual i. This faster version visits every other person only once.
+        Returns an index list
+    """
+    return matrix_agglomerative_cluster(pre_cluster, person_bucket, cutoff, linkage, link_cascade=False, similarity=similarity)
+
+def local_agglomerative_cluster(pre_cluster:list[int], person_bucket: pd.core.frame.DataFrame, cutoff: float,linkage: str, iteration:str, link_cascade=False,
+                                similarity: BucketSimilarity = None):
     """
         Uses agglomerative clustering to compute the cluster of an idividual i.
         Returns an index list
@@ -195,31 +506,58 @@ def local_agglomerative_cluster(pre_cluster:list[int], person_bucket: pd.core.fr
             person_bucket = person_bucket,
             cutoff = cutoff,
             linkage = linkage,
-            link_cascade=link_cascade
+            link_cascade=link_cascade,
+            similarity=similarity
         )
-    person_cluster = pre_cluster
-    # check if an iteration found no new additions
-    cluster_changed = True
-    while cluster_changed:
-        cluster_changed = False
-        # persons that do not (yet) belong to a the person_cluster
-        other_persons_idx = person_bucket.index.difference(person_cluster)
-        for other_person_idx, other_person in person_bucket.loc[other_persons_idx,:].iterrows():
-            # the score on how likely other_person belongs to the same person
-            score = link_score(other_person,person_bucket.loc[person_cluster],linkage)
-            if score >=cutoff:
-                # add other person to the cluster
-                person_cluster.append(other_person_idx)
-                cluster_changed = link_cascade and True
-    return person_cluster
+    return matrix_agglomerative_cluster(pre_cluster, person_bucket, cutoff, linkage, link_cascade=link_cascade, similarity=similarity)
 
-def preprocess_clustering_data(
-        person_data: pd.core.frame.DataFrame,
-        gname_col="strGName_processed", lname_col="strLName_processed"
-) -> pd.core.frame.DataFrame:
-    person_data[gname_col] = person_data[gname_col].apply(preprocess_name)
-    person_data[lname_col] = person_data[lname_col].apply(preprocess_last_name)
-    return person_data
+CHECKPOINT_COLUMNS = ["strGName_processed", "strLName_processed", "strDoB_processed", "prisoner_number", "strPoB_processed"]
+
+def clustering_fingerprint(person_data: pd.core.frame.DataFrame) -> str:
+    """
+        `frame_fingerprint` of the index and the scored columns of `person_data` in `CHECKPOINT_COLUMNS`.
+    """
+    return frame_fingerprint(person_data, [col for col in CHECKPOINT_COLUMNS if col in person_data], index=True)
+
+def clustering_seed_order(person_data: pd.core.frame.DataFrame, known_clusters: Dict[int, list[int]]) -> np.ndarray:
+    """
+        Positions of the persons in `person_data` in the order they are used as cluster seeds:
+        persons with known clusters first, then all other persons in index order.
+    """
+    is_known = person_data.index.isin(list(known_clusters.keys()))
+    known_positions = person_data.index.get_indexer(list(known_clusters.keys()))
+    return np.concatenate([known_positions[known_positions >= 0], np.flatnonzero(~is_known)])
+
+def save_clustering_checkpoint(path: str, cluster_positions: list[np.ndarray], assigned: np.ndarray, seed_order: np.ndarray,
+                               seed_cursor: int, config: dict):
+    """
+        Stores the state of an `agglomerative_clustering` run in the npz file `path`. Clusters are stored as
+        concatenated row positions with offsets. The file is replaced atomically.
+    """
+    cluster_sizes = np.array([cluster.shape[0] for cluster in cluster_positions], dtype=np.int64)
+    members = np.concatenate(cluster_positions) if len(cluster_positions) > 0 else np.zeros(0, dtype=np.int64)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(f,
+                            cluster_members=members.astype(np.int64),
+                            cluster_offsets=np.concatenate([[0], np.cumsum(cluster_sizes)]),
+                            assigned=assigned,
+                            seed_order=seed_order,
+                            seed_cursor=np.array(seed_cursor),
+                            config=np.array(json.dumps(config)))
+    os.replace(tmp_path, path)
+
+def load_clustering_checkpoint(path: str) -> dict:
+    """
+        Loads a checkpoint written by `save_clustering_checkpoint`.
+    """
+    with np.load(path) as checkpoint:
+        members, offsets = checkpoint["cluster_members"], checkpoint["cluster_offsets"]
+        return {"cluster_positions": [members[start:end] for start, end in zip(offsets[:-1], offsets[1:])],
+                "assigned": checkpoint["assigned"].copy(),
+                "seed_order": checkpoint["seed_order"].copy(),
+                "seed_cursor": int(checkpoint["seed_cursor"]),
+                "config": json.loads(str(checkpoint["config"]))}
 
 def agglomerative_clustering(get_bucket_fn,
                              known_clusters: Dict[int, list[int]],
@@ -227,78 +565,298 @@ def agglomerative_clustering(get_bucket_fn,
                              cutoff: float,
                              linkage: str,
                              iteration: str,
-                             allow_known_cluster_merge = False
+                             allow_known_cluster_merge = False,
+                             checkpoint_path: str = None,
+                             checkpoint_every_seconds: float = None,
+                             checkpoint_every_rows: int = None,
+                             resume_from: str = None,
+                             preprocess: bool = True,
+                             verbose: bool = True,
+                             bucket_similarity = BucketSimilarity
                              ):
     """
         This method computes an agglomerative clustering on person_data to build persons.
         Returns a list of index lists.
         This method assumes that no pre-known clusters are merged. They can be extended.
+        Clustered persons are tracked in a boolean mask over row positions, the next seed is the
+        first unassigned person in `clustering_seed_order`.
+        With `checkpoint_path`, the state of the run is written to an npz file whenever `checkpoint_every_seconds`
+        have passed or `checkpoint_every_rows` persons were clustered since the last checkpoint, and at the end of the run.
+        `resume_from` continues a run from such a checkpoint. The run has to use the same data and parameters,
+        the data is checked with `clustering_fingerprint`.
+        With `preprocess=False`, the names in `person_data` are expected to be preprocessed already.
+        `get_bucket_fn` can be a `Blocker`, e.g. a `SortedNeighborhoodBlocker`. It is fitted on `person_data` if needed.
+        `bucket_similarity` builds the similarity of a bucket, e.g. `SimilarityGraph.bucket_similarity`. The default
+        `BucketSimilarity` of the single and max linkage scores the names with the `cutoff` as rapidfuzz `score_cutoff`.
     """
-    not_clustered = person_data.index
+    index = person_data.index
+    num_person_rows = index.shape[0]
     # enumerate known clusters first.
-    enumeration_order = list(known_clusters.keys()) + list(not_clustered.difference(known_clusters.keys()))
-    not_clustered = not_clustered[enumeration_order]
+    seed_order = clustering_seed_order(person_data, known_clusters)
+    assigned = np.zeros(num_person_rows, dtype=bool)
+    is_pre_clustered = index.isin(list(known_clusters.keys()))
     clustering = []
-    num_person_rows = not_clustered.shape[0]
+    cluster_positions = []
+    start_cursor = 0
+    config = {"cutoff": cutoff, "linkage": linkage, "iteration": iteration, 
+              "allow_known_cluster_merge": allow_known_cluster_merge, "num_person_rows": num_person_rows,
+              "fingerprint": clustering_fingerprint(person_data) if checkpoint_path is not None or resume_from is not None else None}
+    if resume_from is not None:
+        checkpoint = load_clustering_checkpoint(resume_from)
+        assert checkpoint["config"] == config, f"Checkpoint {resume_from} was written with a different configuration: {checkpoint['config']}"
+        assert np.array_equal(checkpoint["seed_order"], seed_order), f"Checkpoint {resume_from} was written for different known clusters"
+        cluster_positions, assigned, start_cursor = checkpoint["cluster_positions"], checkpoint["assigned"], checkpoint["seed_cursor"]
+        clustering = [list(index[positions]) for positions in cluster_positions]
+        if verbose:
+            print(f"Resume clustering with {len(clustering)} clusters from {resume_from}")
+    clustered_rows = int(assigned.sum())
+    checkpoint_time, checkpoint_rows = time.monotonic(), clustered_rows
     known_cluster_map = lambda idx: known_clusters[idx] if idx in known_clusters else [idx]
-    pre_clustered_entities = set(known_clusters.keys())
-    print(f"{num_person_rows} Person Rows")
-    print(f"Preprocess Person Data")
-    _person_data = preprocess_clustering_data(person_data)
-    with tqdm(total=num_person_rows) as pbar:
-        while len(not_clustered) > 0:
-            person_idx = not_clustered[0]
+    if verbose:
+        print(f"{num_person_rows} Person Rows")
+    if preprocess:
+        if verbose:
+            print(f"Preprocess Person Data")
+        person_data = preprocess_clustering_data(person_data)
+    if isinstance(get_bucket_fn, Blocker) and not get_bucket_fn.is_fitted():
+        get_bucket_fn = get_bucket_fn.fit(person_data)
+    _person_data = person_data
+    if bucket_similarity is BucketSimilarity and linkage != "average":
+        # single and max linkage only compare scores with the cutoff, so scores below it do not have to be exact
+        bucket_similarity = lambda person_bucket: BucketSimilarity(person_bucket, score_cutoff=cutoff)
+    with tqdm(total=num_person_rows, initial=clustered_rows, disable=not verbose) as pbar:
+        for seed_cursor in range(start_cursor, seed_order.shape[0]):
+            seed_pos = seed_order[seed_cursor]
+            if assigned[seed_pos]:
+                continue
+            person_idx = index[seed_pos]
             # known pre-clustering for td cases or other sources
             pre_cluster = known_cluster_map(person_idx)
+            pre_cluster_positions = index.get_indexer(pre_cluster)
+            assert (pre_cluster_positions >= 0).all(), \
+                f"Known cluster of {person_idx} contains persons missing in person_data: {[idx for idx, pos in zip(pre_cluster, pre_cluster_positions) if pos < 0]}"
             # get similar persons from the lsh index
             # person_bucket = lsh.query(minhashes[person_idx])
-            person_bucket = {bucket_idx for idx in pre_cluster for bucket_idx in get_bucket_fn(idx)}
-            if not allow_known_cluster_merge:
-                person_bucket = person_bucket.difference(pre_clustered_entities)
-            person_bucket = list(person_bucket)
+            bucket_positions = index.get_indexer(list({bucket_idx for idx in pre_cluster for bucket_idx in get_bucket_fn(idx)}))
+            bucket_positions = bucket_positions[bucket_positions >= 0]
             # reduce to person_information that are not already clustered
-            person_bucket = not_clustered.intersection(person_bucket)
-            person_bucket = person_bucket.union(pre_cluster)
+            bucket_mask = ~assigned[bucket_positions]
+            if not allow_known_cluster_merge:
+                bucket_mask &= ~is_pre_clustered[bucket_positions]
+            bucket_positions = np.union1d(bucket_positions[bucket_mask], pre_cluster_positions)
             # slice in which the person_cluster of person_idx is computed 
-            person_bucket = _person_data.loc[person_bucket]
+            person_bucket = _person_data.iloc[bucket_positions]
+            similarity = bucket_similarity(person_bucket)
             # new person
             person_cluster = local_agglomerative_cluster(pre_cluster,
                                                          person_bucket,
                                                          cutoff,
                                                          linkage,
-                                                         iteration,)
+                                                         iteration,
+                                                         similarity=similarity)
             if len(person_cluster) == 0:
                 person_cluster = pre_cluster
             clustering.append(person_cluster)
-            not_clustered = not_clustered.difference(person_cluster)
+            cluster_positions.append(index.get_indexer(person_cluster))
+            clustered_rows += int((~assigned[cluster_positions[-1]]).sum())
+            assigned[cluster_positions[-1]] = True
             # update 
             pbar.update(len(person_cluster))
+            if checkpoint_path is not None:
+                if (checkpoint_every_seconds is not None and time.monotonic() - checkpoint_time >= checkpoint_every_seconds) \
+                   or (checkpoint_every_rows is not None and clustered_rows - checkpoint_rows >= checkpoint_every_rows):
+                    save_clustering_checkpoint(checkpoint_path, cluster_positions, assigned, seed_order, seed_cursor + 1, config)
+                    checkpoint_time, checkpoint_rows = time.monotonic(), clustered_rows
+    if checkpoint_path is not None:
+        save_clustering_checkpoint(checkpoint_path, cluster_positions, assigned, seed_order, seed_order.shape[0], config)
     return clustering
 
+def graph_agglomerative_clustering(graph: SimilarityGraph,
+                                   known_clusters: Dict[int, list[int]],
+                                   person_data: pd.core.frame.DataFrame,
+                                   cutoff: float,
+                                   linkage: str,
+                                   iteration: str = "fast",
+                                   **clustering_kwargs):
+    """
+        `agglomerative_clustering` on the scored pairs of a `SimilarityGraph`, e.g. the candidate edges of a blocker
+        scored by `score_candidate_edges`. No persons are scored, so other cutoffs and linkages can be tried quickly.
+        The candidates of a person are its graph neighbors and pairs without an edge score 0.
+    """
+    graph = graph.fit(person_data)
+    return agglomerative_clustering(graph, known_clusters, person_data, cutoff, linkage, iteration, preprocess=False,
+                                    bucket_similarity=graph.bucket_similarity, **clustering_kwargs)
+
+# ------------------- Parallel Clustering ---------------------------------------------
+
+def bucket_components(person_data: pd.core.frame.DataFrame, buckets: "list[dict | BlockingIndex]", known_clusters: Dict[int, list[int]] = dict()) -> np.ndarray:
+    """
+        Connected components of the bucket overlap graph: persons are connected if they share a bucket in one of the 
+        bucket dicts in `buckets` (see `build_buckets`) or a known cluster. Returns the component label of every row.
+        A `BlockingIndex` in `buckets` has to be built on the rows of `person_data` (see `build_bucket_index`).
+    """
+    disjoint_set = DisjointSet(person_data.shape[0])
+    for bucket in buckets:
+        if isinstance(bucket, BlockingIndex):
+            # connect every posting to the first row of its bucket
+            bucket_sizes = bucket.bucket_sizes()
+            first_rows = np.repeat(np.asarray(bucket.row_ids)[bucket.indptr[:-1][bucket_sizes > 0]], bucket_sizes[bucket_sizes > 0])
+            disjoint_set.union_pairs(first_rows, bucket.row_ids)
+    buckets = [bucket for bucket in buckets if not isinstance(bucket, BlockingIndex)]
+    clusters = [bucket_members for bucket in buckets for bucket_members in bucket.values()] + list(known_clusters.values())
+    cluster_sizes = np.array([len(cluster) for cluster in clusters], dtype=np.int64)
+    positions = person_data.index.get_indexer([idx for cluster in clusters for idx in cluster])
+    first_positions = np.repeat(positions[(np.cumsum(cluster_sizes) - cluster_sizes)[cluster_sizes > 0]], cluster_sizes[cluster_sizes > 0])
+    known = (positions >= 0) & (first_positions >= 0)
+    disjoint_set.union_pairs(first_positions[known], positions[known])
+    return disjoint_set.labels()
+
+_shared_clustering_state = dict()
+
+def _cluster_components(positions: np.ndarray) -> list[list]:
+    """
+        Worker function for the parallel clustering. Clusters the persons at `positions`, which have to be a union
+        of bucket components. The data is inherited from the parent process through `_shared_clustering_state` on fork.
+    """
+    state = _shared_clustering_state
+    person_data = state["person_data"].iloc[positions]
+    known_clusters = {idx: list(cluster) for idx, cluster in state["known_clusters"].items() if idx in person_data.index}
+    return agglomerative_clustering(state["get_bucket_fn"], known_clusters, person_data, preprocess=False, verbose=False, **state["kwargs"])
+
+def parallel_agglomerative_clustering(get_bucket_fn,
+                                      known_clusters: Dict[int, list[int]],
+                                      person_data: pd.core.frame.DataFrame,
+                                      cutoff: float,
+                                      linkage: str,
+                                      iteration: str,
+                                      buckets: "list[dict | BlockingIndex]",
+                                      allow_known_cluster_merge = False,
+                                      n_jobs: int = None,
+                                      tasks_per_job: int = 8):
+    """
+        Parallel version of `agglomerative_clustering`. Persons are partitioned into the connected components of the 
+        bucket overlap graph of `buckets` (see `bucket_components`), which have to contain every candidate returned
+        by `get_bucket_fn`. Seeds in different components can not interact, so components are clustered independently
+        in a pool of `n_jobs` forked processes. The clusters are sorted by the seed order of the serial run, so the 
+        result equals `agglomerative_clustering` with allow_known_cluster_merge=False.
+        A `Blocker` is fitted on all persons before the fork, the workers only query it.
+        Parallel runs do not write checkpoints.
+    """
+    n_jobs = os.cpu_count() if n_jobs is None else n_jobs
+    print(f"{person_data.shape[0]} Person Rows")
+    print(f"Preprocess Person Data")
+    person_data = preprocess_clustering_data(person_data)
+    if isinstance(get_bucket_fn, Blocker) and not get_bucket_fn.is_fitted():
+        # fitted on a worker subset, e.g. the windows of a `SortedNeighborhoodBlocker` would differ from the serial run
+        get_bucket_fn = get_bucket_fn.fit(person_data)
+    print(f"Compute bucket components")
+    components = bucket_components(person_data, buckets, known_clusters)
+    # group components into tasks of similar size, largest components first
+    component_sizes = np.bincount(components)
+    task_size = max(1, int(np.ceil(person_data.shape[0] / (n_jobs * tasks_per_job))))
+    tasks, task, task_rows = [], [], 0
+    for component in np.argsort(-component_sizes, kind="stable"):
+        task.append(component)
+        task_rows += component_sizes[component]
+        if task_rows >= task_size:
+            tasks.append(task)
+            task, task_rows = [], 0
+    if len(task) > 0:
+        tasks.append(task)
+    task_of_component = np.zeros(component_sizes.shape[0], dtype=np.int64)
+    for task_nr, task in enumerate(tasks):
+        task_of_component[task] = task_nr
+    row_tasks = task_of_component[components]
+    task_positions = [np.flatnonzero(row_tasks == task_nr) for task_nr in range(len(tasks))]
+    print(f"Cluster {component_sizes.shape[0]} components in {len(tasks)} tasks")
+    _shared_clustering_state.update(get_bucket_fn=get_bucket_fn, known_clusters=known_clusters, person_data=person_data,
+                                    kwargs=dict(cutoff=cutoff, linkage=linkage, iteration=iteration, allow_known_cluster_merge=allow_known_cluster_merge))
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context("fork")) as executor:
+            task_clusterings = list(tqdm(executor.map(_cluster_components, task_positions), total=len(tasks)))
+    finally:
+        _shared_clustering_state.clear()
+    # a cluster is created by its seed, the member that comes first in the seed order
+    clustering = [cluster for task_clustering in task_clusterings for cluster in task_clustering]
+    seed_rank = np.empty(person_data.shape[0], dtype=np.int64)
+    seed_rank[clustering_seed_order(person_data, known_clusters)] = np.arange(person_data.shape[0])
+    cluster_ranks = [seed_rank[person_data.index.get_indexer(cluster)].min() for cluster in clustering]
+    return [clustering[i] for i in np.argsort(cluster_ranks, kind="stable")]
+
 # ---------------------- Export  ----------------------------
 
+def _cluster_labels(person_data, clustering) -> tuple[np.ndarray, np.ndarray]:
+    """
+        Positions of all clustered persons in `person_data` and the index of their cluster.
+        Built with one indexer lookup over the concatenated clusters.
+    """
+    cluster_sizes = np.fromiter((len(cluster) for cluster in clustering), dtype=np.int64, count=len(clustering))
+    persons = [person for cluster in clustering for person in cluster]
+    labels = np.repeat(np.arange(len(clustering), dtype=np.int64), cluster_sizes)
+    positions = person_data.index.get_indexer(persons) if len(persons) > 0 else np.zeros(0, dtype=np.int64)
+    # persons that are not in person_data are ignored
+    known = positions >= 0
+    return positions[known], labels[known]
+
 def cluster_column(person_data, clustering):
-    person_cluster_map = dict()
-    for cluster_idx, cluster in enumerate(clustering):
-        for person in cluster:
-            person_cluster_map[person] = cluster_idx
-    cluster_col = person_data.index.to_series().apply(lambda idx: int(person_cluster_map[idx])
-                                                      if idx in person_cluster_map 
-                                                      else None)
+    """
+        Returns the index of the cluster of every row in `person_data` as nullable Int64 column.
+        Rows that are in no cluster are NA. If a person is in several clusters, the last cluster is used.
+    """
+    positions, labels = _cluster_labels(person_data, clustering)
+    cluster_ids = np.full(person_data.shape[0], -1, dtype=np.int64)
+    cluster_ids[positions] = labels
+    return pd.Series(cluster_ids, index=person_data.index, dtype="Int64").mask(cluster_ids < 0)
+
+def cluster_size_column(person_data, clustering):
+    """
+        Returns the size of the cluster of every row in `person_data` as nullable Int64 column (see `cluster_column`).
+    """
+    positions, labels = _cluster_labels(person_data, clustering)
+    cluster_sizes = np.fromiter((len(cluster) for cluster in clustering), dtype=np.int64, count=len(clustering))
+    sizes = np.full(person_data.shape[0], -1, dtype=np.int64)
+    sizes[positions] = cluster_sizes[labels]
+    return pd.Series(sizes, index=person_data.index, dtype="Int64").mask(sizes < 0)
+
+def export_clustering(person_data, clustering, id_col="Person_Entity_ID", size_col=None):
+    """
+        Writes the cluster ids of `clustering` to `id_col` of `person_data` and optionally the cluster sizes to `size_col`.
+    """
+    person_data[id_col] = cluster_column(person_data, clustering)
+    if size_col is not None:
+        person_data[size_col] = cluster_size_column(person_data, clustering)
+    return person_data
+
+def merged_cluster_column(person_data, *clusterings):
+    """
+        Merges several clusterings (lists of index lists, e.g. prisoner number clusters, TD number clusters and the
+        agglomerative clustering) with union-find. Clusters that share a person are merged.
+        Returns the cluster id of every row as Int64 column, rows that are in no cluster are NA.
+    """
+    clusters = [list(cluster) for clustering in clusterings for cluster in clustering]
+    cluster_sizes = np.array([len(cluster) for cluster in clusters], dtype=np.int64)
+    positions = person_data.index.get_indexer([idx for cluster in clusters for idx in cluster])
+    assert (positions >= 0).all(), "Clusters contain unknown indices"
+    cluster_starts = np.cumsum(cluster_sizes) - cluster_sizes
+    disjoint_set = DisjointSet(person_data.shape[0])
+    disjoint_set.union_pairs(np.repeat(positions[cluster_starts[cluster_sizes > 0]], cluster_sizes[cluster_sizes > 0]), positions)
+    clustered = np.zeros(person_data.shape[0], dtype=bool)
+    clustered[positions] = True
+    cluster_ids, _ = pd.factorize(disjoint_set.labels()[clustered])
+    cluster_col = pd.Series(pd.NA, index=person_data.index, dtype="Int64")
+    cluster_col[clustered] = cluster_ids
     return cluster_col
 
 # ---------------------- Fix Known Clusters  ----------------------------
 
 def clean_td_cases(person_data, td_col="TD_number"):
-    td_clustering = person_data[person_data["TD_number"].notna()].groupby(["TD_number"])[["lObjId","lCountId"]].apply(lambda group: list(group.groupby(["lObjId","lCountId"]).groups.keys()))
-    clustering = person_data.groupby(["Person_Entity_ID"])[["lObjId","lCountId"]].apply(lambda group: list(group.groupby(["lObjId","lCountId"]).groups.keys()))
-    has_known_entity = {idx for cluster in td_clustering for idx in cluster}
-    clustering = [[idx for idx in cluster if idx not in has_known_entity] for cluster in clustering]
-    clustering = [cluster for cluster in clustering if len(cluster)>0]
-    clustering = [*clustering, *list(td_clustering.values)]
-    ids_to_row_idx = dict()
-    for row_idx, row in person_data.iterrows():
-        ids_to_row_idx[(row["lObjId"],row["lCountId"])] = row_idx
-    row_idx_clustering = [[ids_to_row_idx[idx] for idx in cluster] for cluster in clustering]
-    person_data["Person_Entity_ID"] = cluster_column(person_data, row_idx_clustering)
+    """
+        Replaces the Person_Entity_ID of all rows with a TD number by a cluster per TD number.
+        The remaining rows keep their clusters. Clusters are renumbered: first the Person_Entity_ID clusters, then the TD clusters.
+    """
+    has_td = person_data[td_col].notna().to_numpy()
+    entity_ids, _ = pd.factorize(person_data["Person_Entity_ID"].where(~has_td), sort=True)
+    td_ids, _ = pd.factorize(person_data[td_col].where(has_td), sort=True)
+    cluster_ids = np.where(has_td, entity_ids.max(initial=-1) + 1 + td_ids, entity_ids)
+    person_data["Person_Entity_ID"] = pd.Series(cluster_ids, index=person_data.index, dtype="Int64").mask(cluster_ids < 0)
     return person_data
@@ -0,0 +1,61 @@
+import heapq
+import numpy as np
+
+# ------------------------- Top N Selection ---------------------------------
+
+class TopNCollector():
+    """
+        Collects the `n` best scored items with a score of at least `min_score`.
+        Items are kept in a bounded min-heap. For equal scores the item that was added first is preferred.
+    """
+    def __init__(self, n: int, min_score: float = -np.inf):
+        self.n = n
+        self.min_score = min_score
+        self._heap = [] # entries (score, -insertion number, item), the worst entry on top
+        self._cnt = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, score: float, item):
+        entry = (score, -self._cnt, item)
+        self._cnt += 1
+        if not score >= self.min_score or self.n <= 0:
+            return
+        if len(self._heap) < self.n:
+            heapq.heappush(self._heap, entry)
+        elif entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+
+    def add_batch(self, scores: np.ndarray, items):
+        """
+            Adds all `items` with their `scores`. Only the `n` best candidates of the batch are pushed to the heap,
+            they are preselected with `numpy.partition`.
+        """
+        scores = np.asarray(scores)
+        candidates = np.flatnonzero(scores >= self.min_score)
+        if candidates.shape[0] > self.n:
+            candidate_scores = scores[candidates]
+            kth_score = np.partition(candidate_scores, -self.n)[-self.n] if self.n > 0 else np.inf
+            above = candidates[candidate_scores > kth_score]
+            at = candidates[candidate_scores == kth_score][:self.n - above.shape[0]]
+            candidates = np.sort(np.concatenate([above, at]))
+        cnt = self._cnt
+        for pos in candidates:
+            self._cnt = cnt + pos
+            self.add(scores[pos], items[pos])
+        self._cnt = cnt + scores.shape[0]
+
+    def min_accepted_score(self) -> float:
+        """
+            The score a new item has to exceed to be collected.
+        """
+        if len(self._heap) < self.n:
+            return self.min_score
+        return self._heap[0][0]
+
+    def result(self) -> list[tuple[float, object]]:
+        """
+            Returns the collected (score, item) pairs in increasing order of scores.
+        """
+        return [(score, item) for score, _, item in sorted(self._heap, key=lambda entry: entry[:2])]
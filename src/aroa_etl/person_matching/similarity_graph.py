@@ -0,0 +1,243 @@
+import glob
+import json
+import os
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from aroa_etl.person_matching.blockers import Blocker
+from aroa_etl.person_matching.clustering_preprocessing import preprocess_clustering_data
+from aroa_etl.person_matching.similarity_measures import SimilarityModel
+
+# ------------------------- Edge List Export ---------------------------------
+
+EDGE_FORMATS = ("npz", "parquet")
+
+class EdgeWriter():
+    """
+        Streams scored pairs (src, dst, score) as int32, int32, float32 columns to chunk files in the directory `path`.
+        Edges are buffered and written every `chunk_size` edges to `{prefix}_{chunk_nr:05d}.npz` or `.parquet`
+        (parquet needs a pandas parquet engine like pyarrow). Several writers with different `prefix` can write
+        to the same directory, e.g. one per worker process.
+        `close` writes `{prefix}_metadata.json` with the counts and `metadata`, e.g. whether src and dst are positions
+        in different frames (bipartite, see `read_edge_metadata`).
+    """
+    def __init__(self, path: str, chunk_size: int = 1_000_000, format: str = "npz", prefix: str = "edges", metadata: dict = None):
+        assert format in EDGE_FORMATS, f"Edge format has to be one of {EDGE_FORMATS}"
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.chunk_size = chunk_size
+        self.format = format
+        self.prefix = prefix
+        self.metadata = dict() if metadata is None else metadata
+        self.num_chunks = 0
+        self.num_edges = 0
+        self._buffer = []
+        self._buffered_edges = 0
+
+    def add(self, src, dst, score):
+        """
+            Adds the edges src[i] - dst[i] with score[i]. `src` can be a single position.
+        """
+        dst = np.asarray(dst, dtype=np.int32)
+        src = np.broadcast_to(np.asarray(src, dtype=np.int32), dst.shape)
+        self._buffer.append((src, dst, np.asarray(score, dtype=np.float32)))
+        self._buffered_edges += dst.shape[0]
+        if self._buffered_edges >= self.chunk_size:
+            self.flush()
+
+    def _chunk_path(self, chunk_nr: int) -> str:
+        return os.path.join(self.path, f"{self.prefix}_{chunk_nr:05d}.{self.format}")
+
+    def flush(self):
+        if self._buffered_edges == 0:
+            return
+        src, dst, score = (np.concatenate(column) for column in zip(*self._buffer))
+        chunk_path = self._chunk_path(self.num_chunks)
+        if self.format == "npz":
+            np.savez(chunk_path, src=src, dst=dst, score=score)
+        else:
+            pd.DataFrame({"src": src, "dst": dst, "score": score}).to_parquet(chunk_path, index=False)
+        self.num_chunks += 1
+        self.num_edges += self._buffered_edges
+        self._buffer, self._buffered_edges = [], 0
+
+    def close(self):
+        self.flush()
+        with open(os.path.join(self.path, f"{self.prefix}_metadata.json"), "w") as f:
+            json.dump({**self.metadata, "num_edges": self.num_edges, "num_chunks": self.num_chunks, "format": self.format}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def edge_chunk_paths(path: str) -> list[str]:
+    return sorted(chunk_path for format in EDGE_FORMATS for chunk_path in glob.glob(os.path.join(path, f"*.{format}")))
+
+def iter_edge_chunks(path: str):
+    """
+        Yields the (src, dst, score) arrays of every chunk file written by `EdgeWriter` to `path`.
+    """
+    for chunk_path in edge_chunk_paths(path):
+        if chunk_path.endswith(".npz"):
+            with np.load(chunk_path) as chunk:
+                yield chunk["src"], chunk["dst"], chunk["score"]
+        else:
+            chunk = pd.read_parquet(chunk_path)
+            yield chunk["src"].to_numpy(np.int32), chunk["dst"].to_numpy(np.int32), chunk["score"].to_numpy(np.float32)
+
+def read_edge_metadata(path: str) -> list[dict]:
+    """
+        The metadata files of all writers that wrote to `path`.
+    """
+    metadata = []
+    for metadata_path in sorted(glob.glob(os.path.join(path, "*_metadata.json"))):
+        with open(metadata_path) as f:
+            metadata.append(json.load(f))
+    return metadata
+
+def edges_match(path: str, expected_metadata: dict) -> bool:
+    """
+        Whether `path` contains edges whose writers all stored `expected_metadata`, e.g. to reuse scored edges.
+    """
+    metadata = read_edge_metadata(path) if os.path.isdir(path) else []
+    return len(metadata) > 0 and all(all(m.get(key) == value for key, value in expected_metadata.items()) for m in metadata)
+
+def remove_edges(path: str):
+    """
+        Removes the chunk and metadata files of all writers in `path`.
+    """
+    for file_path in [*edge_chunk_paths(path), *glob.glob(os.path.join(path, "*_metadata.json"))]:
+        os.remove(file_path)
+
+def read_edges(path: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+        All edges of the chunk files in `path` as (src, dst, score) arrays.
+    """
+    chunks = list(iter_edge_chunks(path))
+    if len(chunks) == 0:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+    return tuple(np.concatenate(column) for column in zip(*chunks))
+
+def score_candidate_edges(person_data: pd.core.frame.DataFrame, blocker: Blocker, edge_path: str, chunk_size: int = 1_000_000,
+                          format: str = "npz", preprocess: bool = True, metadata: dict = None, verbose: bool = True,
+                          **similarity_kwargs) -> int:
+    """
+        Scores every person in `person_data` against its candidates of the fitted `blocker` with a `SimilarityModel` of
+        `similarity_kwargs` and streams the edges to `edge_path`. Every candidate pair is scored once. Returns the number of edges.
+        The edges do not depend on a cutoff or linkage, `graph_agglomerative_clustering` reclusters from them. With `preprocess`,
+        the names of a copy of `person_data` are preprocessed like in `agglomerative_clustering` before scoring.
+        Edges of earlier runs in `edge_path` are removed, `metadata` is stored with the edges (see `edges_match`).
+    """
+    if preprocess:
+        person_data = preprocess_clustering_data(person_data.copy())
+    if not blocker.is_fitted():
+        blocker = blocker.fit(person_data)
+    if os.path.isdir(edge_path):
+        remove_edges(edge_path)
+    metadata = {**({} if metadata is None else metadata), "bipartite": False, "num_rows": person_data.shape[0]}
+    model = SimilarityModel(**similarity_kwargs).compile(person_data.columns)
+    with EdgeWriter(edge_path, chunk_size, format, metadata=metadata) as edge_writer:
+        for pos in tqdm(range(person_data.shape[0]), disable=not verbose):
+            candidates = blocker.neighbors(pos)
+            candidates = candidates[candidates > pos]
+            if candidates.shape[0] > 0:
+                scores = model.matrix(person_data.iloc[[pos]], person_data.iloc[candidates])[0]
+                edge_writer.add(pos, candidates, scores)
+    return edge_writer.num_edges
+
+# ------------------------- Similarity Graph ---------------------------------
+
+class SimilarityGraph(Blocker):
+    """
+        Undirected graph of scored person pairs in CSR layout, e.g. the edges written by `score_candidate_edges`.
+        Edges are positions in the person data the graph is fitted on. A pair scored in both directions keeps the
+        higher score. As a blocker, the candidates of a person are its neighbors in the graph and the person itself.
+        `bucket_similarity` replaces the `BucketSimilarity` of the clustering, so a clustering can be recomputed
+        with another cutoff or linkage without scoring persons again. Pairs without an edge score 0.
+        The edges of `person_matching` are bipartite (src and dst are positions in different frames) and can not be loaded.
+    """
+    def __init__(self, src: np.ndarray, dst: np.ndarray, score: np.ndarray, num_rows: int = None):
+        src, dst, score = np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64), np.asarray(score, dtype=np.float32)
+        no_loop = src != dst
+        src, dst, score = src[no_loop], dst[no_loop], score[no_loop]
+        num_rows = int(max(src.max(initial=-1), dst.max(initial=-1)) + 1) if num_rows is None else num_rows
+        # both directions, highest score per pair first
+        rows, cols, scores = np.concatenate([src, dst]), np.concatenate([dst, src]), np.concatenate([score, score])
+        order = np.lexsort((-scores, cols, rows))
+        rows, cols, scores = rows[order], cols[order], scores[order]
+        first = np.ones(rows.shape[0], dtype=bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        self.indices = cols[first].astype(np.int32)
+        self.scores = scores[first]
+        self.indptr = np.zeros(num_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows[first], minlength=num_rows), out=self.indptr[1:])
+        self.num_rows = num_rows
+
+    @classmethod
+    def load(cls, path: str, num_rows: int = None) -> "SimilarityGraph":
+        for metadata in read_edge_metadata(path):
+            assert not metadata.get("bipartite", False), f"The edges in {path} link two frames and are no similarity graph"
+            assert num_rows is None or metadata.get("num_rows", num_rows) == num_rows, \
+                f"The edges in {path} were written for {metadata.get('num_rows')} rows"
+        return cls(*read_edges(path), num_rows=num_rows)
+
+    @property
+    def num_edges(self) -> int:
+        return self.indices.shape[0] // 2
+
+    def edges(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+            Every edge once as (src, dst, score) arrays with src < dst.
+        """
+        rows = np.repeat(np.arange(self.num_rows, dtype=np.int32), np.diff(self.indptr))
+        upper = rows < self.indices
+        return rows[upper], self.indices[upper], self.scores[upper]
+
+    def fit(self, target_df: pd.core.frame.DataFrame) -> "SimilarityGraph":
+        assert target_df.shape[0] == self.num_rows, "The graph was built on person data with a different number of rows"
+        self.target_df = target_df
+        return self
+
+    def candidate_positions(self, src_df: pd.core.frame.DataFrame):
+        # source persons are persons of the fitted data
+        for pos in self.target_df.index.get_indexer(src_df.index):
+            yield self.neighbors(pos)
+
+    def neighbors(self, pos: int) -> np.ndarray:
+        return np.union1d(self.indices[self.indptr[pos]:self.indptr[pos+1]], [pos])
+
+    def similarity_row(self, pos: int, positions: np.ndarray) -> np.ndarray:
+        """
+            Scores of the person at `pos` to the persons at `positions`, 0 without edge and 100 to itself.
+        """
+        row_indices = self.indices[self.indptr[pos]:self.indptr[pos+1]]
+        row_scores = self.scores[self.indptr[pos]:self.indptr[pos+1]]
+        row = np.zeros(positions.shape[0])
+        if row_indices.shape[0] > 0:
+            found = np.minimum(np.searchsorted(row_indices, positions), row_indices.shape[0] - 1)
+            has_edge = row_indices[found] == positions
+            row[has_edge] = row_scores[found[has_edge]]
+        row[positions == pos] = 100
+        return row
+
+    def bucket_similarity(self, person_bucket: pd.core.frame.DataFrame) -> "GraphBucketSimilarity":
+        return GraphBucketSimilarity(self, self.target_df.index.get_indexer(person_bucket.index))
+
+class GraphBucketSimilarity():
+    """
+        Similarity matrix of a bucket read from a `SimilarityGraph` (same interface as `BucketSimilarity`).
+    """
+    def __init__(self, graph: SimilarityGraph, positions: np.ndarray):
+        self.graph = graph
+        self.positions = positions
+
+    def __len__(self):
+        return self.positions.shape[0]
+
+    def row(self, pos: int) -> np.ndarray:
+        return self.graph.similarity_row(self.positions[pos], self.positions)
+
+    def matrix(self) -> np.ndarray:
+        return np.array([self.row(pos) for pos in range(len(self))]).reshape(len(self), len(self))
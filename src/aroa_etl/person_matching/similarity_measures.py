@@ -1,10 +1,12 @@
-from  rapidfuzz import fuzz, utils
+from  rapidfuzz import fuzz, process, utils
 import re
 import numpy as np
 import math
 import pandas as pd
 from aroa_etl.attribute_processing.string_utils import preprocess_name, preprocess_last_name
+from aroa_etl.person_matching.name_cache import cached_name_score
 from tqdm import tqdm
+from functools import lru_cache
 from rapidfuzz import fuzz, utils
 
 # ------------------------- Person Similarity Measure ---------------------------------
@@ -89,76 +91,538 @@ def simple_date_matcher(src_date: str, target_date: str):
     return score
     
 
-def name_matcher(src_name: str, target_name: str):
+def fuzzy_matcher(scorer, src_name: str, target_name: str, score_cutoff: float = 0):
     """
-        Fuzzy matching for names. Two empty/nan names are treated as match.
+        Fuzzy matching of two names with the rapidfuzz `scorer`. Returns -1 if a name is empty.
+        Scores below `score_cutoff` can be returned as 0 (see `cached_name_score`).
     """
     score = -1
     if __not_empty(src_name) and __not_empty(target_name):
-        score = fuzz.ratio(src_name,target_name,processor=utils.default_process)
-        score = score
+        score = cached_name_score(scorer,src_name,target_name,score_cutoff)
     return score
 
-def name_set_matcher(src_name: str, target_name: str):
+def name_matcher(src_name: str, target_name: str, score_cutoff: float = 0):
+    """
+        Fuzzy matching for names. Two empty/nan names are treated as match.
+        Scores below `score_cutoff` can be returned as 0 (see `cached_name_score`).
+    """
+    return fuzzy_matcher(fuzz.ratio, src_name, target_name, score_cutoff)
+
+def name_set_matcher(src_name: str, target_name: str, score_cutoff: float = 0):
     """
         Fuzzy matching for names. Two empty/nan names are treated as match. Order of names is ignored
+        Scores below `score_cutoff` can be returned as 0 (see `cached_name_score`).
     """
-    score = -1
-    if __not_empty(src_name) and __not_empty(target_name):
-        score = fuzz.token_set_ratio(src_name,target_name,processor=utils.default_process)
-        score = score
-    return score
+    return fuzzy_matcher(fuzz.token_set_ratio, src_name, target_name, score_cutoff)
 
 
-def person_similarity(src_person: pd.core.series.Series, trg_person: pd.core.series.Series,
-                      src_gname_col="strGName_processed",src_lname_col="strLName_processed",src_date_col="strDoB_processed",
-                      src_prisoner_number="prisoner_number",src_birthplace = "strPoB_processed",
-                      target_gname_col="strGName_processed",target_lname_col="strLName_processed",target_date_col="strDoB_processed",
-                      target_prisoner_number="prisoner_number",target_birthplace = "strPoB_processed",
-                      date_matcher=date_similarity, name_only=False, non_names_optional=False
-                      ):
-    # primary
-    primary_scores = []
-    if src_lname_col in src_person:
-        score = max(0,name_set_matcher(src_person[src_lname_col], trg_person[target_lname_col]))
-        primary_scores.append(score)
-    if src_gname_col in src_person:
-        score = max(0,name_set_matcher(src_person[src_gname_col], trg_person[target_gname_col]))
-        primary_scores.append(score)
-    primary_scores = [s for s in primary_scores if s>=0]
-    primary_score = np.sum(primary_scores)/2 if len(primary_scores) > 0 else 0
-    if name_only:
-        return primary_score 
-    # secondary ids
+def _secundary_score(src_person: pd.core.series.Series, trg_person: pd.core.series.Series,
+                     src_date_col, src_prisoner_number, target_date_col, target_prisoner_number,
+                     date_matcher=date_similarity, non_names_optional=False) -> float:
+    """
+        Mean of the prisoner number and birth date scores of `person_similarity`.
+    """
     secundary_scores = []
     if src_prisoner_number in src_person:
         score = name_matcher(src_person[src_prisoner_number], trg_person[target_prisoner_number])
         secundary_scores.append(score)
-    if src_date_col in src_person:
+    src_date_parsed, trg_date_parsed = parsed_date_columns(src_date_col), parsed_date_columns(target_date_col)
+    if src_date_col in src_person and date_matcher is date_similarity and src_date_parsed[0] in src_person and trg_date_parsed[0] in trg_person:
+        score = max(0,parsed_date_similarity(*(src_person[col] for col in src_date_parsed), *(trg_person[col] for col in trg_date_parsed)))
+        secundary_scores.append(score)
+    elif src_date_col in src_person:
         score = max(0,date_matcher(src_person[src_date_col],trg_person[target_date_col]))
         secundary_scores.append(score)
     secundary_scores = [s for s in secundary_scores if s>=0]
     if len(secundary_scores) > 0:
-        secundary_score = np.array(secundary_scores).mean()
+        return np.array(secundary_scores).mean()
     elif non_names_optional:
-        secundary_score = -1
-    else:
-        secundary_score= 0
-    # other
-    other_scores = []
-    if src_birthplace in src_person:
-        score = name_matcher(src_person[src_birthplace],trg_person[target_birthplace])
-        other_scores.append(score)
-    other_scores = [s for s in other_scores if s>=0]
-    if len(other_scores) > 0:
-        other_score = np.array(other_scores).mean()
-    else:
+        return -1
+    return 0
+
+def person_similarity(src_person: pd.core.series.Series, trg_person: pd.core.series.Series,
+                      src_gname_col="strGName_processed",src_lname_col="strLName_processed",src_date_col="strDoB_processed",
+                      src_prisoner_number="prisoner_number",src_birthplace = "strPoB_processed",
+                      target_gname_col="strGName_processed",target_lname_col="strLName_processed",target_date_col="strDoB_processed",
+                      target_prisoner_number="prisoner_number",target_birthplace = "strPoB_processed",
+                      date_matcher=date_similarity, name_only=False, non_names_optional=False
+                      ):
+    """
+        Weighted similarity of two persons given as Series, scored by the shared `SimilarityModel` of the arguments
+        (see `similarity_model`).
+    """
+    model = similarity_model(src_gname_col=src_gname_col, src_lname_col=src_lname_col, src_date_col=src_date_col,
+                             src_prisoner_number=src_prisoner_number, src_birthplace=src_birthplace,
+                             target_gname_col=target_gname_col, target_lname_col=target_lname_col, target_date_col=target_date_col,
+                             target_prisoner_number=target_prisoner_number, target_birthplace=target_birthplace,
+                             date_matcher=date_matcher, name_only=name_only, non_names_optional=non_names_optional)
+    return model.series_score(src_person, trg_person)
+
+def _required_score(bound, threshold: float) -> float:
+    """
+        Smallest component score x in [0, 100] with bound(x) >= threshold for an increasing affine `bound`.
+    """
+    low, high = bound(0), bound(100)
+    if low >= threshold:
+        return 0
+    # a little lower, so that rounding does not cut off a score at the threshold
+    return max(0, (threshold - low) * 100 / (high - low) - 1e-6)
+
+def _batch_required_score(low: np.ndarray, high: np.ndarray, threshold: float) -> float:
+    """
+        `_required_score` for arrays of pair bounds from `low` (component score 0) to `high` (component score 100):
+        the smallest component score one of the pairs needs to reach `threshold`. Pairs whose bound does not depend
+        on the component or that can not reach `threshold` are left out.
+    """
+    threshold = threshold - 1e-6
+    relevant = (high > low) & (high >= threshold)
+    if not relevant.any():
+        return 100
+    low, high = low[relevant], high[relevant]
+    # a little lower, `process.cdist` compares scores with the cutoff in single precision
+    return max(0, float(((threshold - low) * 100 / (high - low)).min()) - 1e-3)
+
+def bounded_person_similarity(src_person: pd.core.series.Series, trg_person: pd.core.series.Series, threshold: float,
+                              src_gname_col="strGName_processed",src_lname_col="strLName_processed",src_date_col="strDoB_processed",
+                              src_prisoner_number="prisoner_number",src_birthplace = "strPoB_processed",
+                              target_gname_col="strGName_processed",target_lname_col="strLName_processed",target_date_col="strDoB_processed",
+                              target_prisoner_number="prisoner_number",target_birthplace = "strPoB_processed",
+                              date_matcher=date_similarity, name_only=False, non_names_optional=False
+                              ):
+    """
+        `person_similarity` with early exit for a `threshold` like the clustering cutoff or `min_match_score`.
+        Returns the score of `person_similarity` if it is at least `threshold`, otherwise a value below `threshold`.
+        The cheap prisoner number and date scores are computed first, then the last name, the first name and the
+        birthplace. Every name is scored with the rapidfuzz `score_cutoff` it needs to reach `threshold` if all
+        remaining scores were 100, and the scoring stops as soon as `threshold` can not be reached any more.
+    """
+    has_lname, has_gname, has_birthplace = src_lname_col in src_person, src_gname_col in src_person, src_birthplace in src_person
+    secundary_score = -1 if name_only else _secundary_score(src_person, trg_person, src_date_col, src_prisoner_number,
+                                                            target_date_col, target_prisoner_number, date_matcher, non_names_optional)
+    combine = similarity_model()._combine
+    def bound(lname_score, gname_score, other_score):
+        primary_score = ((lname_score if has_lname else 0) + (gname_score if has_gname else 0)) / 2
+        return primary_score if name_only else float(combine(primary_score, secundary_score, other_score))
+    # optimistic scores of the components that are not scored yet
+    lname_score, gname_score, other_score = 100, 100, 100 if has_birthplace and not name_only else -1
+    score = bound(lname_score, gname_score, other_score)
+    if score < threshold:
+        return score
+    if has_lname:
+        score_cutoff = _required_score(lambda x: bound(x, gname_score, other_score), threshold)
+        lname_score = max(0, name_set_matcher(src_person[src_lname_col], trg_person[target_lname_col], score_cutoff))
+        score = bound(lname_score, gname_score, other_score)
+        if score < threshold:
+            return score
+    if has_gname:
+        score_cutoff = _required_score(lambda x: bound(lname_score, x, other_score), threshold)
+        gname_score = max(0, name_set_matcher(src_person[src_gname_col], trg_person[target_gname_col], score_cutoff))
+        score = bound(lname_score, gname_score, other_score)
+        if score < threshold:
+            return score
+    if other_score >= 0:
+        score_cutoff = _required_score(lambda x: bound(lname_score, gname_score, x), threshold)
+        other_score = name_matcher(src_person[src_birthplace], trg_person[target_birthplace], score_cutoff)
+        score = bound(lname_score, gname_score, other_score)
+    return score
+
+
+# ------------------------- Batch Person Similarity ---------------------------------
+
+_EMPTY_FIELDS = ["", "00000000", "-1.0", "-1"]
+
+def _field_array(values) -> np.ndarray:
+    """
+        Converts `values` into an object array of strings. Missing values become empty strings.
+    """
+    values = pd.Series(values, dtype=object)
+    return values.where(values.notna(), "").astype(str).to_numpy(dtype=object)
+
+def _not_empty_mask(values: np.ndarray) -> np.ndarray:
+    """
+        Vectorized version of `__not_empty` for an array produced by `_field_array`.
+    """
+    return ~pd.Series(values, dtype=object).isin(_EMPTY_FIELDS).to_numpy()
+
+def _batch_fuzzy_matcher(src_names, target_names, scorer, score_cutoff: float = 0) -> np.ndarray:
+    """
+        Scores every name in `src_names` against every name in `target_names` with `rapidfuzz.process.cdist`.
+        Scores below `score_cutoff` are 0.
+    """
+    src_names = _field_array(src_names)
+    target_names = _field_array(target_names)
+    scores = process.cdist(src_names, target_names, scorer=scorer, processor=utils.default_process, dtype=np.float64,
+                           score_cutoff=score_cutoff)
+    return np.where(_valid_pairs(src_names, target_names, paired=False), scores, -1.0)
+
+def _paired_fuzzy_matcher(src_names, target_names, scorer, score_cutoff: float = 0) -> np.ndarray:
+    """
+        Scores src_names[i] against target_names[i] with `rapidfuzz.process.cpdist`. Returns a (len(src_names),) score array.
+        Scores below `score_cutoff` are 0.
+    """
+    src_names = _field_array(src_names)
+    target_names = _field_array(target_names)
+    scores = process.cpdist(src_names, target_names, scorer=scorer, processor=utils.default_process, dtype=np.float64,
+                            score_cutoff=score_cutoff)
+    return np.where(_valid_pairs(src_names, target_names, paired=True), scores, -1.0)
+
+def _valid_pairs(src_names: np.ndarray, target_names: np.ndarray, paired: bool) -> np.ndarray:
+    """
+        Mask of the pairs where both names are not empty, aligned pairs if `paired`, else every src against every target.
+        The names are arrays produced by `_field_array`.
+    """
+    src_valid, target_valid = _not_empty_mask(src_names), _not_empty_mask(target_names)
+    return src_valid & target_valid if paired else src_valid[:, None] & target_valid[None, :]
+
+def batch_name_matcher(src_names, target_names) -> np.ndarray:
+    """
+        Matrix version of `name_matcher`. Returns a (len(src_names), len(target_names)) score array.
+    """
+    return _batch_fuzzy_matcher(src_names, target_names, fuzz.ratio)
+
+def batch_name_set_matcher(src_names, target_names) -> np.ndarray:
+    """
+        Matrix version of `name_set_matcher`. Returns a (len(src_names), len(target_names)) score array.
+    """
+    return _batch_fuzzy_matcher(src_names, target_names, fuzz.token_set_ratio)
+
+def parse_dates(dates) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+        Vectorized version of `parse_date`. Returns int16 year, int8 month and int8 day arrays. 
+        Dates that can not be parsed are marked with -1 in all three arrays.
+    """
+    dates = pd.Series(dates, dtype=object).astype(str).reset_index(drop=True)
+    parsed = dates.str.extract(r"^(?P<year>\d\d\d\d)(?P<month>\d\d)(?P<day>\d\d)\.?0?$")
+    dotted = dates.str.extract(r"^(?P<day>\d\d)\.(?P<month>\d\d)\.(?P<year>\d\d\d\d)$")
+    parsed = parsed.fillna(dotted)
+    to_array = lambda part, dtype: pd.to_numeric(parsed[part]).fillna(-1).to_numpy(dtype=dtype)
+    return to_array("year", np.int16), to_array("month", np.int8), to_array("day", np.int8)
+
+def parsed_date_columns(date_col: str) -> tuple[str, str, str]:
+    return f"{date_col}_year", f"{date_col}_month", f"{date_col}_day"
+
+def add_parsed_date_columns(person_data: pd.core.frame.DataFrame, date_col="strDoB_processed") -> pd.core.frame.DataFrame:
+    """
+        Parses `date_col` once and stores year, month and day as compact integer columns next to it
+        (see `parsed_date_columns`). Unparsable dates are -1. `person_similarity` and `batch_person_similarity` 
+        use these columns instead of parsing the dates on every comparison.
+    """
+    year_col, month_col, day_col = parsed_date_columns(date_col)
+    person_data[year_col], person_data[month_col], person_data[day_col] = parse_dates(person_data[date_col])
+    return person_data
+
+def parsed_date_similarity(year_1: int, month_1: int, day_1: int, year_2: int, month_2: int, day_2: int):
+    """
+        `date_similarity` on dates that are already parsed (see `add_parsed_date_columns`).
+    """
+    if year_1 < 0 or year_2 < 0:
+        return -1
+    year_1, month_1, day_1, year_2, month_2, day_2 = map(int, (year_1, month_1, day_1, year_2, month_2, day_2))
+    year_score = compute_year_score(year_1,year_2)
+    month_score, day_score = day_month_score(day_1,day_2,month_1,month_2)
+    # check reversed 
+    month_score_reversed, day_score_reversed = day_month_score(day_1,month_2,month_1,day_2)
+    if month_score + day_score <= month_score_reversed + day_score_reversed:
+        month_score, day_score = month_score_reversed, day_score_reversed
+    score = 100
+    for s in [year_score, month_score, day_score]:
+        if s>=0:
+            score = score - (100-s)
+    return max(0, score)
+
+def _number_diff_array(num_1: np.ndarray, num_2: np.ndarray) -> np.ndarray:
+    # differences larger than 3 already yield a score of 0. Clipping avoids overflows of the power.
+    difference = 5 ** np.minimum(np.abs(num_1 - num_2), 3) - 1
+    return np.maximum(0, 100 - difference)
+
+def _unknown_to_negative(score: np.ndarray, num_1: np.ndarray, num_2: np.ndarray) -> np.ndarray:
+    return np.where((num_1 == 0) | (num_2 == 0), -1, score)
+
+def date_similarity_arrays(year_1, month_1, day_1, year_2, month_2, day_2) -> np.ndarray:
+    """
+        Vectorized version of `date_similarity` on parsed dates (see `parse_dates`). 
+        The arguments are broadcasted against each other, e.g. (n,1) source arrays against (1,m) target arrays.
+    """
+    # widen the compact parsed dtypes to avoid overflows
+    year_1, month_1, day_1, year_2, month_2, day_2 = (np.asarray(a, dtype=np.int32) for a in (year_1, month_1, day_1, year_2, month_2, day_2))
+    year_score = _unknown_to_negative(_number_diff_array(year_1, year_2), year_1, year_2)
+    month_score = _unknown_to_negative(_number_diff_array(month_1, month_2), month_1, month_2)
+    day_score = _unknown_to_negative(_number_diff_array(day_1, day_2), day_1, day_2)
+    # check reversed 
+    month_score_reversed = _unknown_to_negative(_number_diff_array(month_1, day_2), month_1, day_2)
+    day_score_reversed = _unknown_to_negative(_number_diff_array(day_1, month_2), day_1, month_2)
+    reversed_q = month_score + day_score <= month_score_reversed + day_score_reversed
+    month_score = np.where(reversed_q, month_score_reversed, month_score)
+    day_score = np.where(reversed_q, day_score_reversed, day_score)
+
+    score = 100
+    for s in [year_score, month_score, day_score]:
+        score = score - np.where(s >= 0, 100 - s, 0)
+    score = np.maximum(0, score)
+    unparsed = (year_1 < 0) | (year_2 < 0)
+    return np.where(unparsed, -1, score)
+
+def batch_date_similarity(src_dates, target_dates) -> np.ndarray:
+    """
+        Matrix version of `date_similarity`. Returns a (len(src_dates), len(target_dates)) score array.
+        `src_dates` and `target_dates` are date strings or (year, month, day) tuples of parsed date arrays.
+    """
+    src_year, src_month, src_day = src_dates if type(src_dates) == tuple else parse_dates(src_dates)
+    trg_year, trg_month, trg_day = target_dates if type(target_dates) == tuple else parse_dates(target_dates)
+    return date_similarity_arrays(
+        np.asarray(src_year)[:, None], np.asarray(src_month)[:, None], np.asarray(src_day)[:, None],
+        np.asarray(trg_year)[None, :], np.asarray(trg_month)[None, :], np.asarray(trg_day)[None, :]
+    ).astype(np.float64)
+
+def _parsed_dates(persons: pd.core.frame.DataFrame, date_col: str):
+    """
+        Returns the precomputed (year, month, day) columns of `date_col` or the date strings if they are missing.
+    """
+    columns = list(parsed_date_columns(date_col))
+    if all(col in persons for col in columns):
+        return tuple(persons[col].to_numpy() for col in columns)
+    return persons[date_col]
+
+def batch_person_similarity(src_persons: pd.core.frame.DataFrame, trg_persons: pd.core.frame.DataFrame,
+                            src_gname_col="strGName_processed",src_lname_col="strLName_processed",src_date_col="strDoB_processed",
+                            src_prisoner_number="prisoner_number",src_birthplace = "strPoB_processed",
+                            target_gname_col="strGName_processed",target_lname_col="strLName_processed",target_date_col="strDoB_processed",
+                            target_prisoner_number="prisoner_number",target_birthplace = "strPoB_processed",
+                            date_matcher=date_similarity, name_only=False, non_names_optional=False, score_cutoff: float = None
+                            ) -> np.ndarray:
+    """
+        Batch version of `person_similarity`. Scores every person in `src_persons` against every person in `trg_persons`
+        and returns a (len(src_persons), len(trg_persons)) score array with `SimilarityModel.matrix` of the shared model
+        of the arguments. Names are scored with `rapidfuzz.process.cdist`, dates with vectorized arithmetic.
+        With `score_cutoff`, scores of at least `score_cutoff` are exact and lower scores can be lower (see `SimilarityModel.matrix`).
+    """
+    model = similarity_model(src_gname_col=src_gname_col, src_lname_col=src_lname_col, src_date_col=src_date_col,
+                             src_prisoner_number=src_prisoner_number, src_birthplace=src_birthplace,
+                             target_gname_col=target_gname_col, target_lname_col=target_lname_col, target_date_col=target_date_col,
+                             target_prisoner_number=target_prisoner_number, target_birthplace=target_birthplace,
+                             date_matcher=date_matcher, name_only=name_only, non_names_optional=non_names_optional)
+    return model.matrix(src_persons, trg_persons, score_cutoff)
+
+# ------------------------- Similarity Model ---------------------------------
+
+SIMILARITY_FIELDS = ("lname", "gname", "prisoner_number", "date", "birthplace")
+
+class SimilarityModel():
+    """
+        The weighted person similarity as an object that holds the columns, comparators and weights.
+        `compile` resolves the columns of the source and target data to integer offsets once, fields whose
+        source column is missing (or None) are left out.
+        `score` scores two rows given as tuples (e.g. from `itertuples(index=False, name=None)`), `batch` scores
+        aligned pairs of rows and `matrix` every source row against every target row. `batch` and `matrix` use the
+        compiled offsets only for frames with the compiled columns and resolve the offsets of other frames.
+        Primary names count with the remaining weight, prisoner number and date with `secundary_weight`,
+        the birthplace with `other_weight`. The default model gives the scores of `person_similarity`.
+    """
+    def __init__(self, src_gname_col="strGName_processed",src_lname_col="strLName_processed",src_date_col="strDoB_processed",
+                 src_prisoner_number="prisoner_number",src_birthplace = "strPoB_processed",
+                 target_gname_col="strGName_processed",target_lname_col="strLName_processed",target_date_col="strDoB_processed",
+                 target_prisoner_number="prisoner_number",target_birthplace = "strPoB_processed",
+                 date_matcher=date_similarity, name_only=False, non_names_optional=False,
+                 name_scorer=fuzz.token_set_ratio, id_scorer=fuzz.ratio, birthplace_scorer=fuzz.ratio,
+                 secundary_weight: float = 1/3, other_weight: float = 1/4):
+        self.src_columns = dict(zip(SIMILARITY_FIELDS, (src_lname_col, src_gname_col, src_prisoner_number, src_date_col, src_birthplace)))
+        self.target_columns = dict(zip(SIMILARITY_FIELDS, (target_lname_col, target_gname_col, target_prisoner_number, target_date_col, target_birthplace)))
+        self.date_matcher = date_matcher
+        self.name_only = name_only
+        self.non_names_optional = non_names_optional
+        self.name_scorer = name_scorer
+        self.id_scorer = id_scorer
+        self.birthplace_scorer = birthplace_scorer
+        self.secundary_weight = secundary_weight
+        self.other_weight = other_weight
+        self.compiled_columns = None
+        self._frame_offsets = None
+
+    def _resolve(self, src_columns: pd.Index, target_columns: pd.Index) -> tuple[dict, dict, tuple, tuple]:
+        """
+            The field offsets in `src_columns` and `target_columns` and the offsets of the parsed date columns (or None).
+        """
+        offsets = lambda columns, column: columns.get_loc(column) if column is not None and column in columns else None
+        src_offsets, target_offsets = dict(), dict()
+        for field in SIMILARITY_FIELDS:
+            src_offset = offsets(src_columns, self.src_columns[field])
+            if src_offset is not None:
+                assert self.target_columns[field] in target_columns, f"Target column {self.target_columns[field]} is missing"
+                src_offsets[field] = src_offset
+                target_offsets[field] = target_columns.get_loc(self.target_columns[field])
+        src_date_offsets = target_date_offsets = None
+        if "date" in src_offsets and self.date_matcher is date_similarity:
+            src_date_columns, target_date_columns = parsed_date_columns(self.src_columns["date"]), parsed_date_columns(self.target_columns["date"])
+            if all(col in src_columns for col in src_date_columns) and all(col in target_columns for col in target_date_columns):
+                src_date_offsets = tuple(src_columns.get_loc(col) for col in src_date_columns)
+                target_date_offsets = tuple(target_columns.get_loc(col) for col in target_date_columns)
+        return src_offsets, target_offsets, src_date_offsets, target_date_offsets
+
+    def compile(self, src_columns, target_columns=None) -> "SimilarityModel":
+        """
+            Resolves the fields to offsets in `src_columns` and `target_columns` (default `src_columns`), e.g. `df.columns`.
+            The precomputed date columns of `add_parsed_date_columns` are used if both sides have them.
+        """
+        src_columns = pd.Index(src_columns)
+        target_columns = src_columns if target_columns is None else pd.Index(target_columns)
+        self.compiled_columns = (src_columns, target_columns)
+        self._compiled_offsets = self._resolve(src_columns, target_columns)
+        return self
+
+    def is_compiled(self) -> bool:
+        return self.compiled_columns is not None
+
+    def _offsets(self, src_columns: pd.Index, target_columns: pd.Index) -> tuple[dict, dict, tuple, tuple]:
+        """
+            The offsets for rows with `src_columns` and `target_columns`. Other columns than the compiled ones, e.g. the
+            same columns in another order, are resolved again. The offsets of the last other columns are kept.
+        """
+        if self.is_compiled() and src_columns.equals(self.compiled_columns[0]) and target_columns.equals(self.compiled_columns[1]):
+            return self._compiled_offsets
+        frame_offsets = self._frame_offsets
+        if frame_offsets is not None and src_columns.equals(frame_offsets[0]) and target_columns.equals(frame_offsets[1]):
+            return frame_offsets[2]
+        offsets = self._resolve(src_columns, target_columns)
+        self._frame_offsets = (src_columns, target_columns, offsets)
+        return offsets
+
+    def _combine(self, primary_score, secundary_score, other_score):
+        score = np.where(secundary_score >= 0, (1 - self.secundary_weight) * primary_score + self.secundary_weight * secundary_score, primary_score)
+        return np.where(other_score >= 0, (1 - self.other_weight) * score + self.other_weight * other_score, score)
+
+    def score(self, src_row: tuple, trg_row: tuple) -> float:
+        """
+            Similarity of two rows of the compiled source and target columns.
+        """
+        assert self.is_compiled(), "The model has to be compiled for the columns of the rows"
+        return self._score(src_row, trg_row, self._compiled_offsets)
+
+    def series_score(self, src_person: pd.core.series.Series, trg_person: pd.core.series.Series) -> float:
+        """
+            Similarity of two persons given as Series, e.g. the rows of `iterrows`.
+        """
+        return self._score(tuple(src_person), tuple(trg_person), self._offsets(src_person.index, trg_person.index))
+
+    def _score(self, src_row: tuple, trg_row: tuple, offsets: tuple) -> float:
+        src, trg, src_date_offsets, target_date_offsets = offsets
+        # primary
+        primary_score = 0
+        if "lname" in src:
+            primary_score += max(0, fuzzy_matcher(self.name_scorer, src_row[src["lname"]], trg_row[trg["lname"]]))
+        if "gname" in src:
+            primary_score += max(0, fuzzy_matcher(self.name_scorer, src_row[src["gname"]], trg_row[trg["gname"]]))
+        primary_score = primary_score / 2
+        if self.name_only:
+            return primary_score
+        # secondary ids
+        secundary_scores = []
+        if "prisoner_number" in src:
+            score = fuzzy_matcher(self.id_scorer, src_row[src["prisoner_number"]], trg_row[trg["prisoner_number"]])
+            if score >= 0:
+                secundary_scores.append(score)
+        if src_date_offsets is not None:
+            secundary_scores.append(max(0, parsed_date_similarity(*(src_row[offset] for offset in src_date_offsets),
+                                                                  *(trg_row[offset] for offset in target_date_offsets))))
+        elif "date" in src:
+            secundary_scores.append(max(0, self.date_matcher(src_row[src["date"]], trg_row[trg["date"]])))
+        if len(secundary_scores) > 0:
+            secundary_score = sum(secundary_scores) / len(secundary_scores)
+        else:
+            secundary_score = -1 if self.non_names_optional else 0
+        # other
         other_score = -1
+        if "birthplace" in src:
+            other_score = fuzzy_matcher(self.birthplace_scorer, src_row[src["birthplace"]], trg_row[trg["birthplace"]])
+        return float(self._combine(primary_score, secundary_score, other_score))
+
+    def _scores(self, src_df: pd.core.frame.DataFrame, trg_df: pd.core.frame.DataFrame, paired: bool,
+                score_cutoff: float = None) -> np.ndarray:
+        src, trg, src_date_offsets, target_date_offsets = self._offsets(src_df.columns, trg_df.columns)
+        shape = (src_df.shape[0],) if paired else (src_df.shape[0], trg_df.shape[0])
+        if src_df.shape[0] == 0 or trg_df.shape[0] == 0:
+            return np.zeros(shape)
+        fuzzy = _paired_fuzzy_matcher if paired else _batch_fuzzy_matcher
+        src_column = lambda field: src_df.iloc[:, src[field]]
+        trg_column = lambda field: trg_df.iloc[:, trg[field]]
+        secundary_score = other_score = np.full(shape, -1.0)
+        if not self.name_only:
+            # secondary ids
+            secundary_sum, secundary_cnt = np.zeros(shape), np.zeros(shape)
+            if "prisoner_number" in src:
+                score = fuzzy(src_column("prisoner_number"), trg_column("prisoner_number"), self.id_scorer)
+                secundary_sum += np.maximum(0, score)
+                secundary_cnt += score >= 0
+            if "date" in src:
+                if self.date_matcher is date_similarity:
+                    if src_date_offsets is not None:
+                        src_dates = tuple(src_df.iloc[:, offset].to_numpy() for offset in src_date_offsets)
+                        trg_dates = tuple(trg_df.iloc[:, offset].to_numpy() for offset in target_date_offsets)
+                    else:
+                        src_dates, trg_dates = parse_dates(src_column("date")), parse_dates(trg_column("date"))
+                    score = date_similarity_arrays(*src_dates, *trg_dates) if paired else batch_date_similarity(src_dates, trg_dates)
+                elif paired:
+                    score = np.array([self.date_matcher(src_date, trg_date) for src_date, trg_date in zip(src_column("date"), trg_column("date"))], dtype=np.float64)
+                else:
+                    score = np.array([[self.date_matcher(src_date, trg_date) for trg_date in trg_column("date")]
+                                      for src_date in src_column("date")], dtype=np.float64).reshape(shape)
+                secundary_sum += np.maximum(0, score)
+                secundary_cnt += 1
+            secundary_score = np.divide(secundary_sum, secundary_cnt, out=np.full(shape, -1.0 if self.non_names_optional else 0.0), where=secundary_cnt > 0)
+            if "birthplace" in src and score_cutoff is not None:
+                # optimistic birthplace score until it is scored
+                valid = _valid_pairs(_field_array(src_column("birthplace")), _field_array(trg_column("birthplace")), paired)
+                other_score = np.where(valid, 100.0, -1.0)
+        def bound(lname_score, gname_score, other_score):
+            primary_score = (lname_score + gname_score) / 2
+            return primary_score if self.name_only else self._combine(primary_score, secundary_score, other_score)
+        def component_scores(field, scorer, component_bound):
+            # with `score_cutoff`, only the targets of pairs that reach it if the components not scored yet score 100
+            # are scored with the rapidfuzz cutoff they need, the other pairs score 0
+            if score_cutoff is None:
+                return fuzzy(src_column(field), trg_column(field), scorer)
+            low, high = component_bound(0), component_bound(100)
+            reachable = high >= score_cutoff - 1e-6
+            targets = reachable if paired else reachable.any(axis=0)
+            scores = np.zeros(shape)
+            if targets.any():
+                src_names = src_column(field).to_numpy()[targets] if paired else src_column(field)
+                scores[..., targets] = fuzzy(src_names, trg_column(field).to_numpy()[targets], scorer,
+                                             _batch_required_score(low, high, score_cutoff))
+            return scores
+        # primary
+        lname_score = np.full(shape, 100.0 if "lname" in src else 0.0)
+        gname_score = np.full(shape, 100.0 if "gname" in src else 0.0)
+        if "lname" in src:
+            lname_score = np.maximum(0, component_scores("lname", self.name_scorer, lambda x: bound(x, gname_score, other_score)))
+        if "gname" in src:
+            gname_score = np.maximum(0, component_scores("gname", self.name_scorer, lambda x: bound(lname_score, x, other_score)))
+        # other
+        if "birthplace" in src and not self.name_only:
+            other_score = component_scores("birthplace", self.birthplace_scorer,
+                                           lambda x: bound(lname_score, gname_score, np.where(other_score >= 0, x, -1.0)))
+        return bound(lname_score, gname_score, other_score)
+
+    def batch(self, src_df: pd.core.frame.DataFrame, trg_df: pd.core.frame.DataFrame, score_cutoff: float = None) -> np.ndarray:
+        """
+            Similarity of the aligned pairs (src_df row i, trg_df row i), e.g. the edges of a candidate list.
+            `score_cutoff` works like in `matrix`.
+        """
+        assert src_df.shape[0] == trg_df.shape[0], "Batch scoring needs aligned rows"
+        return self._scores(src_df, trg_df, paired=True, score_cutoff=score_cutoff)
 
-    # combine with weights
-    score = primary_score
-    if secundary_score >= 0:
-        score = 2/3 * score + 1/3 * secundary_score
-    if other_score >=0:
-        score =  3/4 * score + 1/4 * other_score
-    return score 
+    def matrix(self, src_df: pd.core.frame.DataFrame, trg_df: pd.core.frame.DataFrame, score_cutoff: float = None) -> np.ndarray:
+        """
+            (len(src_df), len(trg_df)) similarity matrix like `batch_person_similarity`.
+            With `score_cutoff`, e.g. `min_match_score`, the names are scored with the rapidfuzz `score_cutoff` that the
+            pairs need to reach it (like `bounded_person_similarity`). Scores of at least `score_cutoff` are exact,
+            lower scores can be lower.
+        """
+        return self._scores(src_df, trg_df, paired=False, score_cutoff=score_cutoff)
+
+@lru_cache(maxsize=64)
+def similarity_model(**similarity_kwargs) -> SimilarityModel:
+    """
+        The shared `SimilarityModel` of the keyword arguments, used by `person_similarity` and `batch_person_similarity`.
+        The model is not compiled, `batch`, `matrix` and `series_score` resolve the offsets of the given frames.
+    """
+    return SimilarityModel(**similarity_kwargs)
@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+from aroa_etl.person_matching.disjoint_set import DisjointSet
+from aroa_etl.person_matching.similarity_graph import SimilarityGraph
+
+# ------------------------- Clustering Comparison ---------------------------------
+
+def _pairs(counts: np.ndarray) -> int:
+    counts = counts.astype(np.int64)
+    return int((counts * (counts - 1) // 2).sum())
+
+def pairwise_agreement(labels: np.ndarray, reference_labels: np.ndarray) -> dict:
+    """
+        Pairwise precision, recall and F1 of the clustering `labels` against `reference_labels` (cluster label per
+        position): a pair of persons counts if both clusterings put it into one cluster.
+    """
+    labels, reference_labels = np.asarray(labels), np.asarray(reference_labels)
+    assert labels.shape == reference_labels.shape, "The clusterings have to be on the same persons"
+    pairs = _pairs(np.unique(labels, return_counts=True)[1])
+    reference_pairs = _pairs(np.unique(reference_labels, return_counts=True)[1])
+    common_pairs = _pairs(np.unique(np.stack([labels, reference_labels]), axis=1, return_counts=True)[1])
+    precision = common_pairs / pairs if pairs > 0 else 1.0
+    recall = common_pairs / reference_pairs if reference_pairs > 0 else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+    return {"pairwise_precision": precision, "pairwise_recall": recall, "pairwise_f1": f1}
+
+def cluster_size_stats(labels: np.ndarray) -> dict:
+    """
+        Number of clusters and the distribution of the cluster sizes of a clustering given as label per position.
+    """
+    sizes = np.unique(labels, return_counts=True)[1]
+    if sizes.shape[0] == 0:
+        return {"clusters": 0, "singletons": 0, "mean_size": 0.0, "median_size": 0.0, "p99_size": 0.0, "max_size": 0, "clustered_pairs": 0}
+    return {"clusters": int(sizes.shape[0]), "singletons": int((sizes == 1).sum()), "mean_size": float(sizes.mean()),
+            "median_size": float(np.median(sizes)), "p99_size": float(np.percentile(sizes, 99)), "max_size": int(sizes.max()),
+            "clustered_pairs": _pairs(sizes)}
+
+# ------------------------- Threshold Sweep ---------------------------------
+
+class _LinkageMerger():
+    """
+        Incremental complete ("max") or average linkage on edges visited in decreasing score order. Keeps the number
+        and the sum of the visited edges between every two clusters. Two clusters are merged when an edge between them
+        is visited and all their pairs have an edge (max) or the sum of the edges divided by all pairs is at least the
+        current threshold (average). Pairs without a visited edge count as 0.
+    """
+    def __init__(self, disjoint_set: DisjointSet, linkage: str):
+        self.disjoint_set = disjoint_set
+        self.linkage = linkage
+        self.sizes = np.bincount(disjoint_set.roots(), minlength=len(disjoint_set)).astype(np.int64)
+        self.links = defaultdict(dict)
+
+    def add(self, i: int, j: int, score: float, threshold: float):
+        root_i, root_j = self.disjoint_set.find(i), self.disjoint_set.find(j)
+        if root_i == root_j:
+            return
+        count, total = self.links[root_i].get(root_j, (0, 0.0))
+        count, total = count + 1, total + score
+        self.links[root_i][root_j] = self.links[root_j][root_i] = (count, total)
+        num_pairs = self.sizes[root_i] * self.sizes[root_j]
+        if (self.linkage == "max" and count == num_pairs) or (self.linkage == "average" and total / num_pairs >= threshold):
+            self._merge(root_i, root_j)
+
+    def _merge(self, root_i: int, root_j: int):
+        root = self.disjoint_set.union(root_i, root_j)
+        other = root_j if root == root_i else root_i
+        self.sizes[root] += self.sizes[other]
+        root_links, other_links = self.links[root], self.links.pop(other, {})
+        root_links.pop(other, None)
+        # the links of the merged cluster are the sums of the links of both clusters
+        for cluster, (count, total) in other_links.items():
+            if cluster == root:
+                continue
+            root_count, root_total = root_links.get(cluster, (0, 0.0))
+            root_links[cluster] = self.links[cluster][root] = (root_count + count, root_total + total)
+            del self.links[cluster][other]
+
+def sweep_labels(graph: SimilarityGraph, thresholds, linkage: str = "single", known_clusters: list = []):
+    """
+        Clusterings of the persons of `graph` for every threshold in `thresholds`, from the highest to the lowest.
+        The edges are sorted once and visited in decreasing score order, every threshold only adds the edges down to it,
+        so the whole sweep costs about as much as one clustering at the lowest threshold.
+        With "single" linkage, the clusters are the connected components of the edges with a score of at least the
+        threshold (exact). "max" and "average" linkage are approximated by `_LinkageMerger`: the merge test is made when
+        an edge between two clusters is visited, pairs without edge count as 0 and clusters are never split.
+        `known_clusters` (lists of positions, e.g. prisoner number clusters) are united before the first threshold.
+        Yields (threshold, label per position).
+    """
+    assert linkage in ("single", "average", "max"), "Linkage not defined"
+    src, dst, score = graph.edges()
+    order = np.argsort(-score, kind="stable")
+    src, dst, score = src[order].tolist(), dst[order].tolist(), score[order]
+    disjoint_set = DisjointSet(graph.num_rows)
+    disjoint_set.union_clusters(known_clusters)
+    merger = _LinkageMerger(disjoint_set, linkage) if linkage != "single" else None
+    edge_pos = 0
+    for threshold in sorted(thresholds, reverse=True):
+        end = int(np.searchsorted(-score, -threshold, side="right"))
+        for i, j, edge_score in zip(src[edge_pos:end], dst[edge_pos:end], score[edge_pos:end].tolist()):
+            if merger is None:
+                disjoint_set.union(i, j)
+            else:
+                merger.add(i, j, edge_score, threshold)
+        edge_pos = max(edge_pos, end)
+        yield threshold, disjoint_set.labels()
+
+def threshold_sweep(graph: SimilarityGraph, thresholds, linkage: str = "single", known_clusters: list = [],
+                    reference_labels: np.ndarray = None) -> tuple[pd.core.frame.DataFrame, dict]:
+    """
+        Runs `sweep_labels` and reports for every threshold the number of clusters, the cluster size distribution
+        (see `cluster_size_stats`), the pairwise agreement with the clustering of the previous (higher) threshold and,
+        with `reference_labels` (e.g. the factorized Person_Entity_ID of a production run), with the reference.
+        Returns the report with one row per threshold and a dict threshold -> labels.
+    """
+    reports, labels_per_threshold = [], dict()
+    previous_labels = None
+    for threshold, labels in sweep_labels(graph, thresholds, linkage, known_clusters):
+        report = {"threshold": threshold, "linkage": linkage, **cluster_size_stats(labels)}
+        if previous_labels is not None:
+            report.update({f"previous_{key}": value for key, value in pairwise_agreement(labels, previous_labels).items()})
+        if reference_labels is not None:
+            report.update({f"reference_{key}": value for key, value in pairwise_agreement(labels, reference_labels).items()})
+        reports.append(report)
+        labels_per_threshold[threshold] = labels
+        previous_labels = labels
+    return pd.DataFrame(reports), labels_per_threshold
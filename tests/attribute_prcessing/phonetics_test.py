@@ -0,0 +1,21 @@
+import sys
+sys.path.insert(0, 'src')
+
+import pandas as pd
+from aroa_etl.attribute_processing.phonetics import koelner_phonetik, metaphone, phonetic_codes, add_phonetic_columns, phonetic_column
+
+def test_koelner_phonetik():
+    assert koelner_phonetik("Wikipedia") == "3412"
+    assert koelner_phonetik("Müller-Lüdenscheidt") == "65752682"
+    assert koelner_phonetik("Breschnew") == "17863"
+    assert koelner_phonetik("hans peter") == "068 127", "Sub-names are not encoded separately"
+    assert len({koelner_phonetik(name) for name in ["maier", "meier", "mayr", "meyer"]}) == 1, "Spelling variants differ"
+    assert koelner_phonetik("kowalski") == koelner_phonetik("kovalski")
+    assert koelner_phonetik("schmidt") == koelner_phonetik("schmitt")
+
+def test_phonetic_columns():
+    persons = pd.DataFrame({"strGName_processed": ["hans", "hans", None], "strLName_processed": ["maier", "meier", "kowalski"]})
+    persons = add_phonetic_columns(persons)
+    assert persons[phonetic_column("strLName_processed")].tolist() == ["67", "67", "43584"]
+    assert persons[phonetic_column("strGName_processed")].tolist() == ["068", "068", ""]
+    assert phonetic_codes(pd.Series(["kowalski"]), "metaphone").tolist() == [metaphone("kowalski")]
@@ -0,0 +1,25 @@
+import sys
+sys.path.insert(0, 'src')
+
+import json
+import numpy as np
+from aroa_etl.benchmarks.synthetic import synthetic_persons, umlaut_variant, swap_date, true_pairs
+from aroa_etl.benchmarks.blocking import run_blocking_benchmark
+from aroa_etl.person_matching.blockers import SortedNeighborhoodBlocker
+
+def test_synthetic_persons():
+    persons = synthetic_persons(100, seed=1)
+    assert persons.equals(synthetic_persons(100, seed=1)), "Generator is not reproducible"
+    assert persons.entity_id.nunique() == 100
+    assert umlaut_variant("müller") == "mueller" and umlaut_variant("mueller") == "müller"
+    assert swap_date("19200305", np.random.default_rng(0)) in ["19200503", "05.03.1920"]
+    assert true_pairs(np.array([0, 0, 0, 1, 2, 2])) == 4
+
+def test_blocking_benchmark(tmp_path):
+    configs = {"all": lambda persons: SortedNeighborhoodBlocker(window=persons.shape[0]).fit(persons),
+               "window_2": lambda persons: SortedNeighborhoodBlocker(window=2).fit(persons)}
+    reports = run_blocking_benchmark(configs, n_entities=30, output=tmp_path / "report.json")
+    assert reports[0]["recall"] == 1.0 and reports[0]["pair_reduction_ratio"] == 0.0, "Without blocking all pairs are candidates"
+    assert reports[1]["candidate_pairs"] < reports[0]["candidate_pairs"]
+    assert reports[1]["peak_memory_bytes"] > 0
+    assert json.load(open(tmp_path / "report.json"))["reports"] == reports
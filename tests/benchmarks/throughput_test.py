@@ -0,0 +1,24 @@
+import sys
+sys.path.insert(0, 'src')
+
+import json
+from aroa_etl.benchmarks.synthetic import synthetic_persdata, synthetic_external_list
+from aroa_etl.benchmarks.throughput import run_throughput_benchmark, STAGES
+
+def test_synthetic_persdata():
+    persdata = synthetic_persdata(500, seed=1)
+    assert persdata.equals(synthetic_persdata(500, seed=1)), "Generator is not reproducible"
+    assert {"strLName", "strGName", "strDoB", "strPoB", "prisoner_number", "TD_number"} <= set(persdata.columns)
+    assert persdata.duplicated(["lObjId", "lCountId"]).any(), "No persons with multiple names"
+    external = synthetic_external_list(persdata, 20, seed=1)
+    assert external.shape[0] == 20 and external.entity_id.isin(persdata.entity_id).all()
+
+def test_throughput_benchmark(tmp_path):
+    reports = run_throughput_benchmark(scales=(300,), output=tmp_path / "report.json")
+    assert [report["stage"] for report in reports] == STAGES
+    assert all(report["rows_per_second"] > 0 and report["peak_rss_bytes"] > 0 for report in reports)
+    assert all(report["stage_peak_rss_bytes"] >= report["rss_before_bytes"] > 0 for report in reports), "Stage RSS is not sampled"
+    assert all(report["stage_rss_increase_bytes"] == report["stage_peak_rss_bytes"] - report["rss_before_bytes"] for report in reports)
+    assert json.load(open(tmp_path / "report.json"))["reports"] == reports
+    reports = run_throughput_benchmark(scales=(300,), stages=["group_multiple_names"])
+    assert [report["stage"] for report in reports] == ["group_multiple_names"]
@@ -0,0 +1,80 @@
+import pytest
+import sys
+sys.path.insert(0, 'src')
+
+import numpy as np
+import pandas as pd
+from aroa_etl.person_matching.blockers import Blocker, SortedNeighborhoodBlocker, PhoneticBlocker, name_sort_key
+from aroa_etl.attribute_processing.phonetics import add_phonetic_columns
+from aroa_etl.person_matching.matching import person_matching, PrefixBucketBlocker
+from aroa_etl.person_matching.person_clustering import agglomerative_clustering, BucketCandidates, build_bucket_index
+
+@pytest.fixture
+def person_frame(person_frame):
+    # the persons of the clustering tests and a second "anna" with another last name
+    other_anna = pd.DataFrame({"strGName_processed": ["anna"], "strLName_processed": ["schulz"], "strDoB_processed": ["19211202"],
+                               "prisoner_number": [np.nan]}, index=[2])
+    return lambda: pd.concat([person_frame(), other_anna])
+
+def test_sorted_neighborhood_blocker(person_frame):
+    persons = person_frame()
+    blocker = SortedNeighborhoodBlocker(sort_keys=["name"], window=3).fit(persons)
+    sorted_names = name_sort_key(persons).to_numpy()[blocker.orders[0]]
+    assert list(sorted_names) == sorted(sorted_names), "Persons are not sorted by name"
+    for pos in range(persons.shape[0]):
+        neighbors = blocker.neighbors(pos)
+        assert pos in neighbors and len(neighbors) <= 3, "Window is not centered on the person"
+        assert all(pos in blocker.neighbors(other) for other in neighbors), "Neighborhood is not symmetric"
+    candidates = list(blocker.candidate_positions(persons))
+    assert all(len(positions) == 3 for positions in candidates), "Every source gets a full window"
+    assert set(blocker(4)) == set(persons.index[blocker.neighbors(4)]), "Blocker returns index labels"
+    even_window = SortedNeighborhoodBlocker(sort_keys=["name"], window=4).fit(persons)
+    assert max(len(even_window.neighbors(pos)) for pos in range(persons.shape[0])) == 5, "Target windows have 2 * (window // 2) + 1 rows"
+    with pytest.raises(TypeError):
+        Blocker()
+
+def test_sorted_neighborhood_matching(person_frame):
+    persons = person_frame()
+    full_window = SortedNeighborhoodBlocker(window=persons.shape[0])
+    # a single bucket with all persons
+    no_blocking = PrefixBucketBlocker(trg_pre_clustering_on_n_chars=0, trg_pre_clustering_group_n_len_units=100)
+    expected = person_matching(persons, persons, top_n_matches=2, blocker=no_blocking)
+    pd.testing.assert_frame_equal(person_matching(persons, persons, top_n_matches=2, blocker=full_window), expected)
+    pd.testing.assert_frame_equal(person_matching(persons, persons, top_n_matches=2, blocker=PrefixBucketBlocker()),
+                                  person_matching(persons, persons, top_n_matches=2))
+
+def test_blocker_clustering(person_frame):
+    persons = person_frame()
+    expected = agglomerative_clustering(lambda idx: persons.index, {}, persons.copy(), 80, "average", "fast")
+    clustering = agglomerative_clustering(SortedNeighborhoodBlocker(window=persons.shape[0]), {}, persons.copy(), 80, "average", "fast")
+    assert clustering == expected, "Clustering with a full window differs from the clustering without blocking"
+    candidates = BucketCandidates(persons)
+    assert [list(positions) for positions in candidates.candidate_positions(persons)] == \
+        [list(candidates.positions(pos)) for pos in range(persons.shape[0])], "Bucket candidates of sources differ"
+
+def test_phonetic_blocker(person_frame):
+    persons = add_phonetic_columns(person_frame())
+    blocker = PhoneticBlocker().fit(persons)
+    assert set(blocker(3)) == {3, 5, 8, 9}, "Phonetic variants of the names are not candidates"
+    assert set(blocker(1)) == {1, 4}
+    matchings = person_matching(persons, persons, top_n_matches=10, blocker=PhoneticBlocker())
+    assert set(matchings[matchings.srcID == 8].trgID) == {3, 5, 8, 9}, "Phonetic variants are not matched"
+
+def test_phonetic_buckets(person_frame, tmp_path):
+    persons = person_frame()
+    last_name_index = build_bucket_index(persons, "strLName_processed", phonetic_encoder="koelner")
+    assert set(persons.index[last_name_index[("67", 0)]]) == {3, 5, 8, 9, 7}, "Names are not keyed by their whole code"
+    candidates = BucketCandidates(persons, phonetic_encoder="koelner")
+    assert set(candidates(8)) == {3, 5, 8, 9} and set(candidates(1)) == {1, 4}, "Phonetic variants are not in one bucket"
+    assert set(BucketCandidates(persons)(1)) == {1}
+    clustering = agglomerative_clustering(candidates, {}, persons.copy(), 80, "average", "fast")
+    assert [1, 4] in clustering, "Phonetic variants of the names are not clustered"
+    code_persons = add_phonetic_columns(persons)
+    expected = person_matching(code_persons, code_persons, top_n_matches=10, blocker=PhoneticBlocker())
+    matchings = person_matching(persons, persons, top_n_matches=10, phonetic_encoder="koelner")
+    assert set(matchings[matchings.srcID == 8].trgID) == {3, 5, 8, 9}, "Phonetic variants are not matched"
+    pd.testing.assert_frame_equal(matchings, expected)
+    # stored prefix buckets are not reused for phonetic buckets
+    person_matching(persons, persons, top_n_matches=10, trg_index_dir=str(tmp_path))
+    pd.testing.assert_frame_equal(person_matching(persons, persons, top_n_matches=10, trg_index_dir=str(tmp_path), phonetic_encoder="koelner"),
+                                  expected)
@@ -0,0 +1,17 @@
+import sys
+sys.path.insert(0, 'src')
+
+import pandas as pd
+from aroa_etl.person_matching.clustering_preprocessing import clean_na_values, add_processed_columns, group_multiple_names, FIRST_VALUE_COLUMNS
+from aroa_etl.benchmarks.synthetic import synthetic_persdata
+
+def test_group_multiple_names():
+    person_data = add_processed_columns(clean_na_values(synthetic_persdata(400, na_rate=0.2, seed=2)))
+    grouped = group_multiple_names(person_data)
+    # the former row-wise groupby apply of run_clustering
+    expected = person_data.groupby(["lObjId", "lCountId"])[["strGName_processed", "strLName_processed", *FIRST_VALUE_COLUMNS]].apply(lambda group: [" ".join(group["strGName_processed"].values),
+                                                                               " ".join(group["strLName_processed"].values),
+                                                                               *[group[column].iloc[0] for column in FIRST_VALUE_COLUMNS]])
+    expected = pd.DataFrame(list(expected), columns=["strGName_processed", "strLName_processed", *FIRST_VALUE_COLUMNS], index=expected.index).reset_index()
+    assert grouped["prisoner_number"].isna().any()
+    pd.testing.assert_frame_equal(grouped, expected)
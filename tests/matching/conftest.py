@@ -0,0 +1,34 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+def _person_frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        "strGName_processed": ["hans", "hans peter", "hans", "anna", "ana", "hanz", "peter"],
+        "strLName_processed": ["maier", "maier", "meier", "kovalski", "kovalski", "maier", "maier"],
+        "strDoB_processed": ["19200101", "01.01.1920", "19200110", "19211202", "19210212", "19200101", "19250505"],
+        "prisoner_number": ["123", "123", np.nan, np.nan, "4711", np.nan, np.nan],
+    }, index=[3, 5, 8, 1, 4, 9, 7])
+
+def _matching_person_frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        "strGName_processed": ["hans", "hans peter", "anna", "ana", "", "marie"],
+        "strLName_processed": ["maier", "maier", "kovalski", "kovalski", "schmit", "-1"],
+        "strDoB_processed": ["19200101", "01.01.1920", "19211202", "19210212", "00000000", "nan"],
+        "prisoner_number": ["123", "123", np.nan, "4711", "", "-1"],
+        "strPoB_processed": ["berlin", "", "krakau", "krakov", "hamburg", "berlin"],
+    }, index=[10, 11, 12, 13, 14, 15])
+
+@pytest.fixture
+def person_frame():
+    """
+        Factory of a new frame of processed persons for the clustering and blocking tests, with a non-monotonic index.
+    """
+    return _person_frame
+
+@pytest.fixture
+def matching_person_frame():
+    """
+        Factory of a new frame of processed persons with birthplaces and empty fields for the matching tests.
+    """
+    return _matching_person_frame
@@ -0,0 +1,34 @@
+import pytest
+import sys
+sys.path.insert(0, 'src')
+
+import numpy as np
+import pandas as pd
+from aroa_etl.person_matching.disjoint_set import DisjointSet
+from aroa_etl.person_matching.person_clustering import merged_cluster_column, clean_td_cases
+
+def test_disjoint_set():
+    disjoint_set = DisjointSet(7)
+    disjoint_set.union_clusters([[5, 3], [1, 2]])
+    disjoint_set.union(2, 6)
+    disjoint_set.union_pairs([6], [3])
+    assert disjoint_set.find(5) == disjoint_set.find(1), "Sets are not merged"
+    assert disjoint_set.labels().tolist() == [0, 1, 1, 1, 2, 1, 1], "Labels are not numbered by first position"
+    assert [c.tolist() for c in disjoint_set.clusters()] == [[0], [1, 2, 3, 5, 6], [4]]
+
+def test_merged_cluster_column():
+    person_data = pd.DataFrame({"name": list("abcdef")}, index=[10, 11, 12, 13, 14, 15])
+    pnum_clusters = [[11, 14]]
+    td_clusters = [[14, 12], [15]]
+    clustering = [[10], [11], [12, 13]]
+    cluster_col = merged_cluster_column(person_data, pnum_clusters, td_clusters, clustering)
+    assert cluster_col.tolist() == [0, 1, 1, 1, 1, 2], "Clusters sharing persons are not merged"
+    cluster_col = merged_cluster_column(person_data, [[11, 14]])
+    assert cluster_col.isna().tolist() == [True, False, True, True, False, True], "Unclustered rows are not NA"
+
+def test_clean_td_cases():
+    person_data = pd.DataFrame({"Person_Entity_ID": [5, 5, 2, 7, 7, np.nan], 
+                                "TD_number": [np.nan, "td1", np.nan, "td1", "td1", np.nan]})
+    person_data = clean_td_cases(person_data)
+    assert person_data["Person_Entity_ID"].tolist()[:5] == [1, 2, 0, 2, 2], "TD cases are not clustered by TD number"
+    assert pd.isna(person_data["Person_Entity_ID"].iloc[5])
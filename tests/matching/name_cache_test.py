@@ -0,0 +1,29 @@
+import pytest
+import sys
+sys.path.insert(0, 'src')
+
+from aroa_etl.person_matching.name_cache import name_cache, active_name_cache, NameSimilarityCache
+from aroa_etl.person_matching.similarity_measures import name_matcher, name_set_matcher
+from rapidfuzz import fuzz
+
+def test_name_cache():
+    uncached = [name_set_matcher("muller", "mueller"), name_matcher("anna", "ana")]
+    with name_cache(maxsize=2) as cache:
+        assert active_name_cache() is cache, "Cache is not enabled"
+        cached = [name_set_matcher("muller", "mueller"), name_matcher("anna", "ana")]
+        assert name_set_matcher("mueller", "muller") == uncached[0]
+        assert cache.hits == 1 and cache.misses == 2, "Symmetric pair was not found in the cache"
+        name_matcher("hans", "hanz")
+        assert len(cache) == 2, "Cache is not bounded"
+    assert active_name_cache() is None, "Cache is not disabled after the run"
+    assert cached == uncached, "Cached scores differ"
+
+def test_name_cache_lru():
+    cache = NameSimilarityCache(maxsize=2)
+    cache.score(fuzz.ratio, "a", "b")
+    cache.score(fuzz.ratio, "c", "d")
+    cache.score(fuzz.ratio, "a", "b")
+    cache.score(fuzz.ratio, "e", "f")
+    cache.score(fuzz.ratio, "a", "b")
+    assert cache.stats()["hits"] == 2, "Recently used pair was evicted"
+    assert len(cache) == 2 and cache.stats()["size"] == 2, "Evicted pairs are still held"
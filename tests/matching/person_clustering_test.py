@@ -0,0 +1,167 @@
+import pytest
+import sys
+sys.path.insert(0, 'src')
+
+import numpy as np
+import pandas as pd
+from aroa_etl.person_matching.person_clustering import link_score, local_agglomerative_cluster, BucketSimilarity, export_clustering, agglomerative_clustering, \
+    load_clustering_checkpoint, parallel_agglomerative_clustering, bucket_components, build_buckets, build_name_pair_buckets, \
+    get_buckets_for_name, local_semantic_hashing, batch_local_semantic_hashing, build_bucket_index, build_name_pair_bucket_index, BucketCandidates, \
+    cluster_integrety, cluster_quality_table
+from aroa_etl.person_matching.minhash_signatures import minhash_signatures
+from aroa_etl.person_matching.similarity_measures import person_similarity
+from aroa_etl.person_matching.blockers import SortedNeighborhoodBlocker
+
+def reference_cluster(pre_cluster, person_bucket, cutoff, linkage, link_cascade):
+    # clustering with link_score on the dataframe rows
+    person_cluster = pre_cluster
+    cluster_changed = True
+    while cluster_changed:
+        cluster_changed = False
+        for other_person_idx, other_person in person_bucket.loc[person_bucket.index.difference(person_cluster)].iterrows():
+            if link_score(other_person, person_bucket.loc[person_cluster], linkage) >= cutoff:
+                person_cluster.append(other_person_idx)
+                cluster_changed = link_cascade
+    return person_cluster
+
+@pytest.mark.parametrize("linkage", ["single", "average", "max"])
+@pytest.mark.parametrize("cutoff", [60, 80, 90])
+def test_local_agglomerative_cluster(linkage, cutoff, person_frame):
+    persons = person_frame()
+    for link_cascade in [False, True]:
+        expected = reference_cluster([3], persons, cutoff, linkage, link_cascade)
+        clustered = local_agglomerative_cluster([3], persons, cutoff, linkage, None, link_cascade=link_cascade)
+        assert clustered == expected, f"Cluster differs for {linkage} linkage"
+    assert local_agglomerative_cluster([3], persons, cutoff, linkage, "fast") == reference_cluster([3], persons, cutoff, linkage, False)
+
+def test_bucket_similarity(person_frame):
+    persons = person_frame()
+    expected = np.array([[person_similarity(p1, p2) for _, p2 in persons.iterrows()] for _, p1 in persons.iterrows()])
+    similarity = BucketSimilarity(persons)
+    assert np.allclose(similarity.row(2), expected[2])
+    assert np.allclose(similarity.matrix(), expected), "Similarity matrix differs from person_similarity"
+
+def test_cluster_column(person_frame):
+    persons = person_frame()
+    clustering = [[3, 5, 9], [1, 4], [8], [42]]
+    persons = export_clustering(persons, clustering, size_col="cluster_size")
+    assert persons["Person_Entity_ID"].dtype == "Int64"
+    assert persons["Person_Entity_ID"].tolist()[:6] == [0, 0, 2, 1, 1, 0], "Wrong cluster ids"
+    assert pd.isna(persons["Person_Entity_ID"][7]), "Unclustered rows are not NA"
+    assert persons["cluster_size"].tolist()[:6] == [3, 3, 1, 2, 2, 3], "Wrong cluster sizes"
+
+def test_agglomerative_clustering(person_frame):
+    persons = person_frame()
+    known_clusters = {8: [8, 1], 1: [8, 1]}
+    get_bucket_fn = lambda idx: persons.index
+    clustering = agglomerative_clustering(get_bucket_fn, known_clusters, persons, 80, "max", "fast")
+    assert clustering[0] == [8, 1], "Known clusters are not enumerated first"
+    assert sorted(idx for cluster in clustering for idx in cluster) == sorted(persons.index), "Every person has to be in exactly one cluster"
+    assert [3, 5, 9] in clustering, "Similar persons are not clustered"
+    with pytest.raises(AssertionError, match=r"\[42\]"):
+        agglomerative_clustering(get_bucket_fn, {8: [8, 42]}, person_frame(), 80, "max", "fast")
+
+def test_agglomerative_clustering_resume(tmp_path, person_frame):
+    checkpoint_path = str(tmp_path / "checkpoint.npz")
+    expected = agglomerative_clustering(lambda idx: person_frame().index, {}, person_frame(), 80, "max", "fast")
+    calls = []
+    def crashing_get_bucket_fn(idx):
+        calls.append(idx)
+        if len(calls) > 2:
+            raise RuntimeError("crash")
+        return person_frame().index
+    with pytest.raises(RuntimeError):
+        agglomerative_clustering(crashing_get_bucket_fn, {}, person_frame(), 80, "max", "fast",
+                                 checkpoint_path=checkpoint_path, checkpoint_every_rows=1)
+    assert len(load_clustering_checkpoint(checkpoint_path)["cluster_positions"]) == 2, "Checkpoint was not written"
+    resumed = agglomerative_clustering(lambda idx: person_frame().index, {}, person_frame(), 80, "max", "fast", resume_from=checkpoint_path)
+    assert resumed == expected, "Resumed clustering differs"
+    with pytest.raises(AssertionError):
+        agglomerative_clustering(lambda idx: person_frame().index, {}, person_frame(), 90, "max", "fast", resume_from=checkpoint_path)
+    edited = person_frame()
+    edited.loc[7, "strGName_processed"] = "hans"
+    with pytest.raises(AssertionError):
+        agglomerative_clustering(lambda idx: edited.index, {}, edited, 80, "max", "fast", resume_from=checkpoint_path)
+
+def test_parallel_agglomerative_clustering(person_frame):
+    persons = pd.concat([person_frame()] * 3, ignore_index=True)
+    persons["strGName_processed"] += pd.Series(["", "a", "e"]).repeat(7).values
+    first_name_buckets = build_buckets(persons, "strGName_processed")
+    last_name_buckets = build_buckets(persons, "strLName_processed")
+    def get_bucket_fn(idx):
+        first_bucket = set().union(*[first_name_buckets[b] for b in get_buckets_for_name(persons.at[idx, "strGName_processed"], 3)])
+        last_bucket = set().union(*[last_name_buckets[b] for b in get_buckets_for_name(persons.at[idx, "strLName_processed"], 3)])
+        return first_bucket.intersection(last_bucket)
+    pair_buckets = build_name_pair_buckets(persons)
+    known_clusters = {4: [4, 11], 11: [4, 11]}
+    expected = agglomerative_clustering(get_bucket_fn, {k: list(v) for k, v in known_clusters.items()}, persons.copy(), 70, "average", "fast")
+    clustering = parallel_agglomerative_clustering(get_bucket_fn, known_clusters, persons.copy(), 70, "average", "fast",
+                                                   buckets=[pair_buckets], n_jobs=2, tasks_per_job=2)
+    assert len(set(bucket_components(persons, [pair_buckets]))) > 1, "Test data should have several components"
+    assert clustering == expected, "Parallel clustering differs from the serial clustering"
+    candidates = BucketCandidates(persons)
+    assert all(set(candidates(idx)) == get_bucket_fn(idx) for idx in persons.index), "Bucket index candidates differ"
+    pair_index = build_name_pair_bucket_index(persons)
+    assert np.array_equal(bucket_components(persons, [pair_index]), bucket_components(persons, [pair_buckets])), "Components differ"
+    clustering = parallel_agglomerative_clustering(candidates, known_clusters, persons.copy(), 70, "average", "fast",
+                                                   buckets=[pair_index], n_jobs=2, tasks_per_job=2)
+    assert clustering == expected, "Parallel clustering on bucket indices differs from the serial clustering"
+    expected = agglomerative_clustering(SortedNeighborhoodBlocker(window=1), {k: list(v) for k, v in known_clusters.items()},
+                                        persons.copy(), 70, "average", "fast")
+    blocker = SortedNeighborhoodBlocker(window=1)
+    clustering = parallel_agglomerative_clustering(blocker, known_clusters, persons.copy(), 70, "average", "fast",
+                                                   buckets=[pair_index], n_jobs=2, tasks_per_job=2)
+    assert blocker.is_fitted() and blocker.target_df.shape[0] == persons.shape[0], "Blocker is not fitted on all persons"
+    assert clustering == expected, "Parallel clustering with a blocker differs from the serial clustering"
+
+def test_build_bucket_index(person_frame):
+    persons = person_frame()
+    buckets = build_buckets(persons, "strLName_processed")
+    bucket_index = build_bucket_index(persons, "strLName_processed")
+    assert len(bucket_index) == len(buckets), "Bucket index has other buckets"
+    for bucket_key, members in buckets.items():
+        assert set(persons.index[bucket_index[bucket_key]]) == members, f"Bucket {bucket_key} differs"
+        assert bucket_index[bucket_key].dtype == np.int32, "Postings are not int32"
+
+@pytest.mark.parametrize("leave_one_out_hashing", [False, True])
+def test_minhash_signatures(tmp_path, leave_one_out_hashing, person_frame):
+    persons = person_frame()
+    lsh, minhashes = local_semantic_hashing(persons, {"num_perm": 32}, {"threshold": 0.5, "num_perm": 32}, leave_one_out_hashing)
+    signatures = minhash_signatures(persons, {"num_perm": 32}, leave_one_out_hashing, chunk_size=5)
+    for person_idx in persons.index:
+        assert np.array_equal(signatures[person_idx].hashvalues, minhashes[person_idx].hashvalues), "Signature differs from datasketch"
+    batch_lsh, stored = batch_local_semantic_hashing(persons, {"num_perm": 32}, {"threshold": 0.5, "num_perm": 32}, leave_one_out_hashing,
+                                                    signature_path=tmp_path)
+    _, stored = batch_local_semantic_hashing(persons, {"num_perm": 32}, {"threshold": 0.5, "num_perm": 32}, leave_one_out_hashing,
+                                             signature_path=tmp_path)
+    assert isinstance(stored.signatures, np.memmap), "Stored signatures are not memory-mapped"
+    for person_idx in persons.index:
+        assert sorted(batch_lsh.query(stored[person_idx])) == sorted(lsh.query(minhashes[person_idx])), "LSH buckets differ"
+    _, recomputed = batch_local_semantic_hashing(persons, {"num_perm": 32}, {"threshold": 0.5, "num_perm": 32}, not leave_one_out_hashing,
+                                                 signature_path=tmp_path)
+    assert recomputed.metadata["leave_one_out_hashing"] == (not leave_one_out_hashing), "Signatures of the other hashing mode are reused"
+    persons.loc[3, "strGName_processed"] = "peter"
+    _, recomputed = batch_local_semantic_hashing(persons, {"num_perm": 32}, {"threshold": 0.5, "num_perm": 32}, leave_one_out_hashing,
+                                                 signature_path=tmp_path)
+    assert not isinstance(recomputed.signatures, np.memmap), "Signatures of other names are reused"
+    assert np.array_equal(recomputed[3].hashvalues, minhash_signatures(persons, {"num_perm": 32}, leave_one_out_hashing)[3].hashvalues)
+
+def test_cluster_quality(person_frame):
+    persons = person_frame()
+    cluster = [persons.loc[idx] for idx in [3, 5, 8, 9]]
+    # the former per-linkage scoring with person_similarity
+    others = [np.array([person_similarity(person, other) for j, other in enumerate(cluster) if j != i]) for i, person in enumerate(cluster)]
+    expected = {"average": np.mean([o.mean() for o in others]), "average-link": min(o.mean() for o in others),
+                "single-link": min(o.max() for o in others), "max-link": min(o.min() for o in others)}
+    quality = cluster_integrety(cluster)
+    assert quality.keys() == expected.keys()
+    assert np.allclose([quality[key] for key in expected], list(expected.values()))
+    assert cluster_integrety(persons.loc[[3, 5, 8, 9]]) == quality
+    assert cluster_integrety([persons.loc[7]])["max-link"] == 100
+    clustering = [[3, 5, 8, 9], [1, 4], [7]]
+    table = cluster_quality_table(persons, clustering)
+    assert table["size"].tolist() == [4, 2, 1]
+    assert np.isclose(table.loc[0, "max-link"], quality["max-link"]) and table.loc[2, "average"] == 100
+    assert table.equals(cluster_quality_table(persons, clustering, n_jobs=2))
+    persons = export_clustering(persons, clustering)
+    pd.testing.assert_frame_equal(table, cluster_quality_table(persons), check_dtype=False)
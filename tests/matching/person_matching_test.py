@@ -0,0 +1,161 @@
+import pytest
+import sys
+sys.path.insert(0, 'src')
+
+import numpy as np
+import pandas as pd
+from aroa_etl.person_matching.similarity_measures import person_similarity, date_similarity, batch_person_similarity, batch_date_similarity, \
+    parse_dates, parsed_date_similarity, add_parsed_date_columns, bounded_person_similarity, SimilarityModel
+from aroa_etl.person_matching.matching import person_matching, person_matching_stream, compute_trg_buckets, load_or_compute_trg_buckets
+from aroa_etl.person_matching.blocking import BlockingIndex, build_blocking_index, birth_year_band_codes
+from aroa_etl.person_matching.name_cache import name_cache
+
+def test_batch_date_similarity():
+    dates = ["19200101", "01.01.1920", "19201101", "19200111", "00000000", "19200100", "1920", "nan"]
+    expected = np.array([[date_similarity(d1, d2) for d2 in dates] for d1 in dates])
+    assert np.array_equal(batch_date_similarity(dates, dates), expected), "Batch date scores differ from date_similarity"
+    parsed = parse_dates(dates)
+    assert parsed[0].dtype == np.int16 and parsed[1].dtype == np.int8, "Parsed dates are not compact"
+    assert np.array_equal(batch_date_similarity(parsed, parsed), expected), "Scores on parsed dates differ from date_similarity"
+    parsed_expected = np.array([[parsed_date_similarity(*[a[i] for a in parsed], *[a[j] for a in parsed]) for j in range(len(dates))] 
+                                for i in range(len(dates))])
+    assert np.array_equal(parsed_expected, expected), "Scalar scores on parsed dates differ from date_similarity"
+
+def test_batch_person_similarity(matching_person_frame):
+    persons = matching_person_frame()
+    expected = np.array([[person_similarity(p1, p2) for _, p2 in persons.iterrows()] for _, p1 in persons.iterrows()])
+    assert np.allclose(batch_person_similarity(persons, persons), expected), "Batch scores differ from person_similarity"
+    parsed_persons = add_parsed_date_columns(persons.copy())
+    parsed_expected = np.array([[person_similarity(p1, p2) for _, p2 in parsed_persons.iterrows()] for _, p1 in parsed_persons.iterrows()])
+    assert np.allclose(parsed_expected, expected), "Scores with parsed date columns differ"
+    assert np.allclose(batch_person_similarity(parsed_persons, parsed_persons), expected), "Batch scores with parsed date columns differ"
+    expected = np.array([[person_similarity(p1, p2, name_only=True) for _, p2 in persons.iterrows()] for _, p1 in persons.iterrows()])
+    assert np.allclose(batch_person_similarity(persons, persons, name_only=True), expected), "Batch name scores differ from person_similarity"
+
+def test_person_matching(matching_person_frame):
+    persons = matching_person_frame().reset_index(drop=True)
+    matchings = person_matching(persons.iloc[[0, 2]], persons, top_n_matches=2, min_match_score=50.0)
+    assert matchings[matchings.srcID == 0].trgID.tolist() == [1, 0], "Best matches are not ranked by score"
+    assert matchings[matchings.srcID == 2].trgID.tolist() == [2], "Persons in other buckets should not be matched"
+
+def test_person_matching_empty_target(matching_person_frame):
+    persons = matching_person_frame().reset_index(drop=True)
+    assert len(build_blocking_index(pd.Series([], dtype=str), lambda name: [(name[:2], 0)])) == 0
+    matchings = person_matching(persons.iloc[[0, 2]], persons.iloc[:0])
+    assert matchings.srcID.tolist() == [0, 2] and matchings.score.tolist() == [-1, -1], "Unmatched sources are missing"
+    assert matchings.trgID.isna().all()
+    streamed = pd.concat(person_matching_stream(persons.iloc[[0]], iter([persons.iloc[:0], persons.iloc[:2]])))
+    assert streamed.trgID.tolist() == [0], "Empty batch breaks the stream"
+
+def test_parallel_person_matching(matching_person_frame):
+    persons = matching_person_frame().reset_index(drop=True)
+    sequential = person_matching(persons, persons, top_n_matches=3)
+    parallel = person_matching(persons, persons, top_n_matches=3, n_jobs=2)
+    pd.testing.assert_frame_equal(sequential, parallel)
+
+def test_blocking_index(tmp_path, matching_person_frame):
+    persons = matching_person_frame()
+    fname_buckets, lname_buckets = compute_trg_buckets(persons, "strGName_processed", "strLName_processed")
+    assert fname_buckets[("ha", 1)].tolist() == [0, 1], "Bucket does not contain row positions"
+    assert fname_buckets.lookup([("ha", 1), ("pe", 1)]).tolist() == [0, 1], "Buckets are not merged"
+    assert lname_buckets[("xy", 1)].tolist() == [], "Unknown bucket is not empty"
+    fname_buckets, lname_buckets = load_or_compute_trg_buckets(tmp_path, persons, "strGName_processed", "strLName_processed")
+    stored_fname_buckets, _ = load_or_compute_trg_buckets(tmp_path, persons, "strGName_processed", "strLName_processed")
+    assert isinstance(stored_fname_buckets.row_ids, np.memmap), "Stored index is not memory-mapped"
+    assert np.array_equal(stored_fname_buckets.row_ids, fname_buckets.row_ids), "Stored index differs"
+    persons.loc[10, "strGName_processed"] = "peter"
+    with pytest.raises(AssertionError):
+        BlockingIndex.load(tmp_path / "first_name", expected_metadata=compute_trg_buckets(persons, "strGName_processed", "strLName_processed")[0].metadata)
+
+def test_person_matching_stream(matching_person_frame):
+    persons = matching_person_frame().reset_index(drop=True)
+    target_batches = [persons.iloc[:3], persons.iloc[3:]]
+    expected = person_matching(persons, persons, top_n_matches=2)
+    streamed = pd.concat(person_matching_stream(persons, iter(target_batches), target_columns=["strGName_processed"],
+                                                top_n_matches=2, emit_chunk_size=4))
+    assert streamed.shape[0] == expected.shape[0], "Streamed matching has a different size"
+    assert streamed.srcID.tolist() == expected.srcID.tolist()
+    assert np.allclose(streamed.score, expected.score), "Streamed matching has different scores"
+    matched = streamed.trgID.notna()
+    assert streamed.trgID[matched].tolist() == expected.trgID[matched.values].tolist(), "Streamed matching has different matches"
+    assert streamed.strGName_processed[matched].tolist() == persons.strGName_processed[streamed.trgID[matched]].tolist()
+
+def test_bucket_guardrails():
+    names = pd.Series(["schmidt"] * 6 + ["schulz", "maier"])
+    bucket_index = build_blocking_index(names, lambda name: [(name[:2], 0)])
+    assert bucket_index.bucket_stats(max_bucket_size=3)["oversized_pairs"] == 21
+    years = np.array([1920, 1921, 1935, -1, 1936, 1920, 1920, 1950])
+    refined = bucket_index.refine(3, birth_year_band_codes(years))
+    assert refined.lookup([("sc", 0)], birth_year_band_codes([1922])[0]).tolist() == [0, 1, 3, 5, 6], "Sub-block or unknown rows missing"
+    assert refined.lookup([("sc", 0)]).tolist() == list(range(7)), "Unknown sub-block code should get the whole bucket"
+    assert refined.refinement["pairs_after"] == 6 + 1 + 6, "Pairs after refinement are miscounted"
+    skipped = bucket_index.refine(3)
+    assert skipped.lookup([("sc", 0)]).tolist() == [] and skipped.lookup([("ma", 0)]).tolist() == [7], "Oversized bucket not skipped"
+    assert skipped.refinement["skipped_pairs"] == 21
+
+def test_person_matching_guardrails(matching_person_frame):
+    persons = matching_person_frame().reset_index(drop=True)
+    expected = person_matching(persons, persons, top_n_matches=2)
+    refined = person_matching(persons, persons, top_n_matches=2, max_bucket_size=1)
+    pd.testing.assert_frame_equal(refined, expected)
+    skipped = person_matching(persons, persons, top_n_matches=2, max_bucket_size=1, sub_blocking=None)
+    assert skipped[skipped.srcID == 0].score.tolist() == [-1], "Oversized buckets are not skipped"
+
+@pytest.mark.parametrize("name_only", [False, True])
+def test_bounded_person_similarity(name_only, matching_person_frame):
+    persons = matching_person_frame()
+    parsed_persons = add_parsed_date_columns(matching_person_frame())
+    for p1 in [*persons.iloc, *parsed_persons.iloc]:
+        for p2 in persons.iloc if "strDoB_processed_year" not in p1 else parsed_persons.iloc:
+            score = person_similarity(p1, p2, name_only=name_only)
+            for threshold in [0, 20, 50, score, 75, 90, 100]:
+                bounded_score = bounded_person_similarity(p1, p2, threshold, name_only=name_only)
+                if score >= threshold:
+                    assert np.isclose(bounded_score, score), f"Bounded score differs for threshold {threshold}"
+                else:
+                    assert bounded_score < threshold, f"Bounded score reaches threshold {threshold}"
+    with name_cache():
+        assert bounded_person_similarity(persons.loc[10], persons.loc[11], 0) == person_similarity(persons.loc[10], persons.loc[11])
+
+@pytest.mark.parametrize("parsed", [False, True])
+def test_similarity_model(parsed, matching_person_frame):
+    persons = add_parsed_date_columns(matching_person_frame()) if parsed else matching_person_frame()
+    expected = np.array([[person_similarity(p1, p2) for _, p2 in persons.iterrows()] for _, p1 in persons.iterrows()])
+    model = SimilarityModel().compile(persons.columns)
+    rows = list(persons.itertuples(index=False, name=None))
+    assert np.allclose([[model.score(r1, r2) for r2 in rows] for r1 in rows], expected), "Scalar scores differ from person_similarity"
+    assert np.allclose(model.matrix(persons, persons), expected), "Matrix scores differ from person_similarity"
+    src_pos, trg_pos = np.repeat(np.arange(6), 6), np.tile(np.arange(6), 6)
+    assert np.allclose(model.batch(persons.iloc[src_pos], persons.iloc[trg_pos]), expected.ravel()), "Batch scores differ from person_similarity"
+    # frames with other columns than the compiled ones are resolved again
+    reordered = persons[persons.columns[::-1]]
+    assert np.allclose(model.matrix(reordered, reordered), expected), "Scores of reordered columns differ"
+    assert np.allclose(model.batch(persons.iloc[src_pos], reordered.iloc[trg_pos]), expected.ravel())
+    assert np.allclose(batch_person_similarity(reordered, persons), expected)
+    # optional fields and other weights
+    names_only = persons[["strGName_processed", "strLName_processed", "strDoB_processed"]]
+    expected = batch_person_similarity(names_only, names_only, name_only=True)
+    assert np.allclose(SimilarityModel(name_only=True).matrix(names_only, names_only), expected)
+    model = SimilarityModel(src_birthplace=None, secundary_weight=0.5).compile(persons.columns)
+    scores = model.matrix(persons, persons)
+    primary = batch_person_similarity(persons, persons, name_only=True)
+    # without names, person_similarity weights the secondary score with 1/3
+    secundary = 3 * batch_person_similarity(persons[["prisoner_number", "strDoB_processed"]], persons[["prisoner_number", "strDoB_processed"]])
+    assert np.allclose(scores, 0.5 * primary + 0.5 * secundary), "Weights are not applied"
+    assert np.isclose(model.score(rows[0], rows[1]), scores[0, 1])
+
+@pytest.mark.parametrize("name_only", [False, True])
+def test_similarity_score_cutoff(name_only, matching_person_frame):
+    persons = matching_person_frame()
+    model = SimilarityModel(name_only=name_only)
+    expected = model.matrix(persons, persons)
+    src_pos, trg_pos = np.repeat(np.arange(6), 6), np.tile(np.arange(6), 6)
+    for threshold in [20, 50, 75, 90, 100, *np.unique(expected)]:
+        for scores in [model.matrix(persons, persons, threshold),
+                       model.batch(persons.iloc[src_pos], persons.iloc[trg_pos], threshold).reshape(6, 6),
+                       batch_person_similarity(persons, persons, name_only=name_only, score_cutoff=threshold)]:
+            reached = expected >= threshold
+            assert np.allclose(scores[reached], expected[reached]), f"Scores differ at threshold {threshold}"
+            assert (scores[~reached] < threshold).all(), f"Scores reach threshold {threshold}"
+    matchings = person_matching(persons, persons, top_n_matches=3, min_match_score=60.0)
+    assert (matchings.score[matchings.trgID.notna()] >= 60).all()
@@ -0,0 +1,29 @@
+import pytest
+import sys
+sys.path.insert(0, 'src')
+
+import numpy as np
+from aroa_etl.person_matching.ranking import TopNCollector
+
+def test_top_n_collector():
+    rng = np.random.default_rng(0)
+    scores = rng.integers(0, 10, 200).astype(float)
+    items = np.arange(200)
+    # best scores first, earlier items win ties
+    expected = sorted(zip(scores, items), key=lambda entry: (-entry[0], entry[1]))
+    expected = [(score, item) for score, item in expected if score >= 3][:7][::-1]
+    collector = TopNCollector(7, min_score=3)
+    for score, item in zip(scores, items):
+        collector.add(score, item)
+    assert collector.result() == expected, "Single additions do not select the top n"
+    batch_collector = TopNCollector(7, min_score=3)
+    batch_collector.add_batch(scores[:50], items[:50])
+    batch_collector.add_batch(scores[50:], items[50:])
+    assert batch_collector.result() == expected, "Batch additions do not select the top n"
+
+def test_top_n_collector_min_score():
+    collector = TopNCollector(3, min_score=50)
+    for score, item in [(60, "a"), (70, "b"), (40, "c")]:
+        collector.add(score, item)
+    assert collector.result() == [(60, "a"), (70, "b")], "Scores below min_score must not be collected"
+    assert collector.min_accepted_score() == 50
@@ -0,0 +1,70 @@
+import pytest
+import sys
+sys.path.insert(0, 'src')
+
+import numpy as np
+import pandas as pd
+from aroa_etl.person_matching.similarity_graph import EdgeWriter, SimilarityGraph, read_edges, read_edge_metadata, \
+    edges_match, score_candidate_edges
+from aroa_etl.person_matching.person_clustering import agglomerative_clustering, graph_agglomerative_clustering, \
+    preprocess_clustering_data, BucketCandidates
+from aroa_etl.person_matching.matching import person_matching
+from aroa_etl.person_matching.blockers import SortedNeighborhoodBlocker
+from aroa_etl.person_matching.similarity_measures import batch_person_similarity
+
+def test_edge_writer(tmp_path):
+    with EdgeWriter(tmp_path, chunk_size=3) as edge_writer:
+        edge_writer.add(0, [1, 2], [90.0, 50.0])
+        edge_writer.add([1, 2], [2, 3], [70.0, 20.0])
+        edge_writer.add(1, [0], [10.0])
+    assert edge_writer.num_chunks == 2 and edge_writer.num_edges == 5
+    src, dst, score = read_edges(tmp_path)
+    assert src.dtype == np.int32 and dst.dtype == np.int32 and score.dtype == np.float32
+    assert src.tolist() == [0, 0, 1, 2, 1] and dst.tolist() == [1, 2, 2, 3, 0]
+    graph = SimilarityGraph(src, dst, score)
+    assert graph.num_edges == 4, "Edges in both directions are one edge"
+    assert graph.similarity_row(0, np.arange(4)).tolist() == [100, 90, 50, 0], "Pairs keep their highest score"
+    assert graph.similarity_row(1, np.array([3])).tolist() == [0], "Missing edges score 0"
+
+@pytest.mark.parametrize("linkage", ["max", "single", "average"])
+def test_graph_agglomerative_clustering(tmp_path, linkage, person_frame):
+    persons = person_frame()
+    blocker = BucketCandidates(persons, idx_chars=2)
+    score_candidate_edges(persons, blocker, tmp_path, verbose=False)
+    graph = SimilarityGraph.load(tmp_path, num_rows=persons.shape[0])
+    assert 0 < graph.num_edges < persons.shape[0] * (persons.shape[0] - 1) // 2, "The blocker does not split the persons into buckets"
+    for cutoff in [70, 80, 90]:
+        expected = agglomerative_clustering(blocker, {}, person_frame(), cutoff, linkage, "fast")
+        assert graph_agglomerative_clustering(graph, {}, person_frame(), cutoff, linkage) == expected
+
+def test_person_matching_edges(tmp_path, person_frame):
+    persons = person_frame()
+    matching = person_matching(persons, persons, trg_pre_clustering_on_n_chars=1, edge_path=tmp_path / "sequential")
+    src, dst, score = read_edges(tmp_path / "sequential")
+    assert np.allclose(score, batch_person_similarity(persons, persons)[src, dst])
+    best = pd.DataFrame({"src": src, "score": score}).groupby("src")["score"].max()
+    assert np.allclose(best.to_numpy(), matching.groupby("srcID")["score"].max().loc[persons.index[best.index]].to_numpy())
+    person_matching(persons, persons, trg_pre_clustering_on_n_chars=1, n_jobs=2, shards_per_job=2, edge_path=tmp_path / "parallel")
+    parallel_edges = read_edges(tmp_path / "parallel")
+    order, parallel_order = np.lexsort((dst, src)), np.lexsort(parallel_edges[:2][::-1])
+    for column, parallel_column in zip((src, dst, score), parallel_edges):
+        assert np.array_equal(column[order], parallel_column[parallel_order]), "Parallel shards write other edges"
+    assert read_edge_metadata(tmp_path / "sequential")[0]["bipartite"], "Matching edges are not marked as bipartite"
+    with pytest.raises(AssertionError):
+        SimilarityGraph.load(tmp_path / "sequential")
+
+def test_score_candidate_edges(tmp_path, person_frame):
+    persons = person_frame()
+    blocker = SortedNeighborhoodBlocker(window=2 * persons.shape[0])
+    score_candidate_edges(persons, blocker, tmp_path / "edges", chunk_size=2, metadata={"fingerprint": "a"}, verbose=False)
+    assert persons.equals(person_frame()), "The names of the input are preprocessed in place"
+    graph = SimilarityGraph.load(tmp_path / "edges", num_rows=persons.shape[0])
+    assert graph.num_edges == persons.shape[0] * (persons.shape[0] - 1) // 2, "A full window does not score every pair"
+    src, dst, score = graph.edges()
+    preprocessed = preprocess_clustering_data(person_frame())
+    assert np.allclose(score, batch_person_similarity(preprocessed, preprocessed)[src, dst]), "Edges are not scored on the preprocessed names"
+    assert edges_match(tmp_path / "edges", {"fingerprint": "a"}) and not edges_match(tmp_path / "edges", {"fingerprint": "b"})
+    assert not edges_match(tmp_path / "missing", {"fingerprint": "a"})
+    # a new run replaces all chunks of the earlier run
+    score_candidate_edges(persons.iloc[:2], SortedNeighborhoodBlocker(window=4), tmp_path / "edges", chunk_size=2, verbose=False)
+    assert read_edges(tmp_path / "edges")[0].shape[0] == 1 and not edges_match(tmp_path / "edges", {"fingerprint": "a"})
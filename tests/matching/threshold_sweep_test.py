@@ -0,0 +1,48 @@
+import pytest
+import sys
+sys.path.insert(0, 'src')
+
+import numpy as np
+from aroa_etl.person_matching.disjoint_set import DisjointSet
+from aroa_etl.person_matching.similarity_graph import SimilarityGraph
+from aroa_etl.person_matching.threshold_sweep import sweep_labels, threshold_sweep, pairwise_agreement, cluster_size_stats
+
+def small_graph():
+    # (src, dst, score)
+    edges = [(0, 1, 95), (1, 2, 85), (0, 2, 75), (3, 4, 90), (2, 3, 70), (4, 5, 60)]
+    return SimilarityGraph(*np.array(edges).T, num_rows=7)
+
+def test_single_linkage_sweep():
+    graph = small_graph()
+    rng = np.random.default_rng(0)
+    src, dst = rng.integers(0, 200, 500), rng.integers(0, 200, 500)
+    random_graph = SimilarityGraph(src, dst, rng.uniform(0, 100, 500), num_rows=200)
+    for threshold, labels in sweep_labels(random_graph, [90, 50, 70, 20]):
+        # connected components of the edges above the threshold
+        disjoint_set = DisjointSet(200)
+        edge_src, edge_dst, edge_score = random_graph.edges()
+        disjoint_set.union_pairs(edge_src[edge_score >= threshold], edge_dst[edge_score >= threshold])
+        assert np.array_equal(labels, disjoint_set.labels()), f"Single linkage differs at threshold {threshold}"
+    labels = dict(sweep_labels(graph, [90, 80, 50], known_clusters=[[5, 6]]))
+    assert labels[90].tolist() == [0, 0, 1, 2, 2, 3, 3]
+    assert labels[80].tolist() == [0, 0, 0, 1, 1, 2, 2]
+    assert labels[50].tolist() == [0] * 7
+
+def test_linkage_sweep():
+    graph = small_graph()
+    labels = dict(sweep_labels(graph, [90, 80, 74], linkage="max"))
+    assert labels[80].tolist() == [0, 0, 1, 2, 2, 3, 4], "Max linkage needs all pairs above the threshold"
+    assert labels[74].tolist() == [0, 0, 0, 1, 1, 2, 3]
+    labels = dict(sweep_labels(graph, [90, 80, 40], linkage="average"))
+    assert labels[80].tolist() == [0, 0, 1, 2, 2, 3, 4], "Average of 85 and a missing pair is below 80"
+    # {0, 1, 2} and {3, 4}: a single edge of 70 in six pairs
+    assert labels[40].tolist() == [0, 0, 0, 1, 1, 2, 3]
+
+def test_threshold_sweep_report():
+    assert pairwise_agreement([0, 0, 1, 1], [0, 0, 0, 1]) == {"pairwise_precision": 0.5, "pairwise_recall": 1 / 3, "pairwise_f1": 0.4}
+    assert cluster_size_stats(np.array([0, 0, 0, 1, 2]))["singletons"] == 2
+    report, labels = threshold_sweep(small_graph(), [80, 90], reference_labels=np.array([0, 0, 0, 1, 1, 2, 3]))
+    assert report["threshold"].tolist() == [90, 80] and report["clusters"].tolist() == [5, 4]
+    assert report.loc[1, "previous_pairwise_recall"] == 1.0, "Single linkage clusters only grow"
+    assert report.loc[1, "reference_pairwise_f1"] == 1.0
+    assert np.isnan(report.loc[0, "previous_pairwise_f1"])